@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+# Compares the old substring-chain MQTT routing with the TopicDispatcher by
+# replaying the retained Homie topics of a fleet of zwave-socat-node devices.
+#
+#   python benchmarks/dispatch_benchmark.py --nodes 50 --rounds 200
+#   mosquitto_sub -v -t 'devices/#' -W 2 > dump.txt; python benchmarks/dispatch_benchmark.py --replay dump.txt
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "zwave-socat-controller"))
+from lib.topicDispatcher import TopicDispatcher
+
+
+class Message(object):
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+def homie_topics(prefix, nodes):
+    messages = []
+    for number in range(1, nodes + 1):
+        name = "zwave" if number == 1 else "zwave{}".format(number)
+        base = "{}/{}/".format(prefix, name)
+        for attribute, payload in (("$homie", "2.0.0"), ("$name", name), ("$fwname", "zwave-socat-node"),
+                                   ("$fwversion", "1.0.0"), ("$online", "true"), ("$localip", "192.168.1.{}".format(number)),
+                                   ("$mac", "5C:CF:7F:00:00:{:02X}".format(number % 256)), ("$stats/uptime", "3600"),
+                                   ("$stats/signal", "74"), ("$stats/interval", "60"), ("$implementation", "esp8266"),
+                                   ("socat/$type", "socat"), ("socat/$properties", "port,status"),
+                                   ("socat/port", "3333"), ("socat/status", "true"),
+                                   ("time/$type", "time"), ("time/last_report", str(int(time.time())))):
+            messages.append(Message(base + attribute, payload))
+    return messages
+
+
+def load_replay(path):
+    messages = []
+    with open(path) as f:
+        for line in f:
+            topic, _, payload = line.rstrip("\n").partition(" ")
+            messages.append(Message(topic, payload))
+    return messages
+
+
+class SubstringRouter(object):
+    # The routing of NodeController.message_handler and Node.mqtt_message_handler before the dispatcher
+
+    def __init__(self, prefix, names):
+        self.prefix = prefix
+        self.detected_nodes = {}
+        self.nodes = dict((name, {}) for name in names)
+
+    def controller_handler(self, msg):
+        if "$fwname" in msg.topic and "zwave-socat-node" in msg.payload:
+            node_name = msg.topic.replace(self.prefix + "/", "").replace("/$fwname", "")
+            if node_name not in self.detected_nodes: self.detected_nodes[node_name] = {"binding": node_name}
+        if "time/last_report" in msg.topic:
+            node_name = msg.topic.replace(self.prefix + "/", "").replace("/time/last_report", "")
+            if node_name in self.detected_nodes: self.detected_nodes[node_name]["last_update"] = int(msg.payload)
+
+    def node_handler(self, node, msg):
+        if "$online" in msg.topic: node["online"] = msg.payload
+        if "$localip" in msg.topic: node["remote_ip"] = msg.payload
+        if "socat/port" in msg.topic: node["remote_port"] = msg.payload
+        if "socat/status" in msg.topic: node["remote_socat_status"] = msg.payload
+
+    def prepare(self, messages):
+        # The broker did the fan-out to the per-node clients, so it is left out of the measurement
+        deliveries = []
+        for msg in messages:
+            to_controller = msg.topic.endswith("/$fwname") or msg.topic.endswith("/time/last_report")
+            deliveries.append((msg, to_controller, self.nodes.get(msg.topic.split("/")[len(self.prefix.split("/"))])))
+        return deliveries
+
+    def route(self, delivery):
+        msg, to_controller, node = delivery
+        if to_controller:
+            self.controller_handler(msg)
+        if node is not None:
+            self.node_handler(node, msg)
+
+
+class DispatcherRouter(object):
+
+    def __init__(self, prefix, names):
+        self.prefix = prefix
+        self.detected_nodes = {}
+        self.nodes = {}
+        self.dispatcher = TopicDispatcher(prefix)
+        self.dispatcher.add_handler("+", "$fwname", self.handle_fwname)
+        self.dispatcher.add_handler("+", "time/last_report", self.handle_last_report)
+        for name in names:
+            node = self.nodes[name] = {}
+            self.dispatcher.add_handler(name, "$online", lambda n, p, node=node: node.__setitem__("online", p))
+            self.dispatcher.add_handler(name, "$localip", lambda n, p, node=node: node.__setitem__("remote_ip", p))
+            self.dispatcher.add_handler(name, "socat/port", lambda n, p, node=node: node.__setitem__("remote_port", p))
+            self.dispatcher.add_handler(name, "socat/status", lambda n, p, node=node: node.__setitem__("remote_socat_status", p))
+
+    def handle_fwname(self, node_name, payload):
+        if "zwave-socat-node" in payload and node_name not in self.detected_nodes:
+            self.detected_nodes[node_name] = {"binding": node_name}
+
+    def handle_last_report(self, node_name, payload):
+        if node_name in self.detected_nodes:
+            self.detected_nodes[node_name]["last_update"] = int(payload)
+
+    def prepare(self, messages):
+        # The session only subscribes to the topics that have a handler, the broker drops the rest
+        attributes = ("$fwname", "time/last_report", "$online", "$localip", "socat/port", "socat/status")
+        return [msg for msg in messages if msg.topic.split("/", len(self.prefix.split("/")) + 1)[-1] in attributes]
+
+    def route(self, msg):
+        self.dispatcher.dispatch(msg.topic, msg.payload)
+
+
+# Throughput is counted in replayed messages, whatever each design ends up delivering to Python
+def run(router, messages, rounds):
+    deliveries = router.prepare(messages)
+    start = time.time()
+    for _ in range(rounds):
+        for delivery in deliveries:
+            router.route(delivery)
+    elapsed = time.time() - start
+    return len(messages) * rounds / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MQTT topic routing micro-benchmark")
+    parser.add_argument("--prefix", default="devices")
+    parser.add_argument("--nodes", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--replay", help="file with one 'topic payload' line per retained message")
+    args = parser.parse_args()
+
+    messages = load_replay(args.replay) if args.replay else homie_topics(args.prefix, args.nodes)
+    names = set(msg.topic.split("/")[len(args.prefix.split("/"))] for msg in messages
+                if msg.topic.startswith(args.prefix + "/"))
+
+    before = run(SubstringRouter(args.prefix, names), messages, args.rounds)
+    after = run(DispatcherRouter(args.prefix, names), messages, args.rounds)
+    print("{} retained messages x {} rounds, {} nodes".format(len(messages), args.rounds, len(names)))
+    print("substring chain : {:>12,.0f} msg/s".format(before))
+    print("topic dispatcher: {:>12,.0f} msg/s ({:.2f}x)".format(after, after / before))
+
+
+if __name__ == '__main__':
+    main()
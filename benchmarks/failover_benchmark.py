@@ -0,0 +1,411 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+# Drives NodeController, Node and OpenHABHandler against local stand-ins (MQTT broker, OSGi console,
+# HTTP catalog and TCP echo nodes) and reports the latency percentiles and throughput of each scenario.
+#
+#   python benchmarks/failover_benchmark.py --nodes 4 --cycles 3
+#   python benchmarks/failover_benchmark.py --scenarios discovery,failover --json after.json --compare before.json
+import os
+import sys
+import imp
+import json
+import math
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+
+BENCHMARKS_FOLDER = os.path.dirname(os.path.realpath(__file__))
+CONTROLLER_FOLDER = os.path.join(BENCHMARKS_FOLDER, "..", "zwave-socat-controller")
+sys.path.insert(0, CONTROLLER_FOLDER)
+from standins import MqttBroker, FakeOSGiConsole, CatalogServer, EchoNode, SimulatedNode
+
+SCENARIOS = ["discovery", "mqtt", "failover", "link", "restart", "flap"]
+
+OPENHAB_CONFIGURATION = """################################### Z-Wave Binding ####################################
+#
+# The Z-Wave controller port. Valid values are e.g. COM1 for Windows and /dev/ttyS0 or
+# /dev/ttyUSB0 for Linux
+# zwave:port=
+
+################################ Nikobus Binding ######################################
+"""
+DEFAULT_FILE = 'USER_AND_GROUP=openhab:openhab\nJAVA_ARGS="-Djava.net.preferIPv4Stack=true"\n'
+LOGBACK_FILE = '<configuration>\n\t<logger name="runtime.busevents" level="INFO" additivity="false">\n\t</logger>\n' \
+               '\t<logger name="org.openhab" level="{}"{}/>\n</configuration>\n'
+
+
+def load_controller():
+    # The script is not a module, it is loaded by path like "python zwave-socat-controller.py" would
+    return imp.load_source("controller", os.path.join(CONTROLLER_FOLDER, "zwave-socat-controller.py"))
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    # Nearest rank, the p99 of 100 samples is the 99th and not the maximum
+    return ordered[max(0, int(math.ceil(fraction * len(ordered))) - 1)]
+
+
+def wait_all(predicates, start_time, timeout, interval=0.002):
+    # Polls every predicate in the same loop, so each one gets its own first-true time
+    elapsed = dict((name, None) for name in predicates)
+    deadline = start_time + timeout
+    while time.time() < deadline and None in elapsed.values():
+        for name, predicate in predicates.items():
+            if elapsed[name] is None and predicate():
+                elapsed[name] = time.time() - start_time
+        time.sleep(interval)
+    return elapsed
+
+
+def get_histogram_counts(histogram):
+    with histogram.lock:
+        values = [list(counts) for counts, _ in histogram.values.values()]
+    return [sum(column) for column in zip(*values)] if values else [0] * (len(histogram.buckets) + 1)
+
+
+# Upper bucket bounds of the observations made between two snapshots
+def get_histogram_percentiles(histogram, before, after, fractions=(0.5, 0.9, 0.99)):
+    counts = [new - old for old, new in zip(before, after)]
+    total = sum(counts)
+    bounds = list(histogram.buckets) + [float("inf")]
+    results = []
+    for fraction in fractions:
+        cumulative = 0
+        for bound, count in zip(bounds, counts):
+            cumulative += count
+            if total and cumulative >= fraction * total:
+                results.append(bound)
+                break
+        else:
+            results.append(None)
+    return total, results
+
+
+class Report(object):
+
+    def __init__(self):
+        self.rows = []
+
+    def add_samples(self, scenario, metric, samples, timeouts=0):
+        samples = [sample for sample in samples if sample is not None]
+        row = {"scenario": scenario, "metric": metric, "n": len(samples), "timeouts": timeouts}
+        if samples:
+            row.update({"p50": percentile(samples, 0.5), "p90": percentile(samples, 0.9),
+                        "p99": percentile(samples, 0.99), "max": max(samples)})
+        self.rows.append(row)
+
+    def add_value(self, scenario, metric, value, unit=""):
+        self.rows.append({"scenario": scenario, "metric": metric, "value": value, "unit": unit})
+
+    def add_histogram(self, scenario, metric, histogram, before, after):
+        total, (p50, p90, p99) = get_histogram_percentiles(histogram, before, after)
+        self.rows.append({"scenario": scenario, "metric": metric + " (bucket bound)", "n": total, "timeouts": 0,
+                          "p50": p50, "p90": p90, "p99": p99, "max": None})
+
+    def get_results(self):
+        return dict(("{}/{}".format(row["scenario"], row["metric"]), row) for row in self.rows)
+
+    def show(self, baseline=None):
+        def format_time(value):
+            if value is None:
+                return "-"
+            return "{:.1f}ms".format(value * 1000) if value < 1 else "{:.2f}s".format(value)
+
+        print("{:<10} {:<44} {:>5} {:>10} {:>10} {:>10} {:>10}".format("scenario", "metric", "n", "p50", "p90", "p99", "max"))
+        for row in self.rows:
+            key = "{}/{}".format(row["scenario"], row["metric"])
+            if "value" in row:
+                line = "{:<10} {:<44} {:>5} {:>10}".format(row["scenario"], row["metric"], "",
+                                                        "{:,.0f}{}".format(row["value"], row["unit"]))
+                reference = (baseline or {}).get(key, {}).get("value")
+            else:
+                line = "{:<10} {:<44} {:>5} {:>10} {:>10} {:>10} {:>10}".format(
+                    row["scenario"], row["metric"], row["n"], format_time(row.get("p50")), format_time(row.get("p90")),
+                    format_time(row.get("p99")), format_time(row.get("max")))
+                if row["timeouts"]:
+                    line += "  ({} timed out)".format(row["timeouts"])
+                reference = (baseline or {}).get(key, {}).get("p50")
+                row = {"value": row.get("p50")}
+            if reference and row["value"] is not None:
+                line += "  {:+.0f}% vs baseline".format((float(row["value"]) / reference - 1) * 100)
+            print(line)
+
+
+class Testbed(object):
+
+    PREFIX = "devices"
+
+    # Without a broker address, the broker and the simulated nodes are created too
+    def __init__(self, args, broker_address=None, openhab_control=True):
+        self.args = args
+        self.folder = tempfile.mkdtemp(prefix="zsc-benchmark-")
+        for folder in ("addons", "configurations", "habmin", "cache", "mirror", "dev"):
+            os.makedirs(self.get_path(folder))
+        self.write(self.get_path("configurations", "openhab_default.cfg"), OPENHAB_CONFIGURATION)
+        self.write(self.get_path("openhab"), DEFAULT_FILE)
+        self.write(self.get_path("logback.xml"), LOGBACK_FILE.format("INFO", ""))
+        self.write(self.get_path("logback_debug.xml"), LOGBACK_FILE.format("DEBUG", " "))
+
+        self.broker = self.catalog = self.console = self.oh = None
+        self.echo_nodes = []
+        self.nodes = []
+        if broker_address is None:
+            self.broker = MqttBroker()
+            broker_address = (self.broker.host, self.broker.port)
+            self.echo_nodes = [EchoNode() for _ in range(args.nodes)]
+            self.nodes = [SimulatedNode(self.broker, "zwave" if number == 1 else "zwave{}".format(number), self.PREFIX,
+                                        port=echo_node.port) for number, echo_node in enumerate(self.echo_nodes, 1)]
+
+        self.controller = controller = load_controller()
+        from lib import metricsHandler, notificationsHandler
+        from lib.bridgeEngine import BridgeEngine
+        from lib.connectionManager import ConnectionManager
+        self.metrics = metricsHandler
+        mqtt_params = controller.MqttBrokerParameters(*broker_address)
+        notificationsHandler.set_broker_parameters(mqtt_params)
+        controller.Node.bridge = BridgeEngine()
+        if not getattr(args, "no_link_probing", False):
+            controller.Node.connection_manager = ConnectionManager()
+            controller.Node.bridge.on_link_change = controller.NodeController.handle_link
+        controller.Node.device_folder = self.get_path("dev")
+        controller.Node.health_parameters = {"up_delay": args.up_delay, "down_delay": args.down_delay}
+        # The controller is built without openHAB control so it does not create the handlers for the real paths
+        self.nc = controller.NodeController(mqtt_params, self.PREFIX, False)
+        if not openhab_control:
+            return
+        self.catalog = CatalogServer(self.get_path("mirror"), args.nodes)
+        self.console = FakeOSGiConsole(self.get_path("addons"), start_delay=args.start_delay, stop_delay=args.stop_delay,
+                                       restart_downtime=args.restart_downtime, startup_delay=args.startup_delay)
+        self.oh = controller.OpenHABHandler("127.0.0.1", self.console.port, addons_folder=self.get_path("addons"),
+                                            restart_command=self.console.get_restart_command())
+        zbh = controller.ZWaveBindingsHandler(self.get_path("openhab"), self.get_path("configurations"), self.get_path("addons"),
+                                              self.get_path("habmin"), self.get_path("cache"), oh=self.oh, fast_start=True,
+                                              catalog_source=self.catalog.url("manifest.json"),
+                                              artifact_mirrors=[self.catalog.url()], spare_serial_ports=args.spare_ports)
+        controller.NodeController.openhab_control_enabled = True
+        controller.NodeController.oh = self.oh
+        controller.NodeController.zbh = zbh
+        controller.NodeController.orchestrator = controller.BindingOrchestrator(self.oh)
+
+    def get_path(self, *names):
+        return os.path.join(self.folder, *names)
+
+    @staticmethod
+    def write(path, content):
+        with open(path, 'w') as f:
+            f.write(content)
+
+    @staticmethod
+    def get_bundle(node):
+        return "org.openhab.binding." + node.name
+
+    def is_active(self, node):
+        return self.console.is_online() and self.console.get_state(self.get_bundle(node)) == "ACTIVE"
+
+    def is_resolved(self, node):
+        return self.console.is_online() and self.console.get_state(self.get_bundle(node)) == "RESOLVED"
+
+    def is_bridged(self, node):
+        status = self.controller.Node.bridge.status(node.name)
+        return bool(status and status["running"])
+
+    def is_bridge_stopped(self, node):
+        return node.name not in self.controller.Node.bridge.get_names()
+
+    def is_settled(self):
+        orchestrator = self.controller.NodeController.orchestrator
+        return self.oh.restart_scheduler.get_state() == "idle" and not orchestrator.pending and not orchestrator.in_flight \
+            and all(self.is_active(node) and self.is_bridged(node) for node in self.nodes)
+
+    def close(self):
+        self.controller.Node.bridge.shutdown()
+        if self.controller.Node.connection_manager is not None:
+            self.controller.Node.connection_manager.shutdown()
+        for standin in (self.broker, self.console, self.catalog):
+            if standin is not None:
+                standin.close()
+        for echo_node in self.echo_nodes:
+            echo_node.stop()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+
+def run_discovery(testbed, args, report):
+    start_time = time.time()
+    for node in testbed.nodes:
+        node.announce()
+    active_nodes = testbed.controller.NodeController.active_nodes
+    for metric, predicate in (("node detected", lambda node: node.name in active_nodes),
+                              ("local bridge connected", testbed.is_bridged),
+                              ("binding ACTIVE", testbed.is_active)):
+        elapsed = wait_all(dict((node.name, lambda node=node: predicate(node)) for node in testbed.nodes), start_time, args.timeout)
+        report.add_samples("discovery", metric, elapsed.values(), elapsed.values().count(None))
+    settled = wait_all({"settled": testbed.is_settled}, start_time, args.timeout)["settled"]
+    report.add_samples("discovery", "fleet settled", [settled], int(settled is None))
+    report.add_value("discovery", "openHAB restarts", len(testbed.console.restarts))
+
+
+def run_mqtt(testbed, args, report):
+    callback_time = testbed.metrics.histogram("mqtt_callback_seconds", "")
+    before = get_histogram_counts(callback_time)
+    timestamp = int(time.time())
+    start_time = time.time()
+    for number in range(args.messages):
+        testbed.nodes[number % len(testbed.nodes)].publish("time/last_report", str(timestamp + number // len(testbed.nodes)))
+    published_time = time.time()
+    wait_all({"delivered": lambda: sum(get_histogram_counts(callback_time)) - sum(before) >= args.messages},
+             start_time, args.timeout, 0.001)
+    elapsed = time.time() - start_time
+    after = get_histogram_counts(callback_time)
+    report.add_value("mqtt", "published", args.messages / (published_time - start_time), " msg/s")
+    report.add_value("mqtt", "delivered to the controller", (sum(after) - sum(before)) / elapsed, " msg/s")
+    report.add_histogram("mqtt", "callback time", callback_time, before, after)
+
+
+# Every cycle takes a different node down and up, so the health penalty of one cycle does not leak into the next
+def run_failover(testbed, args, report):
+    nodes = testbed.nodes[:-1] if len(testbed.nodes) > 1 and "flap" in args.scenarios else testbed.nodes
+    results = dict((metric, []) for metric in ("port killed", "binding RESOLVED", "bridge reconnected", "binding ACTIVE"))
+    console_roundtrip = testbed.metrics.histogram("openhab_console_roundtrip_seconds", "")
+    before = get_histogram_counts(console_roundtrip)
+    for cycle in range(args.cycles):
+        node = nodes[cycle % len(nodes)]
+        echo_node = testbed.echo_nodes[testbed.nodes.index(node)]
+        start_time = time.time()
+        echo_node.stop()
+        node.set_socat_status(False)
+        elapsed = wait_all({"port killed": lambda: testbed.is_bridge_stopped(node),
+                            "binding RESOLVED": lambda: testbed.is_resolved(node)}, start_time, args.timeout)
+        start_time = time.time()
+        echo_node.start()
+        node.set_socat_status(True)
+        elapsed.update(wait_all({"bridge reconnected": lambda: testbed.is_bridged(node),
+                                 "binding ACTIVE": lambda: testbed.is_active(node)}, start_time, args.timeout))
+        for metric, value in elapsed.items():
+            results[metric].append(value)
+    for metric in ("port killed", "binding RESOLVED", "bridge reconnected", "binding ACTIVE"):
+        report.add_samples("failover", metric, results[metric], results[metric].count(None))
+    report.add_histogram("failover", "console round-trip", console_roundtrip, before, get_histogram_counts(console_roundtrip))
+
+
+# The node loses its link without any MQTT update, like a node that lost power before its last will is published
+def run_link(testbed, args, report):
+    nodes = testbed.nodes[:-1] if len(testbed.nodes) > 1 and "flap" in args.scenarios else testbed.nodes
+    results = dict((metric, []) for metric in ("port killed", "bridge reconnected"))
+    for cycle in range(args.cycles):
+        node = nodes[cycle % len(nodes)]
+        echo_node = testbed.echo_nodes[testbed.nodes.index(node)]
+        wait_all({"bridged": lambda: testbed.is_bridged(node)}, time.time(), args.timeout)
+        start_time = time.time()
+        echo_node.stop()
+        elapsed = wait_all({"port killed": lambda: testbed.is_bridge_stopped(node)}, start_time, args.link_timeout)
+        start_time = time.time()
+        echo_node.start()
+        elapsed.update(wait_all({"bridge reconnected": lambda: testbed.is_bridged(node)}, start_time, args.timeout))
+        for metric, value in elapsed.items():
+            results[metric].append(value)
+    for metric in ("port killed", "bridge reconnected"):
+        report.add_samples("link", metric, results[metric], results[metric].count(None))
+
+
+def run_restart(testbed, args, report):
+    wait_all({"settled": testbed.is_settled}, time.time(), args.timeout)
+    restarts = len(testbed.console.restarts)
+    history = len(testbed.oh.restart_scheduler.get_stats()["history"])
+
+    def request(number):
+        for request_number in range(number, args.restart_requests, 4):
+            testbed.oh.restart_openhab("benchmark request {}".format(request_number))
+            time.sleep(args.restart_spread / args.restart_requests * 4)
+
+    start_time = time.time()
+    threads = [threading.Thread(target=request, args=(number,)) for number in range(4)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    elapsed = wait_all(dict((node.name, lambda node=node: len(testbed.console.restarts) > restarts and testbed.is_active(node))
+                            for node in testbed.nodes), start_time, args.timeout + args.restart_spread)
+    wait_all({"settled": testbed.is_settled}, start_time, args.timeout)
+    restart_history = testbed.oh.restart_scheduler.get_stats()["history"][history:]
+    report.add_value("restart", "restart requests", args.restart_requests)
+    report.add_value("restart", "openHAB restarts", len(testbed.console.restarts) - restarts)
+    report.add_samples("restart", "restart duration", [entry["duration"] for entry in restart_history])
+    report.add_samples("restart", "request to restart completed", [entry["max_latency"] for entry in restart_history])
+    report.add_samples("restart", "bindings ACTIVE again", elapsed.values(), elapsed.values().count(None))
+
+
+def run_flap(testbed, args, report):
+    node = testbed.nodes[-1]
+    bundle = testbed.get_bundle(node)
+    commands = [testbed.console.get_command_count(command, bundle) for command in ("start", "stop")]
+    bridge_status = testbed.controller.Node.bridge.status(node.name) or {"restarts": 0}
+    for _ in range(args.flaps):
+        node.set_socat_status(False)
+        time.sleep(args.flap_interval)
+        node.set_socat_status(True)
+        time.sleep(args.flap_interval)
+    start_time = time.time()
+    recovered = wait_all({"recovered": lambda: testbed.is_active(node) and testbed.is_bridged(node)},
+                         start_time, args.timeout)["recovered"]
+    health = testbed.controller.NodeController.active_nodes[node.name].get_health_stats()
+    new_bridge_status = testbed.controller.Node.bridge.status(node.name) or {"restarts": 0}
+    report.add_value("flap", "reported flaps", health["flaps"])
+    report.add_value("flap", "binding start commands", testbed.console.get_command_count("start", bundle) - commands[0])
+    report.add_value("flap", "binding stop commands", testbed.console.get_command_count("stop", bundle) - commands[1])
+    report.add_value("flap", "bridge reconnections", new_bridge_status["restarts"] - bridge_status["restarts"])
+    report.add_value("flap", "suppressed", int(health["suppressed"]))
+    report.add_samples("flap", "ACTIVE after the last flap", [recovered], int(recovered is None))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline failover benchmark of the controller")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of " + ", ".join(SCENARIOS))
+    parser.add_argument("--nodes", type=int, default=4)
+    parser.add_argument("--cycles", type=int, default=3, help="failover cycles")
+    parser.add_argument("--messages", type=int, default=20000, help="messages of the MQTT scenario")
+    parser.add_argument("--restart-requests", type=int, default=20)
+    parser.add_argument("--restart-spread", type=float, default=1.0, help="seconds over which the restarts are requested")
+    parser.add_argument("--flaps", type=int, default=10)
+    parser.add_argument("--flap-interval", type=float, default=0.2)
+    parser.add_argument("--up-delay", type=float, default=1)
+    parser.add_argument("--down-delay", type=float, default=3)
+    parser.add_argument("--spare-ports", type=int, default=2)
+    parser.add_argument("--start-delay", type=float, default=0.3, help="RESOLVED to ACTIVE delay of the fake console")
+    parser.add_argument("--stop-delay", type=float, default=0.1, help="ACTIVE to RESOLVED delay of the fake console")
+    parser.add_argument("--restart-downtime", type=float, default=1.0)
+    parser.add_argument("--startup-delay", type=float, default=2.0)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--link-timeout", type=float, default=10, help="seconds to wait for a silent link failure to be detected")
+    parser.add_argument("--no-link-probing", action="store_true", help="only detect the dead links through MQTT")
+    parser.add_argument("--json", help="file where the results are saved")
+    parser.add_argument("--compare", help="results file of a previous run, the p50 changes are shown")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    args.scenarios = [scenario for scenario in args.scenarios.split(",") if scenario]
+
+    logging.basicConfig(format='%(asctime)s %(levelname)-8s - %(message)s', level=logging.DEBUG if args.verbose else logging.ERROR)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    testbed = Testbed(args)
+    report = Report()
+    try:
+        if "discovery" not in args.scenarios:
+            # Every other scenario starts from a discovered and settled fleet
+            run_discovery(testbed, args, Report())
+        for scenario in SCENARIOS:
+            if scenario in args.scenarios:
+                globals()["run_" + scenario](testbed, args, report)
+    finally:
+        testbed.close()
+    print("{} nodes, health delays up {}s / down {}s".format(args.nodes, args.up_delay, args.down_delay))
+    report.show(baseline)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report.get_results(), f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
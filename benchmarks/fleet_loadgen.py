@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+# Publishes the Homie traffic of a growing fleet of simulated zwave-socat-node devices and records the
+# controller CPU, memory, threads and decision latency (taken from its notifications) at every fleet size.
+#
+#   python benchmarks/fleet_loadgen.py --fleet 1,10,100,1000 --duration 30
+#   python benchmarks/fleet_loadgen.py --broker 192.168.1.10:1883 --pid 1234 --echo-host 192.168.1.20
+import os
+import re
+import sys
+import json
+import time
+import heapq
+import random
+import signal
+import logging
+import argparse
+import resource
+import threading
+import subprocess
+import paho.mqtt.client as mqtt_client
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+from standins import MqttBroker, EchoNode
+from failover_benchmark import Testbed, percentile
+
+DECISION_PATTERNS = [("detected", re.compile(r"^New '(.+)' node detected$")),
+                     ("unhealthy", re.compile(r"^'(.+)' node \(.*\) is not healthy$")),
+                     ("healthy", re.compile(r"^'(.+)' node \(.*\) is healthy$"))]
+OPPOSITE_DECISIONS = {"healthy": "unhealthy", "unhealthy": "healthy"}
+
+
+def raise_file_limit():
+    # Every node has a pty and a socket in the controller and an echo connection here
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def read_process(pid):
+    with open("/proc/{}/stat".format(pid)) as f:
+        fields = f.read().rpartition(")")[2].split()
+    status = {}
+    with open("/proc/{}/status".format(pid)) as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            status[key] = value.split()
+    return {"cpu": (int(fields[11]) + int(fields[12])) / float(os.sysconf("SC_CLK_TCK")),
+            "rss": int(status["VmRSS"][0]) / 1024.0, "threads": int(status["Threads"][0])}
+
+
+class ProcessSampler(object):
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.phase = None
+        thread = threading.Thread(target=self.__run, name="process-sampler")
+        thread.daemon = True
+        thread.start()
+
+    def start_phase(self):
+        sample = read_process(self.pid)
+        with self.lock:
+            self.phase = {"start_time": time.time(), "start_cpu": sample["cpu"], "rss": sample["rss"],
+                          "threads": sample["threads"]}
+
+    def end_phase(self):
+        sample = read_process(self.pid)
+        with self.lock:
+            phase, self.phase = self.phase, None
+        return {"cpu": (sample["cpu"] - phase["start_cpu"]) / (time.time() - phase["start_time"]) * 100,
+                "rss": max(phase["rss"], sample["rss"]), "threads": max(phase["threads"], sample["threads"])}
+
+    def __run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                sample = read_process(self.pid)
+            except (IOError, OSError):
+                return
+            with self.lock:
+                if self.phase is not None:
+                    self.phase["rss"] = max(self.phase["rss"], sample["rss"])
+                    self.phase["threads"] = max(self.phase["threads"], sample["threads"])
+
+
+class DecisionTracker(object):
+    # Matches the controller notifications with the state changes that should cause them
+
+    def __init__(self, host, port, topic, delays):
+        self.delays = delays
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.samples = dict((kind, []) for kind, _ in DECISION_PATTERNS)
+        self.damped = 0
+        self.lost = 0
+        self.last_decision = time.time()
+        self.subscribed = threading.Event()
+        self.client = mqtt_client.Client()
+        self.client.on_connect = lambda client, userdata, flags, rc: client.subscribe(topic, 1)
+        self.client.on_subscribe = lambda client, userdata, mid, granted_qos: self.subscribed.set()
+        self.client.on_message = self.__on_message
+        self.client.connect(host, port, 60)
+        self.client.loop_start()
+        self.subscribed.wait(10)
+
+    def expect(self, kind, name):
+        with self.lock:
+            opposite = OPPOSITE_DECISIONS.get(kind)
+            expected_time = self.pending.pop((opposite, name), None)
+            if expected_time is not None:
+                # A change undone before the controller could act on it was damped, neither decision will come,
+                # one still unanswered after its delay was lost
+                if time.time() - expected_time < self.delays[opposite]:
+                    self.damped += 1
+                else:
+                    self.lost += 1
+                return
+            self.pending.setdefault((kind, name), time.time())
+
+    # The decisions of a change cut short by the end of a phase are not measured
+    def forget(self, name, kinds=OPPOSITE_DECISIONS):
+        with self.lock:
+            return sum(1 for kind in kinds if self.pending.pop((kind, name), None) is not None)
+
+    def is_pending(self, kind, name):
+        return (kind, name) in self.pending
+
+    def drain(self):
+        with self.lock:
+            samples, self.samples = self.samples, dict((kind, []) for kind, _ in DECISION_PATTERNS)
+            damped, self.damped = self.damped, 0
+            lost, self.lost = self.lost, 0
+        return samples, damped, lost
+
+    def __on_message(self, client, userdata, msg):
+        now = time.time()
+        try:
+            text = json.loads(msg.payload)["text"]
+        except (ValueError, KeyError, TypeError):
+            return
+        for kind, pattern in DECISION_PATTERNS:
+            match = pattern.match(text)
+            if match:
+                with self.lock:
+                    expected_time = self.pending.pop((kind, match.group(1)), None)
+                    if expected_time is not None:
+                        self.samples[kind].append(now - expected_time)
+                        self.last_decision = now
+                return
+
+
+class Fleet(object):
+
+    def __init__(self, args, tracker, echo_port):
+        self.args = args
+        self.tracker = tracker
+        self.echo_port = echo_port
+        self.nodes = []
+        self.published = 0
+        self.reports = []
+        self.recoveries = []
+        self.client = mqtt_client.Client()
+        self.client.max_inflight_messages_set(1000)
+        self.client.connect(args.broker_host, args.broker_port, 60)
+        self.client.loop_start()
+
+    def publish(self, name, attribute, payload):
+        self.client.publish("{}/{}/{}".format(self.args.prefix, name, attribute), payload, retain=True)
+        self.published += 1
+
+    def grow(self, size):
+        names = []
+        for number in range(len(self.nodes) + 1, size + 1):
+            name = "zwave" if number == 1 else "zwave{}".format(number)
+            self.nodes.append(name)
+            names.append(name)
+            self.tracker.expect("detected", name)
+            self.tracker.expect("healthy", name)
+            self.publish(name, "$fwname", "zwave-socat-node")
+            self.publish(name, "$localip", self.args.echo_host)
+            self.publish(name, "socat/port", str(self.echo_port))
+            self.publish(name, "$online", "true")
+            self.publish(name, "socat/status", "true")
+            self.publish(name, "time/last_report", str(int(time.time())))
+            heapq.heappush(self.reports, (time.time() + random.uniform(0, self.args.report_interval), name))
+        return names
+
+    # Reports, churn and flaps of the whole fleet, churn and flaps are Poisson events at fleet-wide rates
+    def run(self, duration):
+        end_time = time.time() + duration
+        busy = set(name for _, name, _ in self.recoveries)
+        next_churn = self.__get_next_event(self.args.churn)
+        next_flap = self.__get_next_event(self.args.flaps)
+        while True:
+            now = time.time()
+            if now >= end_time:
+                return
+            while self.reports and self.reports[0][0] <= now:
+                _, name = heapq.heappop(self.reports)
+                self.publish(name, "time/last_report", str(int(now)))
+                heapq.heappush(self.reports, (now + self.args.report_interval, name))
+            while self.recoveries and self.recoveries[0][0] <= now:
+                _, name, attribute = heapq.heappop(self.recoveries)
+                busy.discard(name)
+                self.tracker.expect("healthy", name)
+                self.restore(name, attribute)
+            for attribute, next_time, rate, down_time in (("$online", next_churn, self.args.churn, self.args.offline_time),
+                                                          ("socat/status", next_flap, self.args.flaps, self.args.flap_time)):
+                if now < next_time:
+                    continue
+                candidates = [name for name in self.nodes if name not in busy]
+                if candidates:
+                    name = random.choice(candidates)
+                    busy.add(name)
+                    self.tracker.expect("unhealthy", name)
+                    self.publish(name, attribute, "false")
+                    heapq.heappush(self.recoveries, (now + down_time, name, attribute))
+                if attribute == "$online":
+                    next_churn = self.__get_next_event(rate)
+                else:
+                    next_flap = self.__get_next_event(rate)
+            wakeup_time = min([end_time, next_churn, next_flap] + [queue[0][0] for queue in (self.reports, self.recoveries) if queue])
+            time.sleep(min(max(wakeup_time - time.time(), 0), 0.05))
+
+    # Brings every node back, so the next fleet size starts from a healthy fleet
+    def recover(self):
+        while self.recoveries:
+            _, name, attribute = heapq.heappop(self.recoveries)
+            self.tracker.forget(name)
+            self.restore(name, attribute)
+
+    # $online=false resets the socat status in the controller, a reconnecting node publishes both again
+    def restore(self, name, attribute):
+        self.publish(name, attribute, "true")
+        if attribute == "$online":
+            self.publish(name, "socat/status", "true")
+
+    @staticmethod
+    def __get_next_event(rate):
+        return time.time() + random.expovariate(rate / 60.0) if rate > 0 else float("inf")
+
+
+def format_latencies(samples):
+    if not samples:
+        return "{:>8} {:>8}".format("-", "-")
+    return "{:>7.2f}s {:>7.2f}s".format(percentile(samples, 0.5), percentile(samples, 0.99))
+
+
+def run_controller(args):
+    testbed = Testbed(args, (args.broker_host, args.broker_port), args.openhab)
+
+    def stop(signal_number, frame):
+        testbed.close()
+        os._exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while True:
+        signal.pause()
+
+
+def start_controller(args):
+    command = [sys.executable, os.path.realpath(__file__), "--controller", "--broker",
+               "{}:{}".format(args.broker_host, args.broker_port), "--nodes", str(args.nodes),
+               "--up-delay", str(args.up_delay), "--down-delay", str(args.down_delay)]
+    if args.openhab:
+        command.append("--openhab")
+    return subprocess.Popen(command)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic zwave-socat-node fleet load generator")
+    parser.add_argument("--fleet", default="1,10,100,1000", help="comma-separated fleet sizes, the fleet grows between them")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of steady traffic at every fleet size")
+    parser.add_argument("--report-interval", type=float, default=10, help="seconds between time/last_report messages of a node")
+    parser.add_argument("--churn", type=float, default=6, help="nodes going offline per minute, in the whole fleet")
+    parser.add_argument("--offline-time", type=float, default=10, help="seconds a churned node stays offline")
+    parser.add_argument("--flaps", type=float, default=6, help="socat flaps per minute, in the whole fleet")
+    parser.add_argument("--flap-time", type=float, default=5, help="seconds a flapping node reports its socat down")
+    parser.add_argument("--settle-timeout", type=float, default=120, help="seconds to wait for the new nodes to be healthy")
+    parser.add_argument("--broker", help="host:port of the broker, an in-process one is started by default")
+    parser.add_argument("--pid", type=int, help="pid of a running controller, one is started against the broker by default")
+    parser.add_argument("--prefix", default="devices")
+    parser.add_argument("--notifications-topic", default="notifications/zwave-socat-controller")
+    parser.add_argument("--echo-host", default="127.0.0.1", help="address the nodes announce for their socat port")
+    parser.add_argument("--openhab", action="store_true", help="the started controller also manages a fake openHAB")
+    parser.add_argument("--up-delay", type=float, default=1)
+    parser.add_argument("--down-delay", type=float, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="file where the results are saved")
+    parser.add_argument("--controller", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--nodes", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.fleet = [int(size) for size in args.fleet.split(",")]
+    args.nodes = args.nodes or max(args.fleet)
+    # Testbed options that this tool does not expose
+    args.spare_ports, args.start_delay, args.stop_delay, args.restart_downtime, args.startup_delay = 2, 0.3, 0.1, 1.0, 2.0
+    random.seed(args.seed)
+    raise_file_limit()
+    logging.basicConfig(format='%(asctime)s %(levelname)-8s - %(message)s', level=logging.ERROR)
+
+    broker = None
+    if args.broker:
+        args.broker_host, _, port = args.broker.partition(":")
+        args.broker_port = int(port or 1883)
+    else:
+        broker = MqttBroker()
+        args.broker_host, args.broker_port = broker.host, broker.port
+    if args.controller:
+        run_controller(args)
+        return
+
+    controller = None
+    pid = args.pid
+    if pid is None:
+        controller = start_controller(args)
+        pid = controller.pid
+    echo_node = EchoNode()
+    tracker = DecisionTracker(args.broker_host, args.broker_port, args.notifications_topic,
+                              {"healthy": args.up_delay, "unhealthy": args.down_delay})
+    sampler = ProcessSampler(pid)
+    fleet = Fleet(args, tracker, echo_node.port)
+    results = []
+    try:
+        if controller is not None:
+            # The subscriptions of the controller have to be in place before the first node is announced
+            time.sleep(2)
+        print("{:>6} {:>8} {:>8} {:>7} {:>8} {:>8} {:>8} {:>17} {:>17} {:>17} {:>7} {:>5}".format(
+            "nodes", "join", "join cpu", "msg/s", "cpu", "rss", "threads", "detected p50/p99", "healthy p50/p99",
+            "unhealthy p50/p99", "damped", "lost"))
+        for size in args.fleet:
+            sampler.start_phase()
+            join_time = time.time()
+            names = fleet.grow(size)
+            # Decisions still missing after a quiet period were lost, the controller will not send them anymore
+            quiet_period = max(args.up_delay, args.down_delay) + 5
+            while any(tracker.is_pending(kind, name) for kind in ("detected", "healthy") for name in names) and \
+                    time.time() - max(join_time, tracker.last_decision) < quiet_period and \
+                    time.time() - join_time < args.settle_timeout:
+                time.sleep(0.01)
+            lost = sum(tracker.forget(name, ("detected", "healthy")) for name in names)
+            join_time = time.time() - join_time
+            join_stats = sampler.end_phase()
+            sampler.start_phase()
+            steady_time = time.time()
+            published = fleet.published
+            fleet.run(args.duration)
+            stats = sampler.end_phase()
+            rate = (fleet.published - published) / (time.time() - steady_time)
+            fleet.recover()
+            time.sleep(args.up_delay + 1)
+            samples, damped, unanswered = tracker.drain()
+            lost += unanswered
+            result = {"nodes": size, "join_time": join_time, "join_cpu": join_stats["cpu"], "rate": rate, "cpu": stats["cpu"],
+                      "rss": stats["rss"], "threads": stats["threads"], "damped": damped, "lost": lost, "latencies": samples}
+            results.append(result)
+            print("{:>6} {:>7.1f}s {:>7.1f}% {:>7.0f} {:>7.1f}% {:>6.1f}MB {:>8} {} {} {} {:>7} {:>5}".format(
+                size, join_time, join_stats["cpu"], rate, stats["cpu"], stats["rss"], stats["threads"],
+                format_latencies(samples["detected"]), format_latencies(samples["healthy"]),
+                format_latencies(samples["unhealthy"]), damped, lost))
+            sys.stdout.flush()
+    finally:
+        if controller is not None:
+            controller.terminate()
+            controller.wait()
+        echo_node.stop()
+        if broker is not None:
+            broker.close()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,613 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+# Local stand-ins for everything the controller talks to, so the benchmarks run offline:
+# an MQTT 3.1.1 broker, an openHAB OSGi console, an HTTP artifact catalog and TCP echo nodes.
+import os
+import sys
+import json
+import time
+import errno
+import socket
+import struct
+import zipfile
+import threading
+import SocketServer
+import SimpleHTTPServer
+import BaseHTTPServer
+
+
+def read_exactly(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError("connection closed")
+        data += chunk
+    return data
+
+
+# A thread blocked in accept keeps the socket listening after close, the shutdown wakes it up
+def close_server(server):
+    try:
+        server.shutdown(socket.SHUT_RDWR)
+    except socket.error:
+        pass
+    server.close()
+
+
+def encode_length(length):
+    encoded = bytearray()
+    while True:
+        digit, length = length % 128, length // 128
+        encoded.append(digit | 0x80 if length else digit)
+        if not length:
+            return bytes(encoded)
+
+
+def encode_string(value):
+    return struct.pack("!H", len(value)) + value
+
+
+def topic_matches(topic_filter, topic):
+    filter_levels = topic_filter.split("/")
+    topic_levels = topic.split("/")
+    for number, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if number >= len(topic_levels) or (level != "+" and level != topic_levels[number]):
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+class MqttConnection(object):
+
+    def __init__(self, broker, sock):
+        self.broker = broker
+        self.sock = sock
+        self.lock = threading.Lock()
+        self.client_id = None
+        self.filters = {}
+
+    def send(self, packet):
+        with self.lock:
+            try:
+                self.sock.sendall(packet)
+            except socket.error:
+                pass
+
+    def deliver(self, topic, payload, retain=False):
+        body = encode_string(topic) + payload
+        self.send(chr(0x31 if retain else 0x30) + encode_length(len(body)) + body)
+
+    def serve(self):
+        try:
+            while True:
+                header = ord(read_exactly(self.sock, 1))
+                length, multiplier = 0, 1
+                while True:
+                    digit = ord(read_exactly(self.sock, 1))
+                    length += (digit & 0x7f) * multiplier
+                    multiplier *= 128
+                    if not digit & 0x80:
+                        break
+                body = read_exactly(self.sock, length) if length else b""
+                if not self.handle(header >> 4, header & 0x0f, body):
+                    break
+        except (EOFError, socket.error):
+            pass
+        finally:
+            self.broker.disconnect(self)
+            self.sock.close()
+
+    def handle(self, packet_type, flags, body):
+        if packet_type == 1:
+            protocol_length = struct.unpack("!H", body[:2])[0]
+            offset = 2 + protocol_length + 4
+            client_id_length = struct.unpack("!H", body[offset:offset + 2])[0]
+            self.client_id = body[offset + 2:offset + 2 + client_id_length]
+            self.send(b"\x20\x02\x00\x00")
+        elif packet_type == 3:
+            qos = (flags >> 1) & 0x03
+            topic_length = struct.unpack("!H", body[:2])[0]
+            topic = body[2:2 + topic_length]
+            offset = 2 + topic_length
+            if qos:
+                packet_id = body[offset:offset + 2]
+                offset += 2
+                self.send((b"\x40\x02" if qos == 1 else b"\x50\x02") + packet_id)
+            self.broker.publish(topic, body[offset:], bool(flags & 0x01))
+        elif packet_type == 6:
+            self.send(b"\x70\x02" + body[:2])
+        elif packet_type == 8:
+            packet_id, offset, granted, filters = body[:2], 2, [], []
+            while offset < len(body):
+                filter_length = struct.unpack("!H", body[offset:offset + 2])[0]
+                topic_filter = body[offset + 2:offset + 2 + filter_length]
+                offset += 2 + filter_length + 1
+                filters.append(topic_filter)
+                granted.append(b"\x00")
+            self.send(b"\x90" + encode_length(2 + len(granted)) + packet_id + b"".join(granted))
+            for topic_filter in filters:
+                self.broker.subscribe(self, topic_filter)
+        elif packet_type == 10:
+            offset = 2
+            while offset < len(body):
+                filter_length = struct.unpack("!H", body[offset:offset + 2])[0]
+                self.broker.unsubscribe(self, body[offset + 2:offset + 2 + filter_length])
+                offset += 2 + filter_length
+            self.send(b"\xb0\x02" + body[:2])
+        elif packet_type == 12:
+            self.send(b"\xd0\x00")
+        elif packet_type == 14:
+            return False
+        return True
+
+
+class MqttBroker(object):
+    # QoS 0/1/2 publishes are accepted, every delivery is made at QoS 0
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.lock = threading.Lock()
+        self.connections = set()
+        self.exact = {}
+        self.wildcards = {}
+        self.retained = {}
+        self.listeners = []
+        self.published = 0
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(128)
+        self.host, self.port = self.server.getsockname()
+        self.thread = threading.Thread(target=self.__accept, name="mqtt-broker")
+        self.thread.daemon = True
+        self.thread.start()
+
+    # In-process listeners see every publish, whoever the publisher is
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def publish(self, topic, payload, retain=False):
+        with self.lock:
+            self.published += 1
+            if retain:
+                if payload:
+                    self.retained[topic] = payload
+                else:
+                    self.retained.pop(topic, None)
+            subscribers = set(self.exact.get(topic, ()))
+            for topic_filter, connections in self.wildcards.items():
+                if topic_matches(topic_filter, topic):
+                    subscribers.update(connections)
+        for connection in subscribers:
+            connection.deliver(topic, payload)
+        for listener in self.listeners:
+            listener(topic, payload)
+
+    def subscribe(self, connection, topic_filter):
+        with self.lock:
+            connection.filters[topic_filter] = True
+            if "+" in topic_filter or "#" in topic_filter:
+                self.wildcards.setdefault(topic_filter, set()).add(connection)
+                retained = [(topic, payload) for topic, payload in self.retained.items() if topic_matches(topic_filter, topic)]
+            else:
+                self.exact.setdefault(topic_filter, set()).add(connection)
+                retained = [(topic_filter, self.retained[topic_filter])] if topic_filter in self.retained else []
+        for topic, payload in retained:
+            connection.deliver(topic, payload, retain=True)
+
+    def unsubscribe(self, connection, topic_filter):
+        with self.lock:
+            connection.filters.pop(topic_filter, None)
+            index = self.wildcards if "+" in topic_filter or "#" in topic_filter else self.exact
+            connections = index.get(topic_filter, set())
+            connections.discard(connection)
+            if not connections:
+                index.pop(topic_filter, None)
+
+    def disconnect(self, connection):
+        for topic_filter in connection.filters.keys():
+            self.unsubscribe(connection, topic_filter)
+        with self.lock:
+            self.connections.discard(connection)
+
+    def get_subscriptions(self):
+        with self.lock:
+            return sum(len(connections) for connections in self.exact.values() + self.wildcards.values())
+
+    def close(self):
+        close_server(self.server)
+        self.thread.join(1)
+
+    def __accept(self):
+        while True:
+            try:
+                sock, _ = self.server.accept()
+            except socket.error:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = MqttConnection(self, sock)
+            with self.lock:
+                self.connections.add(connection)
+            thread = threading.Thread(target=connection.serve, name="mqtt-connection")
+            thread.daemon = True
+            thread.start()
+
+
+class FakeBundle(object):
+
+    def __init__(self, bundle_id, name, version, state="INSTALLED"):
+        self.id = bundle_id
+        self.name = name
+        self.version = version
+        self.state = state
+        self.target = None
+        self.ready_time = None
+
+    def get_state(self, now):
+        if self.target is not None and now >= self.ready_time:
+            self.state, self.target = self.target, None
+        return self.state
+
+    def transition(self, intermediate, target, delay, now):
+        self.state = intermediate
+        self.target = target
+        self.ready_time = now + delay
+
+
+class FakeOSGiConsole(object):
+    # Equinox console subset used by OpenHABHandler: ss, start, stop, install, uninstall, refresh and update.
+    # The extra "restart" command takes the console down like "/etc/init.d/openhab restart" would.
+
+    PROMPT = "osgi> "
+    CORE_BUNDLES = [("org.eclipse.osgi", "3.8.1"), ("org.openhab.core", "1.8.3"), ("org.openhab.model.item", "1.8.3"),
+                    ("org.openhab.model.persistence", "1.8.3"), ("org.openhab.model.rule", "1.8.3"),
+                    ("org.openhab.model.script", "1.8.3"), ("org.openhab.model.sitemap", "1.8.3")]
+
+    def __init__(self, addons_folder, host="127.0.0.1", port=0, start_delay=0.3, stop_delay=0.1, restart_downtime=1.0,
+                 startup_delay=2.0):
+        self.addons_folder = addons_folder
+        self.start_delay = start_delay
+        self.stop_delay = stop_delay
+        self.restart_downtime = restart_downtime
+        self.startup_delay = startup_delay
+        self.lock = threading.Lock()
+        self.bundles = {}
+        self.next_id = 0
+        self.offline_until = 0
+        self.failures = {}
+        self.commands = {}
+        self.restarts = []
+        self.sessions = set()
+        self.__load_bundles(time.time(), 0)
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(16)
+        self.host, self.port = self.server.getsockname()
+        self.thread = threading.Thread(target=self.__accept, name="osgi-console")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def get_restart_command(self):
+        script = "import socket; s = socket.create_connection(('{}', {})); s.recv(64); s.sendall('restart\\r\\n'); s.recv(64)".format(
+            self.host, self.port)
+        return '{} -c "{}"'.format(sys.executable, script)
+
+    def get_state(self, name):
+        now = time.time()
+        with self.lock:
+            for bundle in self.bundles.values():
+                if bundle.name == name:
+                    return bundle.get_state(now)
+        return None
+
+    def wait_for_state(self, name, state, timeout=30, interval=0.005):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.is_online() and self.get_state(name) == state:
+                return True
+            time.sleep(interval)
+        return False
+
+    def is_online(self):
+        return time.time() >= self.offline_until
+
+    # The next start commands of the bundle leave it RESOLVED, to exercise the recovery paths
+    def fail_starts(self, name, times=1):
+        with self.lock:
+            self.failures[name] = times
+
+    def get_command_count(self, command, name=None):
+        with self.lock:
+            return self.commands.get((command, name), 0)
+
+    def restart(self):
+        now = time.time()
+        with self.lock:
+            self.offline_until = now + self.restart_downtime
+            self.restarts.append(now)
+            sessions = list(self.sessions)
+            self.bundles = {}
+            self.__load_bundles(now, self.restart_downtime + self.startup_delay)
+        for sock in sessions:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def execute(self, line):
+        now = time.time()
+        words = line.split()
+        if not words:
+            return ""
+        command, arguments = words[0], words[1:]
+        with self.lock:
+            bundle = self.bundles.get(arguments[0]) if arguments else None
+            self.commands[(command, None)] = self.commands.get((command, None), 0) + 1
+            if bundle is not None:
+                self.commands[(command, bundle.name)] = self.commands.get((command, bundle.name), 0) + 1
+            if command == "ss":
+                lines = ["", "Framework is launched.", "", "id\tState       Bundle"]
+                for bundle_id in sorted(self.bundles, key=int):
+                    bundle = self.bundles[bundle_id]
+                    lines.append("{}\t{:<12}{}_{}".format(bundle.id, bundle.get_state(now), bundle.name, bundle.version))
+                return "\r\n".join(lines) + "\r\n"
+            if command == "install" and arguments and arguments[0].startswith("file:"):
+                bundle = self.__install_jar(arguments[0][len("file:"):])
+                return "Bundle id is {}\r\n".format(bundle.id)
+            if command == "refresh":
+                return ""
+            if bundle is None:
+                return "No bundle with ID {}\r\n".format(arguments[0] if arguments else "")
+            if command == "start":
+                if self.failures.get(bundle.name):
+                    self.failures[bundle.name] -= 1
+                    bundle.transition("STARTING", "RESOLVED", self.start_delay, now)
+                elif bundle.get_state(now) != "ACTIVE":
+                    bundle.transition("STARTING", "ACTIVE", self.start_delay, now)
+            elif command == "stop":
+                if bundle.get_state(now) == "ACTIVE":
+                    bundle.transition("STOPPING", "RESOLVED", self.stop_delay, now)
+            elif command == "update":
+                target = "ACTIVE" if bundle.get_state(now) in ("ACTIVE", "STARTING") else "RESOLVED"
+                bundle.transition("STARTING" if target == "ACTIVE" else "INSTALLED", target, self.start_delay, now)
+            elif command == "uninstall":
+                del self.bundles[bundle.id]
+            return ""
+
+    def close(self):
+        close_server(self.server)
+        self.thread.join(1)
+
+    def __install(self, name, version):
+        bundle = FakeBundle(str(self.next_id), name, version)
+        self.bundles[bundle.id] = bundle
+        self.next_id += 1
+        return bundle
+
+    # Like Equinox, the bundle is named after its manifest and not after the jar file
+    def __install_jar(self, path):
+        headers = {}
+        try:
+            with zipfile.ZipFile(path) as jar:
+                for line in jar.read("META-INF/MANIFEST.MF").splitlines():
+                    key, _, value = line.partition(":")
+                    headers[key.strip()] = value.strip()
+        except (IOError, KeyError, zipfile.BadZipfile):
+            pass
+        file_name = os.path.basename(path).replace(".jar", "")
+        return self.__install(headers.get("Bundle-SymbolicName", file_name.split("_")[0]), headers.get("Bundle-Version", "1.0.0"))
+
+    # openHAB starts every bundle of the addons folder after its startup delay
+    def __load_bundles(self, now, delay):
+        bundles = [self.__install(name, version) for name, version in self.CORE_BUNDLES]
+        for file_name in sorted(os.listdir(self.addons_folder)):
+            if file_name.endswith(".jar"):
+                bundles.append(self.__install_jar(os.path.join(self.addons_folder, file_name)))
+        for bundle in bundles:
+            bundle.transition("RESOLVED", "ACTIVE", delay, now)
+
+    def __accept(self):
+        while True:
+            try:
+                sock, _ = self.server.accept()
+            except socket.error:
+                return
+            if not self.is_online():
+                sock.close()
+                continue
+            thread = threading.Thread(target=self.__serve, args=(sock,), name="osgi-session")
+            thread.daemon = True
+            thread.start()
+
+    def __serve(self, sock):
+        with self.lock:
+            self.sessions.add(sock)
+        buffer = b""
+        try:
+            sock.sendall(self.PROMPT)
+            while True:
+                data = sock.recv(4096)
+                if not data:
+                    return
+                buffer += data
+                while b"\n" in buffer:
+                    line, buffer = buffer.split(b"\n", 1)
+                    line = line.strip()
+                    if line == "restart":
+                        sock.sendall("Restarting...\r\n" + self.PROMPT)
+                        self.restart()
+                        return
+                    sock.sendall(self.execute(line) + self.PROMPT)
+        except socket.error:
+            pass
+        finally:
+            with self.lock:
+                self.sessions.discard(sock)
+            sock.close()
+
+
+class QuietHTTPRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CatalogServer(object):
+    # Serves a manifest catalog and an artifact mirror with the jars and HABmin archives of N bindings
+
+    def __init__(self, folder, bindings=8, host="127.0.0.1", port=0):
+        self.folder = folder
+        self.build(bindings)
+        folder = self.folder
+
+        class RequestHandler(QuietHTTPRequestHandler):
+
+            def translate_path(self, path):
+                relative_path = SimpleHTTPServer.SimpleHTTPRequestHandler.translate_path(self, path)
+                return os.path.join(folder, os.path.relpath(relative_path, os.getcwd()))
+
+        self.server = ThreadingHTTPServer((host, port), RequestHandler)
+        self.host, self.port = self.server.server_address
+        self.thread = threading.Thread(target=self.server.serve_forever, name="catalog-server")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def url(self, path=""):
+        return "http://{}:{}/{}".format(self.host, self.port, path)
+
+    def build(self, bindings):
+        manifest = {"zwave": {}, "habmin": {}}
+        for folder in ("zwave", "habmin"):
+            if not os.path.isdir(os.path.join(self.folder, folder)):
+                os.makedirs(os.path.join(self.folder, folder))
+        for number in range(1, bindings + 1):
+            name = "zwave" if number == 1 else "zwave{}".format(number)
+            for kind, file_name in (("zwave", "org.openhab.binding.{}_1.9.0(2017-01-01).jar".format(name)),
+                                    ("habmin", "org.openhab.io.habmin_{}_1.7.0(2017-01-01).jar".format(name))):
+                with zipfile.ZipFile(os.path.join(self.folder, kind, file_name), 'w') as jar:
+                    jar.writestr("META-INF/MANIFEST.MF", "Bundle-SymbolicName: {}\nBundle-Version: {}.201701010000\n".format(
+                        file_name.split("_")[0], file_name.split("_")[-1].split("(")[0]))
+                manifest[kind][name] = {"version": file_name.split("_")[-1].split("(")[0], "date": "2017-01-01",
+                                        "url": "{}/{}".format(kind, file_name)}
+        for path, prefix in (("HABmin-master.zip", "HABmin-master/"), ("habmin/habmin.zip", "habmin/")):
+            with zipfile.ZipFile(os.path.join(self.folder, path), 'w') as archive:
+                archive.writestr(prefix + "index.html", "<html></html>")
+                archive.writestr(prefix + "app/app.js", "// {}".format(prefix))
+        with open(os.path.join(self.folder, "manifest.json"), 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+
+class EchoNode(object):
+    # The TCP side of a zwave-socat-node, it echoes what the serial bridge sends and can be taken down
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self.lock = threading.Lock()
+        self.server = None
+        self.clients = set()
+        self.received = 0
+        self.start()
+
+    def start(self):
+        with self.lock:
+            if self.server is not None:
+                return
+            self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.server.bind((self.host, self.port))
+            self.server.listen(4)
+            self.port = self.server.getsockname()[1]
+            thread = threading.Thread(target=self.__accept, args=(self.server,), name="echo-node")
+            thread.daemon = True
+            thread.start()
+
+    # Refuses new connections and resets the current ones, like a node that lost power
+    def stop(self):
+        with self.lock:
+            server, self.server = self.server, None
+            clients, self.clients = self.clients, set()
+        if server is not None:
+            close_server(server)
+        for sock in clients:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+                # The echo thread blocked in recv keeps the socket open on Python 2, shutdown wakes it up
+                sock.shutdown(socket.SHUT_RDWR)
+                sock.close()
+            except socket.error:
+                pass
+
+    def get_clients(self):
+        return len(self.clients)
+
+    def __accept(self, server):
+        while True:
+            try:
+                sock, _ = server.accept()
+            except socket.error:
+                return
+            with self.lock:
+                self.clients.add(sock)
+            thread = threading.Thread(target=self.__echo, args=(sock,), name="echo-client")
+            thread.daemon = True
+            thread.start()
+
+    def __echo(self, sock):
+        try:
+            while True:
+                data = sock.recv(4096)
+                if not data:
+                    break
+                self.received += len(data)
+                sock.sendall(data)
+        except socket.error as e:
+            if e.errno not in (errno.ECONNRESET, errno.EBADF):
+                raise
+        finally:
+            with self.lock:
+                self.clients.discard(sock)
+            sock.close()
+
+
+class SimulatedNode(object):
+    # Publishes the Homie attributes of a zwave-socat-node through the broker
+
+    def __init__(self, broker, name, prefix="devices", host="127.0.0.1", port=None, retain=True):
+        self.broker = broker
+        self.name = name
+        self.prefix = prefix
+        self.host = host
+        self.port = port
+        self.retain = retain
+
+    def publish(self, attribute, payload):
+        self.broker.publish("{}/{}/{}".format(self.prefix, self.name, attribute), payload, self.retain)
+
+    def announce(self, online=True, socat_status=True):
+        self.publish("$fwname", "zwave-socat-node")
+        self.publish("$localip", self.host)
+        self.publish("socat/port", str(self.port))
+        self.publish("$online", "true" if online else "false")
+        self.publish("socat/status", "true" if socat_status else "false")
+        self.report()
+
+    def report(self, timestamp=None):
+        self.publish("time/last_report", str(int(timestamp if timestamp is not None else time.time())))
+
+    def set_online(self, online):
+        self.publish("$online", "true" if online else "false")
+
+    def set_socat_status(self, status):
+        self.publish("socat/status", "true" if status else "false")
@@ -0,0 +1,129 @@
+#!/usr/bin/python
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+import urllib2
+import logging
+import contextlib
+
+logger = logging.getLogger(__name__)
+
+
+class ArtifactCache(object):
+
+    CHUNK_SIZE = 64 * 1024
+    DOWNLOAD_TIMEOUT = 60
+
+    def __init__(self, folder="/var/cache/zwave-socat-controller"):
+        self.folder = folder
+        self.index_path = os.path.join(self.folder, "index.json")
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        self.index = self.__load_index()
+
+    # Returns the path of the cached artifact, downloading it first when needed. The expected hash is the one published
+    # by the catalog, a sha256 or the git blob sha1 of a GitHub tree
+    def fetch(self, url, version=None, max_age=None, expected_hash=None):
+        key = self.get_key(url, version)
+        with self.__get_key_lock(key):
+            entry = self.index.get(key)
+            if entry and self.__is_fresh(entry, version, max_age):
+                path = os.path.join(self.folder, entry["file"])
+                hashes = self.get_hashes(path)
+                if hashes["size"] == entry["size"] and hashes["sha256"] == entry["sha256"] and \
+                        self.matches(hashes, expected_hash):
+                    logger.debug("[ArtifactCache] '{}' served from the cache".format(entry["file"]))
+                    return path
+                logger.warning("[ArtifactCache] '{}' does not match its hash, downloading it again".format(entry["file"]))
+            return self.__download(key, url, version, expected_hash)
+
+    def install(self, url, destination, version=None, max_age=None, expected_hash=None):
+        self.copy_atomically(self.fetch(url, version, max_age, expected_hash), destination)
+
+    @staticmethod
+    def get_key(url, version=None):
+        return hashlib.sha1("{}\n{}".format(url, version or "")).hexdigest()
+
+    @staticmethod
+    def get_hashes(path):
+        size = os.path.getsize(path)
+        sha256 = hashlib.sha256()
+        blob_sha1 = hashlib.sha1("blob {}\0".format(size))
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(ArtifactCache.CHUNK_SIZE), b""):
+                sha256.update(chunk)
+                blob_sha1.update(chunk)
+        return {"size": size, "sha256": sha256.hexdigest(), "git": blob_sha1.hexdigest()}
+
+    @staticmethod
+    def matches(hashes, expected_hash):
+        return not expected_hash or expected_hash.lower() in (hashes["sha256"], hashes["git"])
+
+    @staticmethod
+    def copy_atomically(source, destination):
+        handle, temporary_path = tempfile.mkstemp(dir=os.path.dirname(destination), prefix=".tmp-")
+        try:
+            with os.fdopen(handle, 'wb') as f, open(source, 'rb') as s:
+                shutil.copyfileobj(s, f, ArtifactCache.CHUNK_SIZE)
+            os.chmod(temporary_path, 0644)
+            os.rename(temporary_path, destination)
+        except Exception:
+            os.remove(temporary_path)
+            raise
+
+    def __is_fresh(self, entry, version, max_age):
+        if not os.path.isfile(os.path.join(self.folder, entry["file"])):
+            return False
+        # Versioned artifacts never change, unversioned ones are refreshed after max_age seconds
+        if version or max_age is None:
+            return True
+        return time.time() - entry["time"] < max_age
+
+    def __download(self, key, url, version, expected_hash):
+        file_name = "{}-{}".format(key[:12], url.split("/")[-1].split("?")[0])
+        handle, temporary_path = tempfile.mkstemp(dir=self.folder, prefix=".download-")
+        try:
+            with os.fdopen(handle, 'wb') as f, contextlib.closing(urllib2.urlopen(url, timeout=self.DOWNLOAD_TIMEOUT)) as page:
+                for chunk in iter(lambda: page.read(self.CHUNK_SIZE), b""):
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            hashes = self.get_hashes(temporary_path)
+            if not self.matches(hashes, expected_hash):
+                raise IOError("'{}' does not match the catalog hash {}".format(url, expected_hash))
+            os.rename(temporary_path, os.path.join(self.folder, file_name))
+        except Exception:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+        with self.lock:
+            self.index[key] = {"url": url, "version": version, "file": file_name, "sha256": hashes["sha256"],
+                               "size": hashes["size"], "time": time.time()}
+            self.__save_index()
+        logger.info("[ArtifactCache] '{}' downloaded ({} bytes, sha256 {})".format(file_name, hashes["size"], hashes["sha256"][:12]))
+        return os.path.join(self.folder, file_name)
+
+    def __get_key_lock(self, key):
+        with self.lock:
+            return self.key_locks.setdefault(key, threading.Lock())
+
+    def __load_index(self):
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except (EnvironmentError, ValueError):
+            return {}
+
+    def __save_index(self):
+        temporary_path = self.index_path + ".tmp"
+        with open(temporary_path, 'w') as f:
+            json.dump(self.index, f, indent=2, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(temporary_path, self.index_path)
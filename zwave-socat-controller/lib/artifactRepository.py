@@ -0,0 +1,72 @@
+#!/usr/bin/python
+import os
+import urllib
+import urllib2
+import urlparse
+import logging
+from artifactCache import ArtifactCache
+from catalogHandler import parse_jar_name
+
+logger = logging.getLogger(__name__)
+
+
+class ArtifactRepository(object):
+
+    FOLDERS = {"zwave": "zwave", "habmin": "habmin"}
+
+    def __init__(self, cache, mirrors=None):
+        self.cache = cache
+        self.mirrors = []
+        for mirror in mirrors or []:
+            mirror = mirror.strip().rstrip("/")
+            if not mirror:
+                continue
+            if mirror.startswith("file://"):
+                self.mirrors.append(("local", urllib.url2pathname(urlparse.urlparse(mirror).path)))
+            elif "://" in mirror:
+                self.mirrors.append(("http", mirror))
+            else:
+                self.mirrors.append(("local", os.path.abspath(mirror)))
+        logger.debug("[ArtifactRepository] Mirrors: {}".format([location for _, location in self.mirrors]))
+
+    @staticmethod
+    def get_path(kind, url):
+        return "{}/{}".format(ArtifactRepository.FOLDERS[kind], ArtifactRepository.get_file_name(url))
+
+    @staticmethod
+    def get_file_name(url):
+        return urllib.unquote(url.split("/")[-1].split("?")[0])
+
+    # Returns a local path for the artifact, the mirrors are tried in order before the upstream url
+    def fetch(self, path, url, version=None, max_age=None, expected_hash=None):
+        for mirror_type, location in self.mirrors:
+            if mirror_type == "local":
+                local_path = os.path.join(location, *path.split("/"))
+                if not os.path.isfile(local_path):
+                    continue
+                if expected_hash and not ArtifactCache.matches(ArtifactCache.get_hashes(local_path), expected_hash):
+                    logger.warning("[ArtifactRepository] '{}' in '{}' does not match the catalog hash".format(path, location))
+                    continue
+                logger.debug("[ArtifactRepository] '{}' served from '{}'".format(path, location))
+                return local_path
+            try:
+                return self.cache.fetch("{}/{}".format(location, urllib.quote(path, safe="/()")), version, max_age, expected_hash)
+            except (EnvironmentError, urllib2.URLError) as e:
+                logger.debug("[ArtifactRepository] '{}' not available in '{}': {}".format(path, location, e))
+        return self.cache.fetch(url, version, max_age, expected_hash)
+
+    def install(self, path, url, destination, version=None, max_age=None, expected_hash=None):
+        ArtifactCache.copy_atomically(self.fetch(path, url, version, max_age, expected_hash), destination)
+
+    # Catalog entry for an artifact only present in the local mirrors, None if there is none
+    def lookup(self, kind, name):
+        for mirror_type, location in self.mirrors:
+            folder = os.path.join(location, self.FOLDERS[kind])
+            if mirror_type != "local" or not os.path.isdir(folder):
+                continue
+            for file_name in sorted(os.listdir(folder), reverse=True):
+                parsed_name = parse_jar_name(file_name)
+                if parsed_name and parsed_name[0] == kind and parsed_name[1] == name:
+                    return {"version": parsed_name[2], "date": parsed_name[3], "hash": None,
+                            "url": "file://" + urllib.quote(os.path.join(folder, file_name), safe="/()")}
+        return None
@@ -0,0 +1,95 @@
+#!/usr/bin/python
+import time
+import Queue
+import threading
+import logging
+import traceback
+import metricsHandler as mH
+from scheduler import get_scheduler
+
+logger = logging.getLogger(__name__)
+
+ACTIVATION_TIME = mH.histogram("zwave_node_healthy_to_binding_active_seconds",
+                               "Time from a node becoming healthy to its binding being ACTIVE", ["binding"])
+
+
+class BindingOrchestrator(object):
+
+    RETRY_DELAY = 5
+
+    def __init__(self, oh, workers=3):
+        self.oh = oh
+        self.desired = {}
+        self.applied = {}
+        self.activation_times = {}
+        self.pending = set()
+        self.in_flight = set()
+        self.lock = threading.Lock()
+        self.queue = Queue.Queue()
+        for number in range(workers):
+            worker = threading.Thread(target=self.__work, name="binding-worker-{}".format(number))
+            worker.daemon = True
+            worker.start()
+        logger.debug("[BindingOrchestrator] Service started with {} workers".format(workers))
+
+    # Only the latest intent per binding is kept, queued or running bindings just pick it up
+    def request(self, name, status):
+        with self.lock:
+            if name not in self.desired or self.desired[name][0] != status:
+                self.desired[name] = (status, time.time())
+            if name in self.pending or name in self.in_flight or self.applied.get(name) == status:
+                return
+            self.pending.add(name)
+        self.queue.put(name)
+
+    def get_status(self, name):
+        return self.applied.get(name)
+
+    def __work(self):
+        while True:
+            name = self.queue.get()
+            with self.lock:
+                self.pending.discard(name)
+                status, request_time = self.desired[name]
+                if self.applied.get(name) == status:
+                    continue
+                self.in_flight.add(name)
+            applied = False
+            try:
+                self.__apply(name, status, request_time)
+                applied = True
+            except Exception:
+                logger.error(traceback.format_exc())
+            with self.lock:
+                self.in_flight.discard(name)
+                if applied:
+                    self.applied[name] = status
+                requeue = applied and self.desired[name][0] != status
+                if requeue:
+                    self.pending.add(name)
+            if requeue:
+                self.queue.put(name)
+            elif not applied:
+                # A failed binding is not recorded as applied, so the retry goes through request again
+                get_scheduler().call_later(self.RETRY_DELAY, self.__retry, name, name="binding-retry-" + name)
+
+    def __retry(self, name):
+        with self.lock:
+            status = self.desired[name][0]
+        self.request(name, status)
+
+    def __apply(self, name, status, request_time):
+        if status:
+            if not self.oh.start_binding(name) and not self.oh.recover_binding(name, status):
+                logger.error("[%s] Binding has failed starting..." % (name))
+                self.oh.restart_openhab("'{}' binding failed starting".format(name))
+                return
+            self.activation_times[name] = time.time() - request_time
+            ACTIVATION_TIME.observe(self.activation_times[name], binding=name)
+            logger.info("[{0}] Binding active {1:.2f} seconds after the node became healthy".format(name, self.activation_times[name]))
+        else:
+            if not self.oh.stop_binding(name) and not self.oh.recover_binding(name, status):
+                logger.error("[%s] Binding has failed stopping..." % (name))
+                self.oh.restart_openhab("'{}' binding failed stopping".format(name))
+                return
+            logger.debug("[%s] Binding correctly stopped..." % (name))
@@ -0,0 +1,333 @@
+#!/usr/bin/python
+import os
+import pty
+import tty
+import grp
+import time
+import errno
+import fcntl
+import select
+import socket
+import threading
+import logging
+import traceback
+from zwaveFrames import FrameInspector
+from connectionManager import Backoff, set_keepalive, LINK_TIMEOUT, MAX_BACKOFF, LINK_FAILURES
+
+logger = logging.getLogger(__name__)
+
+# Not exported by the Python 2 select module
+EPOLLRDHUP = getattr(select, "EPOLLRDHUP", 0x2000)
+
+
+class PtyBridge(object):
+
+    def __init__(self, name, link, host, port, backoff, group="dialout", mode=0660, inspector=None):
+        self.name = name
+        self.backoff = backoff
+        self.inspector = inspector
+        self.link = link
+        self.address = (host, int(port))
+        self.master, self.slave = pty.openpty()
+        try:
+            self.__setup_pty(group, mode)
+        except (OSError, IOError):
+            os.close(self.master)
+            os.close(self.slave)
+            raise
+        self.sock = None
+        self.connected = False
+        self.connected_time = None
+        self.connect_deadline = None
+        self.reconnect_time = 0
+        self.link_up = None
+        self.failures = 0
+        self.reconnects = 0
+        self.to_tcp = bytearray()
+        self.to_pty = bytearray()
+
+    def __setup_pty(self, group, mode):
+        # The slave end is kept open so the master never reads EIO while openHAB has the port closed
+        tty.setraw(self.slave)
+        for fd in (self.master, self.slave):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        slave_path = os.ttyname(self.slave)
+        try:
+            os.chown(slave_path, -1, grp.getgrnam(group).gr_gid)
+        except KeyError:
+            logger.warning("[{}] '{}' group not found, keeping the pty group".format(self.name, group))
+        os.chmod(slave_path, mode)
+        temporary_link = "{}.{}".format(self.link, os.getpid())
+        if os.path.lexists(temporary_link):
+            os.remove(temporary_link)
+        os.symlink(slave_path, temporary_link)
+        os.rename(temporary_link, self.link)
+
+    def connect(self, link_timeout):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        set_keepalive(self.sock)
+        self.sock.setblocking(0)
+        self.connected = False
+        self.connect_deadline = time.time() + link_timeout
+        error = self.sock.connect_ex(self.address)
+        if error not in (0, errno.EINPROGRESS):
+            raise socket.error(error, os.strerror(error))
+
+    def disconnect(self):
+        if self.sock is not None:
+            self.sock.close()
+        self.sock = None
+        self.connected = False
+        del self.to_tcp[:]
+        del self.to_pty[:]
+        if self.inspector is not None:
+            self.inspector.reset()
+
+    def close(self):
+        self.disconnect()
+        os.close(self.master)
+        os.close(self.slave)
+        if os.path.islink(self.link):
+            os.remove(self.link)
+
+
+class BridgeEngine(object):
+
+    RECONNECT_DELAY = 0.1
+    BUFFER_SIZE = 4096
+
+    def __init__(self, frame_inspection=False, link_timeout=LINK_TIMEOUT, max_backoff=MAX_BACKOFF):
+        self.frame_inspection = frame_inspection
+        self.link_timeout = link_timeout
+        self.max_backoff = max_backoff
+        # Called with the node name and the link state when a connection is established or cannot be
+        self.on_link_change = None
+        self.bridges = {}
+        self.fds = {}
+        self.lock = threading.Lock()
+        self.commands = []
+        self.poller = select.epoll()
+        self.wakeup_read, self.wakeup_write = os.pipe()
+        fcntl.fcntl(self.wakeup_read, fcntl.F_SETFL, os.O_NONBLOCK)
+        self.poller.register(self.wakeup_read, select.EPOLLIN)
+        self.running = True
+        self.thread = threading.Thread(target=self.__run, name="bridge-engine")
+        self.thread.daemon = True
+        self.thread.start()
+        logger.debug("[BridgeEngine] Service started")
+
+    # Public methods, safe to call from any thread
+
+    def start(self, name, link, host, port):
+        self.__submit(self.__add_bridge, name, link, host, port)
+
+    def stop(self, name):
+        self.__submit(self.__remove_bridge, name)
+        return True
+
+    def is_running(self, name):
+        return name in self.bridges
+
+    def get_names(self):
+        return self.bridges.keys()
+
+    def status(self, name):
+        bridge = self.bridges.get(name)
+        if bridge is None:
+            return None
+        status = {"running": bridge.connected, "restarts": bridge.reconnects,
+                  "uptime": time.time() - bridge.connected_time if bridge.connected else 0}
+        if bridge.inspector is not None:
+            status["frames"] = bridge.inspector.get_stats()
+        return status
+
+    def shutdown(self):
+        self.__submit(self.__shutdown)
+        self.thread.join()
+
+    # Event loop
+
+    def __submit(self, command, *args):
+        with self.lock:
+            self.commands.append((command, args))
+        os.write(self.wakeup_write, "x")
+
+    def __run(self):
+        while self.running:
+            events = self.poller.poll(self.__get_poll_timeout())
+            for fd, event in events:
+                if fd == self.wakeup_read:
+                    self.__run_commands()
+                elif fd in self.fds:
+                    bridge, side = self.fds[fd]
+                    try:
+                        self.__handle_event(bridge, side, event)
+                    except (OSError, IOError, socket.error) as e:
+                        self.__handle_failure(bridge, e)
+            self.__check_connections()
+            self.__reconnect_bridges()
+
+    def __run_commands(self):
+        try:
+            while os.read(self.wakeup_read, 512):
+                pass
+        except OSError:
+            pass
+        with self.lock:
+            commands, self.commands = self.commands, []
+        for command, args in commands:
+            try:
+                command(*args)
+            except Exception:
+                logger.error(traceback.format_exc())
+
+    def __get_poll_timeout(self):
+        pending = [bridge.reconnect_time if bridge.sock is None else bridge.connect_deadline
+                   for bridge in self.bridges.itervalues() if not bridge.connected]
+        if not pending:
+            return -1
+        return max(0, min(pending) - time.time())
+
+    def __handle_event(self, bridge, side, event):
+        if side == "tcp":
+            if not bridge.connected:
+                error = bridge.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if error:
+                    raise socket.error(error, os.strerror(error))
+                bridge.connected = True
+                bridge.connected_time = time.time()
+                bridge.backoff.reset()
+                bridge.failures = 0
+                logger.debug("[{}] Bridge connected to {}:{}".format(bridge.name, *bridge.address))
+                self.__notify_link(bridge, True)
+            elif event & (select.EPOLLHUP | select.EPOLLERR):
+                raise socket.error(errno.ECONNRESET, "connection closed")
+            elif event & EPOLLRDHUP and not event & select.EPOLLIN:
+                # While reading is paused the half-close would be reported on every poll, the node is gone anyway
+                raise socket.error(errno.ECONNRESET, "connection closed by the remote node")
+            if event & select.EPOLLIN:
+                data = bridge.sock.recv(self.BUFFER_SIZE)
+                if not data:
+                    raise socket.error(errno.ECONNRESET, "connection closed by the remote node")
+                start = len(bridge.to_pty)
+                bridge.to_pty += data
+                if bridge.inspector is not None:
+                    bridge.inspector.controller_data(bridge.to_pty, start)
+        else:
+            if event & select.EPOLLIN:
+                start = len(bridge.to_tcp)
+                bridge.to_tcp += os.read(bridge.master, self.BUFFER_SIZE)
+                if bridge.inspector is not None:
+                    bridge.inspector.host_data(bridge.to_tcp, start)
+        if bridge.to_pty:
+            try:
+                written = os.write(bridge.master, bridge.to_pty)
+                del bridge.to_pty[:written]
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    raise
+        if bridge.to_tcp and bridge.connected:
+            try:
+                sent = bridge.sock.send(bridge.to_tcp)
+                del bridge.to_tcp[:sent]
+            except socket.error as e:
+                if e.errno != errno.EAGAIN:
+                    raise
+        self.__update_interest(bridge)
+
+    # While one side has data pending, stop reading from the other one and wait for it to drain
+    def __update_interest(self, bridge):
+        if bridge.sock is None:
+            return
+        if not bridge.connected:
+            tcp_events = select.EPOLLOUT
+        else:
+            tcp_events = select.EPOLLOUT if bridge.to_tcp else 0
+            if not bridge.to_pty:
+                tcp_events |= select.EPOLLIN
+        pty_events = select.EPOLLOUT if bridge.to_pty else 0
+        if not bridge.to_tcp:
+            pty_events |= select.EPOLLIN
+        self.poller.modify(bridge.sock.fileno(), tcp_events | EPOLLRDHUP)
+        self.poller.modify(bridge.master, pty_events)
+
+    # A lost connection is retried right away, only repeated failed connection attempts mean the link is down
+    def __handle_failure(self, bridge, error):
+        if bridge.connected:
+            logger.debug("[{}] Bridge connection lost: {}".format(bridge.name, error))
+        else:
+            bridge.failures += 1
+            logger.debug("[{}] Bridge connection failed ({}): {}".format(bridge.name, bridge.failures, error))
+            if bridge.failures >= LINK_FAILURES:
+                self.__notify_link(bridge, False)
+        self.__schedule_reconnect(bridge)
+
+    def __notify_link(self, bridge, up):
+        if bridge.link_up == up:
+            return
+        bridge.link_up = up
+        if self.on_link_change is None:
+            return
+        try:
+            self.on_link_change(bridge.name, up)
+        except Exception:
+            logger.error(traceback.format_exc())
+
+    def __schedule_reconnect(self, bridge):
+        if bridge.sock is not None:
+            fd = bridge.sock.fileno()
+            if fd in self.fds:
+                self.poller.unregister(fd)
+                del self.fds[fd]
+        bridge.disconnect()
+        bridge.reconnects += 1
+        bridge.reconnect_time = time.time() + bridge.backoff.next_delay()
+        # Without a connection the pty is not read, so openHAB writes stay in the tty buffer
+        self.poller.modify(bridge.master, 0)
+
+    # Without a deadline a connection to a silent host would only fail after the kernel SYN retries, minutes later
+    def __check_connections(self):
+        now = time.time()
+        for bridge in self.bridges.values():
+            if bridge.sock is not None and not bridge.connected and bridge.connect_deadline <= now:
+                self.__handle_failure(bridge, socket.error(errno.ETIMEDOUT, os.strerror(errno.ETIMEDOUT)))
+
+    def __reconnect_bridges(self):
+        now = time.time()
+        for bridge in self.bridges.values():
+            if bridge.sock is not None or bridge.reconnect_time > now:
+                continue
+            try:
+                bridge.connect(self.link_timeout)
+            except socket.error as e:
+                self.__handle_failure(bridge, e)
+                continue
+            self.fds[bridge.sock.fileno()] = (bridge, "tcp")
+            self.poller.register(bridge.sock.fileno(), select.EPOLLOUT | EPOLLRDHUP)
+            self.__update_interest(bridge)
+
+    def __add_bridge(self, name, link, host, port):
+        if name in self.bridges:
+            self.__remove_bridge(name)
+        inspector = FrameInspector(name) if self.frame_inspection else None
+        bridge = PtyBridge(name, link, host, port, Backoff(self.RECONNECT_DELAY, self.max_backoff), inspector=inspector)
+        self.bridges[name] = bridge
+        self.fds[bridge.master] = (bridge, "pty")
+        self.poller.register(bridge.master, 0)
+        logger.debug("[{}] Bridge started: {} <-> {}:{}".format(name, link, host, port))
+
+    def __remove_bridge(self, name):
+        bridge = self.bridges.pop(name, None)
+        if bridge is None:
+            return
+        for fd in [fd for fd, (fd_bridge, side) in self.fds.items() if fd_bridge is bridge]:
+            self.poller.unregister(fd)
+            del self.fds[fd]
+        bridge.close()
+        logger.debug("[{}] Bridge stopped".format(name))
+
+    def __shutdown(self):
+        for name in self.bridges.keys():
+            self.__remove_bridge(name)
+        self.running = False
@@ -0,0 +1,66 @@
+#!/usr/bin/python
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class BundleStateMonitor(object):
+
+    MIN_INTERVAL = 0.05
+    MAX_INTERVAL = 1.0
+    BACKOFF_FACTOR = 1.5
+
+    def __init__(self, refresh):
+        self.refresh = refresh
+        self.condition = threading.Condition()
+        self.snapshot = None
+        self.snapshot_time = 0
+        self.interval = self.MIN_INTERVAL
+        self.waiters = 0
+        self.poller = None
+
+    # Returns the observed transition time of each bundle id, None if it timed out
+    def wait_for(self, targets, timeout):
+        start_time = time.time()
+        deadline = start_time + timeout
+        reached = {}
+        with self.condition:
+            self.waiters += 1
+            self.interval = self.MIN_INTERVAL
+            if self.poller is None:
+                self.poller = threading.Thread(target=self.__poll)
+                self.poller.daemon = True
+                self.poller.start()
+            try:
+                while True:
+                    # Only snapshots taken after the wait started can prove a transition
+                    if self.snapshot is not None and self.snapshot_time >= start_time:
+                        for bundle_id, state in targets.iteritems():
+                            if bundle_id not in reached and self.snapshot.get_state(bundle_id) == state:
+                                reached[bundle_id] = self.snapshot_time - start_time
+                    remaining = deadline - time.time()
+                    if len(reached) == len(targets) or remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+            finally:
+                self.waiters -= 1
+        return {bundle_id: reached.get(bundle_id) for bundle_id in targets}
+
+    def __poll(self):
+        while True:
+            with self.condition:
+                if not self.waiters:
+                    self.poller = None
+                    return
+                interval = self.interval
+                self.interval = min(self.interval * self.BACKOFF_FACTOR, self.MAX_INTERVAL)
+            poll_time = time.time()
+            snapshot = self.refresh()
+            with self.condition:
+                if snapshot is not None:
+                    self.snapshot = snapshot
+                    self.snapshot_time = poll_time
+                self.condition.notify_all()
+            time.sleep(interval)
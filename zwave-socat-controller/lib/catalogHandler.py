@@ -0,0 +1,214 @@
+#!/usr/bin/python
+import os
+import re
+import json
+import time
+import urllib
+import urllib2
+import urlparse
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+ZWAVE_JAR_PATTERN = re.compile(r'^org\.openhab\.binding\.(zwave\d*)\_([\d\.]*)\(([\d\.\-]*)\)\.jar$')
+HABMIN_JAR_PATTERN = re.compile(r'^org\.openhab\.io\.habmin\_([^\s]*)\_([\d\.]*)\(([\d\.\-]*)\)\.jar$')
+
+
+def conditional_get(url, validators, timeout=30):
+    # Returns (None, validators) when the resource has not changed since the given validators
+    request = urllib2.Request(url, headers={"User-Agent": "zwave-socat-controller"})
+    if validators.get("etag"):
+        request.add_header("If-None-Match", validators["etag"])
+    if validators.get("last_modified"):
+        request.add_header("If-Modified-Since", validators["last_modified"])
+    try:
+        response = urllib2.urlopen(request, timeout=timeout)
+    except urllib2.HTTPError as e:
+        if e.code == 304:
+            return None, validators
+        raise
+    new_validators = {}
+    if response.info().getheader("ETag"):
+        new_validators["etag"] = response.info().getheader("ETag")
+    if response.info().getheader("Last-Modified"):
+        new_validators["last_modified"] = response.info().getheader("Last-Modified")
+    return response.read(), new_validators
+
+
+def parse_jar_name(file_name):
+    zwave_search = ZWAVE_JAR_PATTERN.match(file_name)
+    if zwave_search:
+        return "zwave", zwave_search.group(1), zwave_search.group(2), zwave_search.group(3)
+    habmin_search = HABMIN_JAR_PATTERN.match(file_name)
+    if habmin_search:
+        return "habmin", habmin_search.group(1), habmin_search.group(2), habmin_search.group(3)
+    return None
+
+
+class GitHubSource(object):
+
+    def __init__(self, user, project, zwave_folder="zwave", habmin_folder="habmin", api_url="https://api.github.com",
+                 raw_url="https://github.com"):
+        self.user = user
+        self.project = project
+        self.folders = (zwave_folder, habmin_folder)
+        self.api_url = api_url.rstrip("/")
+        self.raw_url = raw_url.rstrip("/")
+
+    def __str__(self):
+        return "github:{}/{}".format(self.user, self.project)
+
+    # Only a new commit on master can change the catalog, so that is the single conditional request
+    def fetch(self, validators):
+        commit_url = "{}/repos/{}/{}/commits/master".format(self.api_url, self.user, self.project)
+        commit, new_validators = conditional_get(commit_url, validators)
+        if commit is None:
+            return None, validators
+        tree_url = "{}/repos/{}/{}/git/trees/{}?recursive=1".format(self.api_url, self.user, self.project,
+                                                                   json.loads(commit)["sha"])
+        tree, _ = conditional_get(tree_url, {})
+        index = {"zwave": {}, "habmin": {}}
+        for entry in json.loads(tree)["tree"]:
+            folder, _, file_name = entry["path"].rpartition("/")
+            parsed_name = parse_jar_name(file_name)
+            if entry["type"] != "blob" or folder not in self.folders or not parsed_name:
+                continue
+            kind, name, version, date = parsed_name
+            url = "{}/{}/{}/blob/master/{}?raw=true".format(self.raw_url, self.user, self.project, urllib.quote(entry["path"], safe="/()"))
+            index[kind][name] = {"version": version, "date": date, "url": url, "hash": entry["sha"]}
+        return index, new_validators
+
+
+class ManifestSource(object):
+
+    def __init__(self, url):
+        self.url = url if "://" in url else "file://" + os.path.abspath(url)
+
+    def __str__(self):
+        return "manifest:{}".format(self.url)
+
+    def fetch(self, validators):
+        if self.url.startswith("file://"):
+            mtime = os.path.getmtime(self.url[len("file://"):])
+            if validators.get("mtime") == mtime:
+                return None, validators
+            manifest, new_validators = urllib2.urlopen(self.url).read(), {"mtime": mtime}
+        else:
+            manifest, new_validators = conditional_get(self.url, validators)
+            if manifest is None:
+                return None, validators
+        manifest = json.loads(manifest)
+        index = {"zwave": {}, "habmin": {}}
+        for kind in index:
+            for name, info in manifest.get(kind, {}).iteritems():
+                index[kind][name] = {"version": info["version"], "date": info.get("date", ""),
+                                     "url": urlparse.urljoin(self.url, info["url"]), "hash": info.get("sha256")}
+        return index, new_validators
+
+
+class DirectorySource(object):
+
+    def __init__(self, folder):
+        self.folder = os.path.abspath(folder)
+
+    def __str__(self):
+        return "directory:{}".format(self.folder)
+
+    def fetch(self, validators):
+        listing = []
+        for root, folders, files in os.walk(self.folder):
+            listing.extend(os.path.join(root, file_name) for file_name in files if file_name.endswith(".jar"))
+        signature = sorted([path, os.path.getmtime(path)] for path in listing)
+        if validators.get("signature") == signature:
+            return None, validators
+        index = {"zwave": {}, "habmin": {}}
+        for path in listing:
+            parsed_name = parse_jar_name(os.path.basename(path))
+            if not parsed_name:
+                continue
+            kind, name, version, date = parsed_name
+            index[kind][name] = {"version": version, "date": date, "url": "file://" + urllib.quote(path, safe="/()"), "hash": None}
+        return index, {"signature": signature}
+
+
+def get_source(description, user, project):
+    if not description or description == "github":
+        return GitHubSource(user, project)
+    if os.path.isdir(description) or description.startswith("dir://"):
+        return DirectorySource(description.replace("dir://", "", 1))
+    return ManifestSource(description)
+
+
+class CatalogHandler(object):
+
+    def __init__(self, source, catalog_file):
+        self.source = source
+        self.catalog_file = catalog_file
+        self.lock = threading.Lock()
+        self.index = {"zwave": {}, "habmin": {}}
+        self.validators = {}
+        self.last_update = None
+        self.load()
+
+    def get(self, kind):
+        return self.index[kind]
+
+    def load(self):
+        try:
+            with open(self.catalog_file) as f:
+                catalog = json.load(f)
+        except (EnvironmentError, ValueError):
+            return
+        self.index["zwave"].update(catalog.get("zwave", {}))
+        self.index["habmin"].update(catalog.get("habmin", {}))
+        self.last_update = catalog.get("last_update")
+        # Validators only apply to the source they were obtained from
+        if catalog.get("source") == str(self.source):
+            self.validators = catalog.get("validators", {})
+        logger.debug("[CatalogHandler] Last known catalog loaded")
+
+    def save(self):
+        catalog = {"zwave": self.index["zwave"], "habmin": self.index["habmin"], "last_update": self.last_update,
+                   "source": str(self.source), "validators": self.validators}
+        temporary_path = self.catalog_file + ".tmp"
+        try:
+            with open(temporary_path, 'w') as f:
+                json.dump(catalog, f, indent=2, sort_keys=True)
+            os.rename(temporary_path, self.catalog_file)
+        except EnvironmentError as e:
+            logger.error("[CatalogHandler] Catalog cannot be saved: {}".format(e))
+
+    # Returns the number of changed entries, 0 when the source reported no changes
+    def refresh(self):
+        with self.lock:
+            try:
+                new_index, validators = self.source.fetch(self.validators)
+            except (EnvironmentError, ValueError, KeyError, urllib2.URLError) as e:
+                logger.error("[CatalogHandler] '{}' catalog cannot be refreshed: {}".format(self.source, e))
+                return 0
+            self.last_update = time.time()
+            if new_index is None:
+                logger.debug("[CatalogHandler] '{}' catalog not modified".format(self.source))
+                self.save()
+                return 0
+            changes = 0
+            for kind in self.index:
+                changes += self.__apply_changes(kind, new_index[kind])
+            self.validators = validators
+            self.save()
+            logger.info("[CatalogHandler] '{}' catalog refreshed, {} changes".format(self.source, changes))
+            return changes
+
+    # The dicts are updated in place, so readers holding a reference always see the latest entries
+    def __apply_changes(self, kind, new_entries):
+        entries = self.index[kind]
+        changes = 0
+        for name in [name for name in entries if name not in new_entries]:
+            del entries[name]
+            changes += 1
+        for name, info in new_entries.iteritems():
+            if entries.get(name) != info:
+                entries[name] = info
+                changes += 1
+        return changes
@@ -0,0 +1,181 @@
+#!/usr/bin/python
+import os
+import re
+import tempfile
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+ZWAVE_SECTION_PATTERN = re.compile(r'\#+\s+Z-Wave\s+Binding\s+\#+(.*)\n#+\s+Nikobus', re.DOTALL)
+JAVA_ARGS_KEYWORD = "JAVA_ARGS="
+SERIAL_PORTS_KEYWORD = "-Dgnu.io.rxtx.SerialPorts="
+
+LOGGER_TEMPLATE = '\t<logger name="org.openhab.binding.{0}" level="{1}" additivity="false">\n' \
+                  '\t\t<appender-ref ref="{2}FILE" />\n\t</logger>'
+APPENDER_TEMPLATE = '\t<appender name="{0}FILE" class="ch.qos.logback.core.rolling.RollingFileAppender">\n' \
+                    '\t\t<file>${{openhab.logdir:-logs}}/{1}.log</file>\n' \
+                    '\t\t<rollingPolicy class="ch.qos.logback.core.rolling.TimeBasedRollingPolicy">\n' \
+                    '\t\t\t<fileNamePattern>${{openhab.logdir:-logs}}/{1}-%d{{yyyy-ww}}.log.zip</fileNamePattern>\n' \
+                    '\t\t\t<maxHistory>15</maxHistory>\n' \
+                    '\t\t</rollingPolicy>\n' \
+                    '\t\t<encoder>\n' \
+                    '\t\t\t<pattern>%d{{yyyy-MM-dd HH:mm:ss.SSS}} [%-5level] [%-30.30logger{{36}}:%-4line]- ' \
+                    '%msg%n</pattern>\n' \
+                    '\t\t</encoder>\n' \
+                    '\t</appender>'
+
+
+# Lines for new bindings are read when their bundle starts, only a changed port needs a restart
+def reconcile_openhab_configuration(content, zwave_bindings):
+    section_search = ZWAVE_SECTION_PATTERN.search(content)
+    section = section_search.group(1) if section_search else content
+    new_section = section
+    changes = []
+    port_changed = False
+    for binding in zwave_bindings:
+        port = "/dev/{}".format(binding)
+        port_search = re.search(r'^{}:port=(.*)$'.format(re.escape(binding)), new_section, re.MULTILINE)
+        if port_search:
+            if port_search.group(1) != port:
+                new_section = "{}{}:port={}{}".format(new_section[:port_search.start()], binding, port, new_section[port_search.end():])
+                changes.append("{} port changed to {}".format(binding, port))
+                port_changed = True
+        else:
+            if new_section and not new_section.endswith("\n"):
+                new_section += "\n"
+            new_section += "{}:port={}\n".format(binding, port)
+            changes.append("{} port added".format(binding))
+    if not section_search:
+        return new_section, changes, port_changed
+    return content[:section_search.start(1)] + new_section + content[section_search.end(1):], changes, port_changed
+
+
+def get_zwave_ports(zwave_bindings, spare_ports=0):
+    numbers = sorted(set(1 if binding == "zwave" else int(binding[len("zwave"):]) for binding in zwave_bindings))
+    if spare_ports:
+        numbers += range(max(numbers or [0]) + 1, max(numbers or [0]) + 1 + spare_ports)
+    return ["/dev/zwave" if number == 1 else "/dev/zwave{}".format(number) for number in numbers]
+
+
+# rxtx only reads the serial ports list when openHAB starts, so spare ports are listed ahead of time and
+# only a port that is needed and not listed yet requires a restart
+def reconcile_default_file(content, zwave_bindings, spare_ports=0):
+    required_ports = get_zwave_ports(zwave_bindings)
+    zwave_ports = get_zwave_ports(zwave_bindings, spare_ports)
+    lines = content.split("\n")
+    for number, line in enumerate(lines):
+        if not line.startswith(JAVA_ARGS_KEYWORD):
+            continue
+        java_args = [arg for arg in line[len(JAVA_ARGS_KEYWORD):].replace('"', '').split(" ") if arg]
+        other_java_args = [arg for arg in java_args if SERIAL_PORTS_KEYWORD not in arg]
+        serial_ports = []
+        for arg in java_args:
+            if SERIAL_PORTS_KEYWORD in arg:
+                serial_ports = [port for port in arg.replace(SERIAL_PORTS_KEYWORD, '').split(":") if port]
+                break
+        configured_zwave_ports = [port for port in serial_ports if "zwave" in port]
+        other_ports = [port for port in serial_ports if "zwave" not in port]
+        new_java_args = " ".join([SERIAL_PORTS_KEYWORD + ":".join(zwave_ports + other_ports)] + other_java_args)
+        lines[number] = '{}"{}"'.format(JAVA_ARGS_KEYWORD, new_java_args)
+        changes = ["serial port {} added".format(port) for port in zwave_ports if port not in configured_zwave_ports] + \
+                  ["serial port {} removed".format(port) for port in configured_zwave_ports if port not in zwave_ports]
+        if lines[number] != line and not changes:
+            changes.append("serial ports reordered")
+        return "\n".join(lines), changes, bool(set(required_ports) - set(configured_zwave_ports))
+    return content, [], False
+
+
+def reconcile_logback_file(content, zwave_bindings, log_level):
+    changes = []
+    root_logger = '<logger name="org.openhab" level="{}"{}/>'.format(log_level.upper(), " " if log_level == "debug" else "")
+    busevents_logger = '\t<logger name="runtime.busevents" level="INFO" additivity="false">'
+    for binding in zwave_bindings:
+        if '<logger name="org.openhab.binding.{}"'.format(binding) not in content and root_logger in content:
+            content = content.replace(root_logger, root_logger + "\n\n" + LOGGER_TEMPLATE.format(binding, log_level.upper(), binding.upper()))
+            changes.append("{} logger added".format(binding))
+        if '<appender name="{}FILE"'.format(binding.upper()) not in content and busevents_logger in content:
+            content = content.replace(busevents_logger, APPENDER_TEMPLATE.format(binding.upper(), binding) + "\n\n" + busevents_logger)
+            changes.append("{} appender added".format(binding))
+    return content, changes
+
+
+def write_atomically(path, content):
+    handle, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix="." + os.path.basename(path) + "-")
+    try:
+        with os.fdopen(handle, 'w') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            stat = os.stat(path)
+            os.chmod(temporary_path, stat.st_mode & 07777)
+            os.chown(temporary_path, stat.st_uid, stat.st_gid)
+        else:
+            os.chmod(temporary_path, 0644)
+        os.rename(temporary_path, path)
+    except Exception:
+        os.remove(temporary_path)
+        raise
+
+
+class ConfigReconciler(object):
+
+    def __init__(self, configuration_folder="/etc/openhab/configurations", default_file="/etc/default/openhab", spare_serial_ports=2):
+        self.spare_serial_ports = spare_serial_ports
+        self.configuration_path = configuration_folder + "/openhab.cfg"
+        self.configuration_default_path = configuration_folder + "/openhab_default.cfg"
+        self.default_file = default_file
+        logback_folder = os.path.dirname(configuration_folder.rstrip("/"))
+        self.logback_files = [(os.path.join(logback_folder, "logback.xml"), "info"),
+                              (os.path.join(logback_folder, "logback_debug.xml"), "debug")]
+        self.lock = threading.Lock()
+        self.last_state = None
+
+    # Returns True when openHAB has to be restarted to apply the reconciled files
+    def reconcile(self, zwave_bindings):
+        with self.lock:
+            state = (sorted(zwave_bindings), self.__get_files_signature())
+            if state == self.last_state:
+                logger.debug("[ConfigReconciler] Nothing changed since the last reconciliation")
+                return False
+            writes = []
+            source_path = self.configuration_path
+            if not os.path.exists(source_path):
+                source_path = self.configuration_default_path
+            content = self.__read(source_path)
+            new_content, changes, restart = reconcile_openhab_configuration(content, zwave_bindings)
+            if changes:
+                writes.append((self.configuration_path, new_content, changes))
+            content = self.__read(self.default_file)
+            new_content, changes, ports_added = reconcile_default_file(content, zwave_bindings, self.spare_serial_ports)
+            if new_content != content:
+                writes.append((self.default_file, new_content, changes))
+                restart = restart or ports_added
+            for logback_file, log_level in self.logback_files:
+                content = self.__read(logback_file)
+                new_content, changes = reconcile_logback_file(content, zwave_bindings, log_level)
+                if changes:
+                    writes.append((logback_file, new_content, changes))
+            for path, new_content, changes in writes:
+                write_atomically(path, new_content)
+                logger.info("[ConfigReconciler] '{}' updated: {}".format(path, ", ".join(changes)))
+            self.last_state = (sorted(zwave_bindings), self.__get_files_signature())
+            if not writes:
+                logger.debug("[ConfigReconciler] Configuration files already reconciled")
+            return restart
+
+    def __read(self, path):
+        with open(path, 'r') as f:
+            return f.read()
+
+    def __get_files_signature(self):
+        signature = []
+        for path in [self.configuration_path, self.configuration_default_path, self.default_file] + \
+                [logback_file for logback_file, _ in self.logback_files]:
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_ino, stat.st_mtime, stat.st_size))
+            except OSError:
+                signature.append(None)
+        return signature
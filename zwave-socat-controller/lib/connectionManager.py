@@ -0,0 +1,222 @@
+#!/usr/bin/python
+import os
+import time
+import math
+import errno
+import fcntl
+import random
+import select
+import socket
+import threading
+import logging
+import traceback
+
+logger = logging.getLogger(__name__)
+
+# Not exported by the Python 2 socket module
+TCP_USER_TIMEOUT = getattr(socket, "TCP_USER_TIMEOUT", 18)
+
+LINK_TIMEOUT = 1 # seconds a connection attempt or a probe may take
+KEEPALIVE_IDLE = 1
+KEEPALIVE_INTERVAL = 1
+KEEPALIVE_COUNT = 2
+# An established link tolerates ACK stalls as long as the keepalive probes would, Wi-Fi nodes have second-long ones
+USER_TIMEOUT = KEEPALIVE_IDLE + KEEPALIVE_INTERVAL * KEEPALIVE_COUNT
+MAX_BACKOFF = 60
+LINK_FAILURES = 3 # consecutive failed connections before a link is reported down, a node restarting socat refuses a few
+
+
+class Backoff(object):
+
+    def __init__(self, initial, maximum=MAX_BACKOFF, multiplier=2, jitter=0.5):
+        self.initial = initial
+        self.maximum = maximum
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.attempts = 0
+
+    # The jitter spreads the retries of the nodes that went down together
+    def next_delay(self):
+        delay = min(self.maximum, self.initial * math.pow(self.multiplier, self.attempts))
+        self.attempts += 1
+        return delay * (1 - self.jitter * random.random())
+
+    def reset(self):
+        self.attempts = 0
+
+
+def set_keepalive(sock, timeout=USER_TIMEOUT):
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, KEEPALIVE_IDLE)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, KEEPALIVE_INTERVAL)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, KEEPALIVE_COUNT)
+    # Unacknowledged data or keepalive probes abort the connection after the timeout instead of the 15 minutes of retransmissions
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, TCP_USER_TIMEOUT, int(timeout * 1000))
+    except socket.error as e:
+        logger.debug("[ConnectionManager] TCP_USER_TIMEOUT not supported: {}".format(e))
+
+
+class LinkTarget(object):
+
+    def __init__(self, name, host, port, on_result, backoff):
+        self.name = name
+        self.address = (host, int(port))
+        self.on_result = on_result
+        self.backoff = backoff
+        self.sock = None
+        self.deadline = 0
+        self.probes = 0
+        self.failures = 0
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+        self.sock = None
+
+
+class ConnectionManager(object):
+    # Probes the links of the nodes without a bridge, every probe is a non-blocking connect closed as soon as it completes
+
+    INITIAL_BACKOFF = 0.25
+
+    def __init__(self, timeout=LINK_TIMEOUT, max_backoff=MAX_BACKOFF):
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.targets = {}
+        self.fds = {}
+        self.lock = threading.Lock()
+        self.commands = []
+        self.poller = select.epoll()
+        self.wakeup_read, self.wakeup_write = os.pipe()
+        fcntl.fcntl(self.wakeup_read, fcntl.F_SETFL, os.O_NONBLOCK)
+        self.poller.register(self.wakeup_read, select.EPOLLIN)
+        self.running = True
+        self.thread = threading.Thread(target=self.__run, name="connection-manager")
+        self.thread.daemon = True
+        self.thread.start()
+        logger.debug("[ConnectionManager] Service started")
+
+    # Public methods, safe to call from any thread
+
+    # The first probe is sent right away, the next ones back off until one succeeds or the target is unwatched
+    def watch(self, name, host, port, on_result):
+        self.__submit(self.__add_target, name, host, port, on_result)
+
+    def unwatch(self, name):
+        self.__submit(self.__remove_target, name)
+
+    def is_watched(self, name):
+        return name in self.targets
+
+    def get_stats(self):
+        return dict((name, {"probes": target.probes, "failures": target.failures})
+                    for name, target in self.targets.items())
+
+    def shutdown(self):
+        self.__submit(self.__shutdown)
+        self.thread.join()
+
+    # Event loop
+
+    def __submit(self, command, *args):
+        with self.lock:
+            self.commands.append((command, args))
+        os.write(self.wakeup_write, "x")
+
+    def __run(self):
+        while self.running:
+            events = self.poller.poll(self.__get_poll_timeout())
+            for fd, event in events:
+                if fd == self.wakeup_read:
+                    self.__run_commands()
+                elif fd in self.fds:
+                    target = self.fds[fd]
+                    error = target.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    self.__complete(target, error)
+            self.__check_targets()
+
+    def __run_commands(self):
+        try:
+            while os.read(self.wakeup_read, 512):
+                pass
+        except OSError:
+            pass
+        with self.lock:
+            commands, self.commands = self.commands, []
+        for command, args in commands:
+            try:
+                command(*args)
+            except Exception:
+                logger.error(traceback.format_exc())
+
+    def __get_poll_timeout(self):
+        if not self.targets:
+            return -1
+        return max(0, min(target.deadline for target in self.targets.itervalues()) - time.time())
+
+    # A due target without a socket starts a probe, one with a socket has timed out
+    def __check_targets(self):
+        now = time.time()
+        for target in self.targets.values():
+            if target.deadline > now:
+                continue
+            if target.sock is not None:
+                self.__complete(target, errno.ETIMEDOUT)
+            else:
+                self.__probe(target, now)
+
+    def __probe(self, target, now):
+        target.probes += 1
+        target.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        target.sock.setblocking(0)
+        error = target.sock.connect_ex(target.address)
+        if error not in (0, errno.EINPROGRESS):
+            self.__complete(target, error)
+            return
+        target.deadline = now + self.timeout
+        self.fds[target.sock.fileno()] = target
+        self.poller.register(target.sock.fileno(), select.EPOLLOUT)
+
+    def __complete(self, target, error):
+        if target.sock is not None:
+            fd = target.sock.fileno()
+            if fd in self.fds:
+                self.poller.unregister(fd)
+                del self.fds[fd]
+            target.close()
+        if error:
+            target.failures += 1
+            target.deadline = time.time() + target.backoff.next_delay()
+            logger.debug("[{}] Link probe to {}:{} failed: {}".format(target.name, target.address[0], target.address[1],
+                                                                       os.strerror(error)))
+        else:
+            del self.targets[target.name]
+            logger.debug("[{}] Link probe to {}:{} succeeded".format(target.name, *target.address))
+        try:
+            target.on_result(target.name, not error)
+        except Exception:
+            logger.error(traceback.format_exc())
+
+    def __add_target(self, name, host, port, on_result):
+        target = self.targets.get(name)
+        if target is not None:
+            if target.address == (host, int(port)):
+                return
+            self.__remove_target(name)
+        self.targets[name] = LinkTarget(name, host, port, on_result, Backoff(self.INITIAL_BACKOFF, self.max_backoff))
+
+    def __remove_target(self, name):
+        target = self.targets.pop(name, None)
+        if target is None:
+            return
+        if target.sock is not None:
+            fd = target.sock.fileno()
+            self.poller.unregister(fd)
+            del self.fds[fd]
+            target.close()
+
+    def __shutdown(self):
+        for name in self.targets.keys():
+            self.__remove_target(name)
+        self.running = False
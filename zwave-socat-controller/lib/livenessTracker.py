@@ -0,0 +1,66 @@
+#!/usr/bin/python
+import time
+import heapq
+import threading
+import logging
+from scheduler import get_scheduler
+
+logger = logging.getLogger(__name__)
+
+
+class LivenessTracker(object):
+
+    def __init__(self, timeout, on_alive, on_expire):
+        self.timeout = timeout
+        self.on_alive = on_alive
+        self.on_expire = on_expire
+        self.deadlines = {}
+        self.heap = []
+        self.lock = threading.Lock()
+        self.timer = None
+        self.wakeup_time = None
+
+    # O(log n): the new deadline is pushed and the outdated heap entry is skipped when it surfaces
+    def touch(self, name, last_update=None):
+        deadline = (last_update if last_update is not None else time.time()) + self.timeout
+        with self.lock:
+            alive = name in self.deadlines
+            if deadline <= time.time() or (alive and deadline <= self.deadlines[name]):
+                return
+            self.deadlines[name] = deadline
+            heapq.heappush(self.heap, (deadline, name))
+            if len(self.heap) > 2 * len(self.deadlines) + 64:
+                self.heap = [(deadline, name) for name, deadline in self.deadlines.iteritems()]
+                heapq.heapify(self.heap)
+            self.__schedule()
+        if not alive:
+            self.on_alive(name)
+
+    def get_alive(self):
+        return self.deadlines.keys()
+
+    # Only the earliest deadline has a timer, it is moved when an earlier one shows up
+    def __schedule(self):
+        if not self.heap or self.heap[0][0] == self.wakeup_time:
+            return
+        if self.timer is not None:
+            self.timer.cancel()
+        self.wakeup_time = self.heap[0][0]
+        self.timer = get_scheduler().call_later(max(self.wakeup_time - time.time(), 0), self.__expire, name="liveness")
+
+    def __expire(self):
+        expired = []
+        with self.lock:
+            self.timer = self.wakeup_time = None
+            now = time.time()
+            while self.heap and self.heap[0][0] <= now:
+                deadline, name = heapq.heappop(self.heap)
+                if self.deadlines.get(name) == deadline:
+                    del self.deadlines[name]
+                    expired.append(name)
+            self.__schedule()
+        for name in expired:
+            try:
+                self.on_expire(name)
+            except Exception as e:
+                logger.error("[LivenessTracker] '{}' expiration failed: {}".format(name, e))
@@ -0,0 +1,218 @@
+#!/usr/bin/python
+import time
+import bisect
+import threading
+import BaseHTTPServer
+import SocketServer
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+metrics = {}
+metrics_lock = threading.Lock()
+server = None
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = [(name, str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")) for name, value in pairs]
+    return "{" + ",".join('{}="{}"'.format(name, value) for name, value in escaped) + "}"
+
+
+class Metric(object):
+
+    TYPE = "untyped"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def get_key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.documentation), "# TYPE {} {}".format(self.name, self.TYPE)]
+        with self.lock:
+            samples = sorted(self.values.items())
+        for key, value in samples:
+            lines.append("{}{} {}".format(self.name, format_labels(self.labels, key), format_value(value)))
+        return lines
+
+
+class Counter(Metric):
+
+    TYPE = "counter"
+
+    def inc(self, value=1, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+
+class Gauge(Metric):
+
+    TYPE = "gauge"
+
+    def __init__(self, name, documentation, labels=()):
+        Metric.__init__(self, name, documentation, labels)
+        self.function = None
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.get_key(labels)] = value
+
+    def inc(self, value=1, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def dec(self, value=1, **labels):
+        self.inc(-value, **labels)
+
+    # The function is evaluated on every scrape, it returns a value or a {label values tuple: value} dict
+    def set_function(self, function):
+        self.function = function
+
+    def render(self):
+        if self.function is not None:
+            try:
+                values = self.function()
+            except Exception as e:
+                logger.error("[Metrics] '{}' gauge cannot be evaluated: {}".format(self.name, e))
+                values = {}
+            with self.lock:
+                self.values = values if isinstance(values, dict) else {(): values}
+        return Metric.render(self)
+
+
+class Histogram(Metric):
+
+    TYPE = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        Metric.__init__(self, name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.get_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self.values[key] = (counts, total + value)
+
+    def time(self, **labels):
+        return HistogramTimer(self, labels)
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.documentation), "# TYPE {} {}".format(self.name, self.TYPE)]
+        with self.lock:
+            samples = sorted((key, (list(counts), total)) for key, (counts, total) in self.values.items())
+        for key, (counts, total) in samples:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append("{}_bucket{} {}".format(self.name, format_labels(self.labels, key, [("le", format_value(bound))]), cumulative))
+            lines.append("{}_sum{} {}".format(self.name, format_labels(self.labels, key), format_value(total)))
+            lines.append("{}_count{} {}".format(self.name, format_labels(self.labels, key), cumulative))
+        return lines
+
+
+class HistogramTimer(object):
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.start_time = None
+
+    def __enter__(self):
+        self.start_time = time.time()
+        return self
+
+    def __exit__(self, exception_type, exception, trace):
+        self.histogram.observe(time.time() - self.start_time, **self.labels)
+        return False
+
+
+class MetricsRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("[Metrics] {} - {}".format(self.client_address[0], format % args))
+
+
+class MetricsServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def get_metric(metric_class, name, documentation, labels=(), **options):
+    with metrics_lock:
+        if name not in metrics:
+            metrics[name] = metric_class(name, documentation, labels, **options)
+        return metrics[name]
+
+
+def counter(name, documentation, labels=()):
+    return get_metric(Counter, name, documentation, labels)
+
+
+def gauge(name, documentation, labels=()):
+    return get_metric(Gauge, name, documentation, labels)
+
+
+def histogram(name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+    return get_metric(Histogram, name, documentation, labels, buckets=buckets)
+
+
+def render():
+    with metrics_lock:
+        registered = sorted(metrics.items())
+    lines = []
+    for _, metric in registered:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def start_server(port=9105, host=""):
+    global server
+    if server is not None:
+        return server
+    server = MetricsServer((host, port), MetricsRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-server")
+    thread.daemon = True
+    thread.start()
+    logger.info("[Metrics] Serving metrics on port {}".format(server.server_address[1]))
+    return server
+
+
+def stop_server():
+    global server
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+        server = None
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+import time
+import socket
+import threading
+import logging
+import metricsHandler as mH
+import paho.mqtt.client as mqtt_client
+from topicDispatcher import TopicDispatcher
+
+logger = logging.getLogger(__name__)
+
+CALLBACK_TIME = mH.histogram("mqtt_callback_seconds", "Time spent handling an MQTT message", [],
+                             (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1))
+
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 60
+
+
+class MqttClient(mqtt_client.Client):
+    # paho only retries on OSError, on Python 2 socket.error is an IOError and a refused connection ends its network thread
+
+    def __init__(self, *args, **kwargs):
+        super(MqttClient, self).__init__(*args, **kwargs)
+        self.reconnect_delay_set(RECONNECT_MIN_DELAY, RECONNECT_MAX_DELAY)
+
+    def reconnect(self):
+        try:
+            return super(MqttClient, self).reconnect()
+        except socket.error as e:
+            raise OSError(e.errno, e.strerror or str(e))
+
+
+class MqttSession(object):
+
+    def __init__(self, mqtt_params, prefix="devices", client_id="zwave-socat-controller"):
+        self.subscriptions = {}
+        self.lock = threading.Lock()
+        self.dispatcher = TopicDispatcher(prefix)
+        self.client = MqttClient(client_id)
+        self.client.username_pw_set(mqtt_params.user, mqtt_params.passw)
+        self.client.on_connect = self.__on_connect
+        self.client.on_message = self.__on_message
+        self.client.connect_async(mqtt_params.host, mqtt_params.port, 60)
+        self.client.loop_start()
+        logger.debug("[MqttSession] Session started")
+
+    def subscribe(self, topic, qos=0):
+        with self.lock:
+            self.subscriptions[topic] = qos
+        # Subscriptions made before the connection is up are sent by __on_connect
+        self.client.subscribe(topic, qos)
+
+    def unsubscribe(self, topic):
+        with self.lock:
+            if topic not in self.subscriptions:
+                return
+            del self.subscriptions[topic]
+        self.client.unsubscribe(topic)
+
+    def add_handler(self, node, attribute, handler):
+        self.dispatcher.add_handler(node, attribute, handler)
+
+    def remove_handlers(self, node):
+        self.dispatcher.remove_handlers(node)
+
+    def stop(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+    def __on_connect(self, client, obj, flags, rc):
+        if rc != 0:
+            logger.error("[MqttSession] Connection refused by the broker (rc={})".format(rc))
+            return
+        with self.lock:
+            topics = self.subscriptions.items()
+        if topics:
+            self.client.subscribe(topics)
+        logger.debug("[MqttSession] Connected, {} subscriptions restored".format(len(topics)))
+
+    def __on_message(self, client, obj, msg):
+        start_time = time.time()
+        self.dispatcher.dispatch(msg.topic, msg.payload)
+        CALLBACK_TIME.observe(time.time() - start_time)
@@ -0,0 +1,117 @@
+#!/usr/bin/python
+import math
+import time
+import threading
+import logging
+from scheduler import get_scheduler
+
+logger = logging.getLogger(__name__)
+
+
+class HealthEvaluator(object):
+
+    UP_DELAY = 1
+    DOWN_DELAY = 3
+    PENALTY = 1000
+    HALF_LIFE = 60
+    SUPPRESS_THRESHOLD = 3000
+    REUSE_THRESHOLD = 750
+    MAX_SUPPRESS_TIME = 15*60
+
+    def __init__(self, name, on_change, up_delay=UP_DELAY, down_delay=DOWN_DELAY, penalty=PENALTY, half_life=HALF_LIFE,
+                 suppress_threshold=SUPPRESS_THRESHOLD, reuse_threshold=REUSE_THRESHOLD, max_suppress_time=MAX_SUPPRESS_TIME):
+        self.name = name
+        self.on_change = on_change
+        self.up_delay = up_delay
+        self.down_delay = down_delay
+        self.penalty = penalty
+        self.half_life = half_life
+        self.suppress_threshold = suppress_threshold
+        self.reuse_threshold = reuse_threshold
+        # The penalty is capped so a suppressed node is always reused after max_suppress_time at most
+        self.max_penalty = reuse_threshold * math.pow(2, float(max_suppress_time) / half_life)
+        self.lock = threading.Lock()
+        self.timer = None
+        self.reported = None
+        self.reported_time = None
+        self.immediate = False
+        self.healthy = None
+        self.suppressed = False
+        self.current_penalty = 0.0
+        self.penalty_time = time.time()
+        self.flaps = 0
+        self.suppressions = 0
+
+    # Raw health observations, the effective state only follows them after the configured delays
+    # An immediate observation (the link itself failed) needs no confirmation, only the flap suppression still applies
+    def report(self, healthy, immediate=False):
+        with self.lock:
+            if healthy == self.reported and (not immediate or self.immediate):
+                return
+            if healthy != self.reported:
+                now = time.time()
+                if self.reported and not healthy:
+                    self.flaps += 1
+                    self.__add_penalty(now)
+                elif healthy and self.healthy and self.timer is not None:
+                    logger.warning("[%s] Fake node death, not killing the local port..." % (self.name))
+                self.reported = healthy
+                self.reported_time = now
+            self.immediate = immediate
+        self.__evaluate()
+
+    def is_healthy(self):
+        return self.healthy
+
+    def get_penalty(self):
+        with self.lock:
+            return self.__decay(time.time())
+
+    def get_stats(self):
+        with self.lock:
+            return {"healthy": self.healthy, "suppressed": self.suppressed, "penalty": round(self.__decay(time.time())),
+                    "flaps": self.flaps, "suppressions": self.suppressions}
+
+    def cancel(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+    def __decay(self, now):
+        return self.current_penalty * math.pow(0.5, (now - self.penalty_time) / self.half_life)
+
+    def __add_penalty(self, now):
+        self.current_penalty = min(self.__decay(now) + self.penalty, self.max_penalty)
+        self.penalty_time = now
+        if not self.suppressed and self.current_penalty >= self.suppress_threshold:
+            self.suppressed = True
+            self.suppressions += 1
+            logger.warning("[{}] Node flapping ({} flaps), suppressed for {:.0f} seconds".format(
+                self.name, self.flaps, self.__get_reuse_delay()))
+
+    def __get_reuse_delay(self):
+        return max(self.half_life * math.log(self.current_penalty / self.reuse_threshold, 2), 0)
+
+    def __evaluate(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            now = time.time()
+            if self.suppressed and self.__decay(now) <= self.reuse_threshold:
+                self.suppressed = False
+                logger.info("[{}] Node no longer suppressed".format(self.name))
+            if self.reported is None or self.reported == self.healthy:
+                return
+            if self.reported:
+                change_time = self.reported_time + (0 if self.immediate else self.up_delay)
+                if self.suppressed:
+                    change_time = max(change_time, self.penalty_time + self.__get_reuse_delay())
+            else:
+                change_time = self.reported_time + (0 if self.immediate else self.down_delay)
+            if change_time > now:
+                self.timer = get_scheduler().call_later(change_time - now, self.__evaluate, name="health-" + self.name)
+                return
+            self.healthy = self.reported
+        self.on_change(self.healthy)
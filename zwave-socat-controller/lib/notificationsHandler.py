@@ -1,7 +1,13 @@
 #!/usr/bin/python
-import paho.mqtt.publish as mqtt_publish
-import datetime
+import collections
+import threading
+import time
 import json
+import logging
+from paho.mqtt.client import MQTT_ERR_QUEUE_SIZE
+from mqttSession import MqttClient
+
+logger = logging.getLogger(__name__)
 
 enabled = True
 mqtt_host = "localhost"
@@ -10,6 +16,133 @@ mqtt_user = ""
 mqtt_password = ""
 mqtt_auth = {'username': mqtt_user, 'password': mqtt_password}
 mqtt_topic = "notifications/zwave-socat-controller"
+queue_size = 100
+batch_size = 20
+overflow_policy = "merge"
+publisher = None
+publisher_lock = threading.Lock()
+STOP_TIMEOUT = 5 # seconds to wait for the broker to acknowledge the notifications in flight
+
+
+class NotificationPublisher(object):
+
+    def __init__(self, host, port, auth, topic, queue_size, batch_size, overflow_policy):
+        self.topic = topic
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.overflow_policy = overflow_policy
+        self.queue = collections.deque()
+        # Queued time of the notifications published but not acknowledged yet, and acknowledgement time of the ones
+        # acknowledged before publish() returned their mid
+        self.in_flight = {}
+        self.acknowledged = {}
+        self.condition = threading.Condition()
+        self.running = True
+        self.stats = {"queued": 0, "published": 0, "merged": 0, "dropped": 0,
+                      "last_latency": 0.0, "max_latency": 0.0, "total_latency": 0.0}
+        self.client = MqttClient()
+        self.client.username_pw_set(auth["username"], auth["password"])
+        # Notifications sent while the broker is unreachable wait in paho until the reconnection
+        self.client.max_queued_messages_set(queue_size)
+        self.client.on_publish = self.__on_publish
+        self.client.connect_async(host, port, 60)
+        self.client.loop_start()
+        self.thread = threading.Thread(target=self.__run, name="notifications-publisher")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, notification):
+        with self.condition:
+            if len(self.queue) >= self.queue_size:
+                if self.overflow_policy == "merge" and self.__merge(notification):
+                    return
+                self.stats["dropped"] += 1
+                if self.overflow_policy == "drop_newest":
+                    return
+                self.queue.popleft()
+            self.queue.append([notification, time.time(), 1])
+            self.stats["queued"] += 1
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
+        deadline = time.time() + STOP_TIMEOUT
+        with self.condition:
+            while self.in_flight and time.time() < deadline:
+                self.condition.wait(deadline - time.time())
+            if self.in_flight:
+                logger.warning("[Notifications] {} notifications not acknowledged by the broker".format(len(self.in_flight)))
+        self.client.loop_stop()
+        self.client.disconnect()
+
+    def __merge(self, notification):
+        for entry in self.queue:
+            if entry[0] == notification:
+                entry[2] += 1
+                self.stats["merged"] += 1
+                return True
+        return False
+
+    def __get_batch(self):
+        with self.condition:
+            while self.running and not self.queue:
+                self.condition.wait()
+            batch = []
+            while self.queue and len(batch) < self.batch_size:
+                batch.append(self.queue.popleft())
+            return batch
+
+    # Identical notifications of the same batch are published once with a repetition count
+    def __coalesce(self, batch):
+        coalesced = collections.OrderedDict()
+        merged = 0
+        for notification, queued_time, count in batch:
+            key = json.dumps(notification, sort_keys=True)
+            if key in coalesced:
+                coalesced[key][2] += count
+                merged += count
+            else:
+                coalesced[key] = [notification, queued_time, count]
+        with self.condition:
+            self.stats["merged"] += merged
+        return coalesced.values()
+
+    def __run(self):
+        while True:
+            batch = self.__get_batch()
+            if not batch:
+                return
+            for notification, queued_time, count in self.__coalesce(batch):
+                if count > 1:
+                    notification = dict(notification, repeated=count)
+                # Not under the condition, paho calls on_publish with its message lock held
+                info = self.client.publish(self.topic, json.dumps(notification), qos=1)
+                with self.condition:
+                    if info.rc == MQTT_ERR_QUEUE_SIZE:
+                        self.stats["dropped"] += count
+                    elif info.mid in self.acknowledged:
+                        self.__add_latency(self.acknowledged.pop(info.mid) - queued_time)
+                    else:
+                        self.in_flight[info.mid] = queued_time
+
+    # The latency runs until the broker acknowledges the notification
+    def __on_publish(self, client, userdata, mid):
+        now = time.time()
+        with self.condition:
+            if mid in self.in_flight:
+                self.__add_latency(now - self.in_flight.pop(mid))
+                self.condition.notify_all()
+            else:
+                self.acknowledged[mid] = now
+
+    def __add_latency(self, latency):
+        self.stats["published"] += 1
+        self.stats["last_latency"] = latency
+        self.stats["max_latency"] = max(self.stats["max_latency"], latency)
+        self.stats["total_latency"] += latency
 
 
 def enable():
@@ -36,26 +169,31 @@ def set_broker_parameters(broker_parameters):
     mqtt_user = broker_parameters.user
     mqtt_password = broker_parameters.passw
     mqtt_auth = {'username': broker_parameters.user, 'password': broker_parameters.passw}
+    stop_publisher()
 
 
 def set_broker_host(host):
     global mqtt_host
     mqtt_host = host
+    stop_publisher()
 
 
 def set_broker_port(port):
     global mqtt_port
     mqtt_port = port
+    stop_publisher()
 
 
 def set_broker_user(user):
     global mqtt_user
     mqtt_user = user
+    set_broker_auth(user, mqtt_password)
 
 
 def set_broker_password(password):
     global mqtt_password
     mqtt_password = password
+    set_broker_auth(mqtt_user, password)
 
 
 def set_broker_auth(user, password):
@@ -63,11 +201,49 @@ def set_broker_auth(user, password):
     mqtt_user = user
     mqtt_password = password
     mqtt_auth = {'username': user, 'password': password}
+    stop_publisher()
 
 
 def set_notification_topic(topic):
     global mqtt_topic
     mqtt_topic = topic
+    stop_publisher()
+
+
+def set_queue_parameters(size=None, batch=None, policy=None):
+    global queue_size, batch_size, overflow_policy
+    if size is not None: queue_size = size
+    if batch is not None: batch_size = batch
+    if policy is not None: overflow_policy = policy
+    stop_publisher()
+
+
+def get_publisher():
+    global publisher
+    with publisher_lock:
+        if publisher is None:
+            publisher = NotificationPublisher(mqtt_host, mqtt_port, mqtt_auth, mqtt_topic,
+                                              queue_size, batch_size, overflow_policy)
+        return publisher
+
+
+def stop_publisher():
+    global publisher
+    with publisher_lock:
+        if publisher is None:
+            return
+        old_publisher, publisher = publisher, None
+    old_publisher.stop()
+
+
+def get_stats():
+    if publisher is None:
+        return {}
+    stats = dict(publisher.stats)
+    stats["pending"] = len(publisher.queue)
+    stats["in_flight"] = len(publisher.in_flight)
+    stats["average_latency"] = stats["total_latency"] / stats["published"] if stats["published"] else 0.0
+    return stats
 
 
 def send_notification(notification):
@@ -75,5 +251,4 @@ def send_notification(notification):
         if not isinstance(notification, dict):
             return
 
-        mqtt_publish.single(topic=mqtt_topic, payload=json.dumps(notification),
-                            hostname=mqtt_host, port=mqtt_port, auth=mqtt_auth)
+        get_publisher().put(notification)
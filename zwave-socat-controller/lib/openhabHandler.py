@@ -1,29 +1,40 @@
 #!/usr/bin/python
 import time
-import threading
-import re
 import subprocess
 import os
+import re
 import logging
 import notificationsHandler as nH
+from osgiConsole import OSGiConsole, BundleSnapshot
+from bundleMonitor import BundleStateMonitor
+from restartScheduler import RestartScheduler
+import metricsHandler as mH
 
 logger = logging.getLogger(__name__)
 
+INSTALL_PATTERN = re.compile(r'Bundle id is (\d+)')
+TRANSITION_TIME = mH.histogram("openhab_bundle_transition_seconds", "Time for a binding bundle to reach the requested state", ["state"])
+
 
 class OpenHABHandler(object):
 
-    def __init__(self, host="127.0.0.1", port=5555, telnet_delay=".4", command_timeout=10):
+    def __init__(self, host="127.0.0.1", port=5555, console_pool_size=2, command_timeout=10,
+                 addons_folder="/usr/share/openhab/addons", restart_command="/etc/init.d/openhab restart"):
         self.host = host
         self.port = port
-        self.telnet_delay = telnet_delay
+        self.addons_folder = addons_folder
+        self.restart_command = restart_command
         self.command_timeout = command_timeout
+        self.console = OSGiConsole(host, port, console_pool_size)
         self.installed_addons = []
-        self.zwave_bindings = {}
+        self.snapshot = BundleSnapshot()
+        self.monitor = BundleStateMonitor(self.__refresh_snapshot)
         self.openhab_online = None
         self.openhab_state = ""
-        self.restart_timer = None
+        self.restart_timeout = 90
+        self.restart_scheduler = RestartScheduler(lambda: self.__restart_openhab(self.restart_timeout))
         self.last_update = 0
-        self.__update_openhab_information()
+        # The console is queried lazily by the first public call, so building the handler never blocks
         self.__update_installed_addons()
 
     # Public methods
@@ -32,8 +43,8 @@ class OpenHABHandler(object):
         self.__update_openhab_information()
         if not self.openhab_online:
             return 1
-        if name in self.zwave_bindings:
-            bundle_id = self.zwave_bindings[name]["id"]
+        if name in self.snapshot.zwave_bindings:
+            bundle_id = self.snapshot.zwave_bindings[name]
         else:
             return 1
         return self.__stop_bundle_by_id(bundle_id)
@@ -42,82 +53,124 @@ class OpenHABHandler(object):
         self.__update_openhab_information()
         if not self.openhab_online:
             return 1
-        if name in self.zwave_bindings:
-            bundle_id = self.zwave_bindings[name]["id"]
+        if name in self.snapshot.zwave_bindings:
+            bundle_id = self.snapshot.zwave_bindings[name]
         else:
             return 1
         return self.__start_bundle_by_id(bundle_id)
 
-    def restart_openhab(self, timeout=90):
-        if self.restart_timer is not None:
-            self.restart_timer.cancel()
-        self.restart_timer = threading.Timer(1.5, self.__restart_openhab, [timeout])
-        self.restart_timer.start()
+    def restart_openhab(self, reason="unspecified", timeout=90):
+        self.restart_timeout = timeout
+        self.restart_scheduler.request(reason)
+
+    # Installs, uninstalls and starts only the affected bundles, returns 0 when a full restart is needed
+    def reload_bundles(self, installed_paths=(), uninstalled_paths=()):
+        reload_time = time.time()
+        self.__update_openhab_information(forced=True)
+        if not self.openhab_online:
+            return 0
+        uninstalled_ids = set()
+        for path in uninstalled_paths:
+            bundle_id = self.snapshot.ids_by_name.get(self.__get_bundle_name(path))
+            if bundle_id is None:
+                continue
+            if self.console.execute("uninstall {0}".format(bundle_id)) is None:
+                return 0
+            uninstalled_ids.add(bundle_id)
+            logger.debug("[openHABHandler] Bundle {0} uninstalled".format(bundle_id))
+        targets = {}
+        for path in installed_paths:
+            previous_id = self.snapshot.ids_by_name.get(self.__get_bundle_name(path))
+            install_search = INSTALL_PATTERN.search(self.console.execute("install file:{0}".format(path)) or "")
+            if not install_search:
+                logger.error("[openHABHandler] '{0}' cannot be installed from the console".format(path))
+                return 0
+            bundle_id = install_search.group(1)
+            if previous_id not in (None, bundle_id) and previous_id not in uninstalled_ids:
+                self.console.execute("uninstall {0}".format(previous_id))
+            targets[bundle_id] = "ACTIVE"
+        if uninstalled_paths:
+            self.console.execute("refresh")
+        for bundle_id in targets:
+            self.console.execute("start {0}".format(bundle_id))
+        transition_times = self.wait_for_bundles(targets)
+        self.__update_installed_addons()
+        failed_bundles = [bundle_id for bundle_id, transition_time in transition_times.iteritems() if transition_time is None]
+        if failed_bundles:
+            logger.error("[openHABHandler] Bundles {0} did not become ACTIVE".format(failed_bundles))
+            return 0
+        logger.info("[openHABHandler] {0} bundles installed and {1} uninstalled in {2:.2f} seconds".format(
+            len(installed_paths), len(uninstalled_paths), time.time()-reload_time))
+        return 1
+
+    # Refreshes the binding bundle, then reinstalls it from its jar, until the wanted state is reached
+    def recover_binding(self, name, status):
+        for command in ("refresh", "update"):
+            self.__update_openhab_information(forced=True)
+            bundle_id = self.snapshot.zwave_bindings.get(name)
+            if not self.openhab_online or bundle_id is None:
+                return 0
+            logger.warning("[{0}] Trying to recover the binding with '{1}'...".format(name, command))
+            if self.console.execute("{0} {1}".format(command, bundle_id)) is None:
+                return 0
+            if (self.start_binding(name) if status else self.stop_binding(name)):
+                logger.info("[{0}] Binding recovered with '{1}'".format(name, command))
+                return 1
+        return 0
+
+    def wait_for_bundles(self, targets, timeout=None):
+        if timeout is None:
+            timeout = self.command_timeout
+        return self.monitor.wait_for(targets, timeout)
 
     # Private methods
 
-    def __ss_result(self):
-        ss_command = "{{ echo 'ss'; sleep {0}; }} | telnet {1} {2} 2>/dev/null".format(self.telnet_delay, self.host,
-                                                                                       self.port)
-        return subprocess.Popen(ss_command, stdout=subprocess.PIPE, shell=True).communicate()[0]
+    def __refresh_snapshot(self):
+        self.__update_openhab_information(forced=True)
+        if not self.openhab_online:
+            return None
+        return self.snapshot
 
-    def __update_installed_addons(self):
-        addons_folder = "/usr/share/openhab/addons"
+    @staticmethod
+    def __get_bundle_name(path):
+        return os.path.basename(path).replace(".jar", "").split("_")[0]
 
+    def __update_installed_addons(self):
         self.installed_addons = [addon.replace(".jar", "").split("-")[0].split("_")[0] for addon in
-                                 os.listdir(addons_folder) if ".jar" in addon]
+                                 os.listdir(self.addons_folder) if ".jar" in addon]
 
     def __update_openhab_information(self, forced=False):
         if not forced and time.time() - self.last_update < 15:
             return
 
-        ss_response = self.__ss_result()
+        snapshot = self.console.ss()
 
-        self.openhab_online = (ss_response != "Trying 127.0.0.1...\n")
+        self.openhab_online = snapshot is not None
 
         if not self.openhab_online:
             if self.openhab_state == "stopping":
                 self.openhab_state = "starting"
             return
 
-        if self.__has_openhab_completely_started(ss_response) and self.openhab_state == "starting":
-            self.openhab_state = "started"
+        self.snapshot = snapshot
 
-        zwaves_info_search = re.compile(ur'(\d{2,4})\s+(\w+)\s+org.openhab.binding.(zwave\d*)')
-        zwaves_info = re.findall(zwaves_info_search, ss_response)
+        if self.__has_openhab_completely_started() and self.openhab_state == "starting":
+            self.openhab_state = "started"
 
-        if not zwaves_info:
+        if not snapshot.zwave_bindings:
             return
 
-        self.zwave_bindings = {}
-        for zwave_info in zwaves_info:
-            self.zwave_bindings[zwave_info[2]] = {"id": zwave_info[0], "status": zwave_info[1]}
-
         self.last_update = time.time()
 
-    def __has_openhab_completely_started(self, ss=None):
+    def __has_openhab_completely_started(self):
         bundles_to_check = ["org.openhab.model.item", "org.openhab.model.persistence", "org.openhab.model.rule",
                             "org.openhab.model.script", "org.openhab.model.sitemap"] + self.installed_addons
 
-        if not ss:
-            ss = self.__ss_result()
         for bundle in bundles_to_check:
-            if "ACTIVE" != self.__get_bundle_status(bundle, ss):
+            if "ACTIVE" != self.snapshot.get_state_by_name(bundle):
                 return False
         return True
 
-    def __get_bundle_status(self, bundle_name, ss=None):
-        if not ss:
-            ss = self.__ss_result()
-
-        pattern = ur'\d{{2,4}}\s+(\w+)\s+{0}'.format(bundle_name)
-        bundle_search = re.compile(pattern)
-        bundle_search_result = re.search(bundle_search, ss)
-
-        if bundle_search_result:
-            return bundle_search_result.group(1)
-        return ""
-
     def __start_bundle_by_id(self, bundle_id):
         self.__update_openhab_information()
         if not self.openhab_online:
@@ -125,15 +178,12 @@ class OpenHABHandler(object):
         name = self.__get_binding_by_bundle(bundle_id)
         if self.__get_binding_realtime_state(name) == "ACTIVE":
             self.__stop_bundle_by_id(bundle_id)
-        command = """{ echo 'start "%s"'; sleep %s; } | telnet %s %s 2>/dev/null""" % \
-                  (bundle_id, self.telnet_delay, self.host, self.port)
-        subprocess.Popen(command, stdout=subprocess.PIPE, shell=True).communicate()[0]
-        start_time = time.time()
-        while self.__get_binding_realtime_state(name) != "ACTIVE":
-            if time.time() - start_time > self.command_timeout:
-                return 0
-            time.sleep(.5)
-        logger.debug("[{0}] Binding started in {1} seconds".format(name, time.time() - start_time))
+        self.console.execute("start {0}".format(bundle_id))
+        transition_time = self.wait_for_bundles({bundle_id: "ACTIVE"})[bundle_id]
+        if transition_time is None:
+            return 0
+        TRANSITION_TIME.observe(transition_time, state="ACTIVE")
+        logger.debug("[{0}] Binding started in {1:.2f} seconds".format(name, transition_time))
         return 1
 
     def __stop_bundle_by_id(self, bundle_id):
@@ -141,32 +191,25 @@ class OpenHABHandler(object):
         if not self.openhab_online:
             return 1
         name = self.__get_binding_by_bundle(bundle_id)
-        command = """{ echo 'stop "%s"'; sleep %s; } | telnet %s %s 2>/dev/null""" % \
-                  (bundle_id, self.telnet_delay, self.host, self.port)
-        subprocess.Popen(command, stdout=subprocess.PIPE, shell=True).communicate()[0]
-        start_time = time.time()
-        while self.__get_binding_realtime_state(name) != "RESOLVED":
-            if time.time() - start_time > self.command_timeout:
-                return 0
-            time.sleep(.5)
-        logger.debug("[{0}] Binding stopped in {1} seconds".format(name, time.time() - start_time))
+        self.console.execute("stop {0}".format(bundle_id))
+        transition_time = self.wait_for_bundles({bundle_id: "RESOLVED"})[bundle_id]
+        if transition_time is None:
+            return 0
+        TRANSITION_TIME.observe(transition_time, state="RESOLVED")
+        logger.debug("[{0}] Binding stopped in {1:.2f} seconds".format(name, transition_time))
         return 1
 
     def __get_binding_by_bundle(self, bundle_id):
         self.__update_openhab_information()
         if not self.openhab_online:
             return None
-        for name, config in self.zwave_bindings.iteritems():
-            if config["id"] == bundle_id:
-                return name
-        return None
+        return self.snapshot.get_binding_by_bundle(bundle_id)
 
     def __get_binding_realtime_state(self, name):
-        self.restart_timer = None
         self.__update_openhab_information(forced=True)
         if not self.openhab_online:
             return None
-        return self.zwave_bindings[name]["status"]
+        return self.snapshot.get_state(self.snapshot.zwave_bindings.get(name))
 
     def __restart_openhab(self, timeout):
         logger.info("[openHABHandler] Restarting openHAB...")
@@ -174,7 +217,7 @@ class OpenHABHandler(object):
         restart_time = time.time()
         self.openhab_state = "stopping"
         self.__update_installed_addons()
-        subprocess.Popen("/etc/init.d/openhab restart", stdout=subprocess.PIPE, shell=True)
+        subprocess.Popen(self.restart_command, stdout=subprocess.PIPE, shell=True)
         while not self.openhab_online or not self.openhab_state == "started":
             self.__update_openhab_information(forced=True)
             time.sleep(0.2)
@@ -0,0 +1,134 @@
+#!/usr/bin/python
+import re
+import socket
+import telnetlib
+import threading
+import time
+import Queue
+import logging
+import metricsHandler as mH
+
+logger = logging.getLogger(__name__)
+
+CONSOLE_ROUNDTRIP = mH.histogram("openhab_console_roundtrip_seconds", "OSGi console command round-trip time", ["command"],
+                                 (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+
+
+class OSGiConsoleSession(object):
+
+    PROMPT = "osgi> "
+
+    def __init__(self, host, port, timeout):
+        self.timeout = timeout
+        self.telnet = telnetlib.Telnet(host, port, timeout)
+        self.__read_until_prompt()
+
+    def execute(self, command):
+        self.telnet.write(command + "\r\n")
+        return self.__read_until_prompt()
+
+    def close(self):
+        try:
+            self.telnet.close()
+        except socket.error:
+            pass
+
+    def __read_until_prompt(self):
+        response = self.telnet.read_until(self.PROMPT, self.timeout)
+        if not response.endswith(self.PROMPT):
+            raise socket.timeout("osgi prompt not received")
+        return response[:-len(self.PROMPT)]
+
+
+class OSGiConsole(object):
+
+    def __init__(self, host="127.0.0.1", port=5555, pool_size=2, timeout=10):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.sessions = Queue.Queue()
+        self.slots = threading.BoundedSemaphore(pool_size)
+
+    def execute(self, command):
+        start_time = time.time()
+        response = self.__execute(command)
+        if response is not None:
+            CONSOLE_ROUNDTRIP.observe(time.time() - start_time, command=command.split(" ")[0])
+        return response
+
+    def __execute(self, command):
+        with self.slots:
+            session = self.__get_session()
+            if session is None:
+                return None
+            try:
+                response = session.execute(command)
+            except (socket.error, EOFError):
+                # The console was restarted under us, retry once with a fresh session
+                session.close()
+                session = self.__new_session()
+                if session is None:
+                    return None
+                try:
+                    response = session.execute(command)
+                except (socket.error, EOFError) as e:
+                    logger.debug("[OSGiConsole] '{}' command failed: {}".format(command, e))
+                    session.close()
+                    return None
+            self.sessions.put(session)
+            return response
+
+    def ss(self):
+        response = self.execute("ss")
+        if response is None:
+            return None
+        return BundleSnapshot(response)
+
+    def close(self):
+        while not self.sessions.empty():
+            self.sessions.get_nowait().close()
+
+    def __get_session(self):
+        try:
+            return self.sessions.get_nowait()
+        except Queue.Empty:
+            return self.__new_session()
+
+    def __new_session(self):
+        try:
+            return OSGiConsoleSession(self.host, self.port, self.timeout)
+        except (socket.error, EOFError) as e:
+            logger.debug("[OSGiConsole] Console not reachable at {}:{}: {}".format(self.host, self.port, e))
+            return None
+
+
+class BundleSnapshot(object):
+
+    BUNDLE_PATTERN = re.compile(r'^\s*(\d+)\s+([A-Z_]+)\s+(\S+?)(?:_(\d\S*))?\s*$', re.MULTILINE)
+    ZWAVE_PATTERN = re.compile(r'^org\.openhab\.binding\.(zwave\d*)$')
+
+    def __init__(self, ss_response=""):
+        self.bundles = {}
+        self.ids_by_name = {}
+        self.zwave_bindings = {}
+        self.bindings_by_id = {}
+        for bundle_id, state, name, version in self.BUNDLE_PATTERN.findall(ss_response):
+            self.bundles[bundle_id] = (name, state)
+            self.ids_by_name[name] = bundle_id
+            zwave_search = self.ZWAVE_PATTERN.match(name)
+            if zwave_search:
+                self.zwave_bindings[zwave_search.group(1)] = bundle_id
+                self.bindings_by_id[bundle_id] = zwave_search.group(1)
+
+    def get_state(self, bundle_id):
+        if bundle_id in self.bundles:
+            return self.bundles[bundle_id][1]
+        return ""
+
+    def get_state_by_name(self, name):
+        if name in self.ids_by_name:
+            return self.bundles[self.ids_by_name[name]][1]
+        return ""
+
+    def get_binding_by_bundle(self, bundle_id):
+        return self.bindings_by_id.get(bundle_id)
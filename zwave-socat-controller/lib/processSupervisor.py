@@ -0,0 +1,169 @@
+#!/usr/bin/python
+import os
+import time
+import errno
+import signal
+import subprocess
+import threading
+import logging
+import traceback
+from connectionManager import Backoff, MAX_BACKOFF
+
+logger = logging.getLogger(__name__)
+
+
+class SupervisedProcess(object):
+
+    def __init__(self, name, command, backoff):
+        self.name = name
+        self.command = command
+        self.backoff = backoff
+        self.process = None
+        self.started = None
+        self.respawn_time = None
+        self.stop_deadline = None
+        self.restarts = 0
+
+    def spawn(self):
+        with open(os.devnull, 'r+') as devnull:
+            # Every child leads its own process group so the whole group can be signalled at once
+            self.process = subprocess.Popen(self.command, stdin=devnull, stdout=devnull, stderr=devnull,
+                                            close_fds=True, preexec_fn=os.setsid)
+        self.started = time.time()
+        self.respawn_time = None
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def terminate(self, timeout):
+        self.signal_group(signal.SIGTERM)
+        self.stop_deadline = time.time() + timeout
+
+    # True once the process is gone, it is killed when it still ignores SIGTERM at the deadline
+    def reap_stopped(self):
+        if self.process.poll() is None:
+            if time.time() < self.stop_deadline:
+                return False
+            logger.warning("[{}] Process did not terminate, killing it".format(self.name))
+            self.signal_group(signal.SIGKILL)
+            self.process.wait()
+        else:
+            # The leader is gone, make sure nothing it forked survives it
+            self.signal_group(signal.SIGKILL)
+        logger.debug("[{}] Process stopped".format(self.name))
+        return True
+
+    def signal_group(self, signal_number):
+        try:
+            os.killpg(self.process.pid, signal_number)
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
+
+
+class ProcessSupervisor(object):
+
+    RESPAWN_DELAY = 0.5
+    STABLE_TIME = 10 # seconds a process must run before its respawn delay goes back to RESPAWN_DELAY
+    TERMINATE_TIMEOUT = 0.5
+    REAP_INTERVAL = 0.2
+
+    def __init__(self, max_respawn_delay=MAX_BACKOFF):
+        self.max_respawn_delay = max_respawn_delay
+        # Called with the process name and its return code when it exits on its own
+        self.on_exit = None
+        self.processes = {}
+        self.stopping = []
+        self.lock = threading.Lock()
+        self.reaper = threading.Thread(target=self.__reap, name="process-supervisor")
+        self.reaper.daemon = True
+        self.reaper.start()
+
+    def start(self, name, command):
+        self.stop(name, wait=True)
+        self.__wait_stopping(name)
+        supervised_process = SupervisedProcess(name, command, Backoff(self.RESPAWN_DELAY, self.max_respawn_delay))
+        with self.lock:
+            supervised_process.spawn()
+            self.processes[name] = supervised_process
+        logger.debug("[{}] Process started (pid {})".format(name, supervised_process.process.pid))
+
+    # Without wait the reaper finishes the stop, so the caller (a health timer) never waits for the process
+    def stop(self, name, wait=False):
+        with self.lock:
+            supervised_process = self.processes.pop(name, None)
+        if supervised_process is None or supervised_process.process is None:
+            return False
+        was_alive = supervised_process.is_alive()
+        supervised_process.terminate(self.TERMINATE_TIMEOUT)
+        if wait:
+            while not supervised_process.reap_stopped():
+                time.sleep(0.01)
+        else:
+            with self.lock:
+                self.stopping.append(supervised_process)
+        return was_alive
+
+    def stop_all(self):
+        for name in self.processes.keys():
+            self.stop(name, wait=True)
+        for name in set(supervised_process.name for supervised_process in self.stopping):
+            self.__wait_stopping(name)
+
+    # A process still stopping could remove the pty link of its successor when it exits
+    def __wait_stopping(self, name):
+        with self.lock:
+            stopping = [supervised_process for supervised_process in self.stopping if supervised_process.name == name]
+            self.stopping = [supervised_process for supervised_process in self.stopping if supervised_process.name != name]
+        for supervised_process in stopping:
+            while not supervised_process.reap_stopped():
+                time.sleep(0.01)
+
+    def status(self, name):
+        supervised_process = self.processes.get(name)
+        if supervised_process is None:
+            return None
+        return {"pid": supervised_process.process.pid if supervised_process.process else None,
+                "running": supervised_process.is_alive(),
+                "restarts": supervised_process.restarts,
+                "uptime": time.time() - supervised_process.started if supervised_process.is_alive() else 0}
+
+    def is_running(self, name):
+        supervised_process = self.processes.get(name)
+        return supervised_process is not None and supervised_process.is_alive()
+
+    def __reap(self):
+        while True:
+            time.sleep(self.REAP_INTERVAL)
+            now = time.time()
+            exited = []
+            with self.lock:
+                self.stopping = [supervised_process for supervised_process in self.stopping
+                                 if not supervised_process.reap_stopped()]
+                for supervised_process in self.processes.values():
+                    if supervised_process.respawn_time is None:
+                        return_code = supervised_process.process.poll()
+                        if return_code is None:
+                            continue
+                        supervised_process.signal_group(signal.SIGKILL)
+                        if now - supervised_process.started >= self.STABLE_TIME:
+                            supervised_process.backoff.reset()
+                        delay = supervised_process.backoff.next_delay()
+                        logger.debug("[{}] Process exited with code {}, respawning it in {:.1f} seconds".format(
+                            supervised_process.name, return_code, delay))
+                        supervised_process.respawn_time = now + delay
+                        exited.append((supervised_process.name, return_code))
+                    elif supervised_process.respawn_time <= now:
+                        supervised_process.restarts += 1
+                        try:
+                            supervised_process.spawn()
+                        except OSError as e:
+                            logger.error("[{}] Process cannot be respawned: {}".format(supervised_process.name, e))
+                            supervised_process.respawn_time = now + supervised_process.backoff.next_delay()
+            # The handlers may stop processes, so they are called without the lock
+            for name, return_code in exited:
+                if self.on_exit is not None:
+                    try:
+                        self.on_exit(name, return_code)
+                    except Exception:
+                        logger.error(traceback.format_exc())
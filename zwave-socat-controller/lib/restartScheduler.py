@@ -0,0 +1,150 @@
+#!/usr/bin/python
+import time
+import collections
+import threading
+import logging
+from scheduler import get_scheduler
+import metricsHandler as mH
+
+logger = logging.getLogger(__name__)
+
+RESTART_BUCKETS = (1, 5, 10, 20, 30, 45, 60, 90, 120, 180, 300)
+RESTART_DURATION = mH.histogram("openhab_restart_duration_seconds", "Duration of the openHAB restarts", [], RESTART_BUCKETS)
+RESTART_LATENCY = mH.histogram("openhab_restart_latency_seconds", "Time from a restart request to the restart completion", [], RESTART_BUCKETS)
+RESTART_REQUESTS = mH.counter("openhab_restart_requests_total", "openHAB restart requests by outcome", ["outcome"])
+
+
+class TokenBucket(object):
+
+    def __init__(self, capacity, refill_period):
+        self.capacity = capacity
+        self.refill_period = refill_period
+        self.tokens = float(capacity)
+        self.last_refill = time.time()
+
+    def __refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) / self.refill_period)
+        self.last_refill = now
+
+    # Returns 0 when a token was taken, otherwise the seconds until the next one is available
+    def take(self, now=None):
+        now = now if now is not None else time.time()
+        self.__refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) * self.refill_period
+
+
+class RestartScheduler(object):
+
+    IDLE = "idle"
+    DEBOUNCING = "debouncing"
+    RESTARTING = "restarting"
+
+    DEBOUNCE = 1.5
+    MAX_DEBOUNCE = 10
+    BURST = 3
+    REFILL_PERIOD = 20*60 # seconds per token, 3 restarts per hour once the burst is used
+    HISTORY_SIZE = 20
+
+    def __init__(self, restart, debounce=DEBOUNCE, burst=BURST, refill_period=REFILL_PERIOD):
+        self.restart = restart
+        self.debounce = debounce
+        self.bucket = TokenBucket(burst, refill_period)
+        self.lock = threading.Lock()
+        self.state = self.IDLE
+        self.timer = None
+        self.generation = 0
+        self.first_request = None
+        self.requests = []
+        self.history = collections.deque(maxlen=self.HISTORY_SIZE)
+        self.stats = {"requested": 0, "merged": 0, "executed": 0, "rate_limited": 0}
+
+    # Requests arriving while one is pending or running are merged into a single (follow-up) restart
+    def request(self, reason):
+        now = time.time()
+        with self.lock:
+            self.stats["requested"] += 1
+            if self.requests:
+                self.stats["merged"] += 1
+                RESTART_REQUESTS.inc(outcome="merged")
+            else:
+                RESTART_REQUESTS.inc(outcome="queued")
+            self.requests.append((reason, now))
+            if self.state == self.RESTARTING:
+                logger.debug("[RestartScheduler] Restart in progress, '{}' queued for a follow-up".format(reason))
+                return
+            if self.state == self.IDLE:
+                self.state = self.DEBOUNCING
+                self.first_request = now
+            # Every request extends the window, but never beyond MAX_DEBOUNCE from the first one
+            self.__schedule(min(now + self.debounce, self.first_request + self.MAX_DEBOUNCE) - now)
+        logger.debug("[RestartScheduler] Restart requested: {}".format(reason))
+
+    def get_state(self):
+        return self.state
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["state"] = self.state
+            stats["pending"] = [reason for reason, _ in self.requests]
+            stats["history"] = list(self.history)
+        return stats
+
+    def __schedule(self, delay):
+        if self.timer is not None:
+            self.timer.cancel()
+        self.generation += 1
+        # The restart blocks for a long time, so it runs on the scheduler worker and not on its timer thread
+        self.timer = get_scheduler().call_later(delay, self.__run, self.generation, name="openhab-restart", blocking=True)
+
+    def __run(self, generation):
+        with self.lock:
+            # A request arriving while this timer waited for the worker rescheduled the restart, the new timer runs it
+            if generation != self.generation:
+                return
+            self.timer = None
+            if not self.requests:
+                self.state = self.IDLE
+                return
+            wait_time = self.bucket.take()
+            if wait_time:
+                self.stats["rate_limited"] += 1
+                RESTART_REQUESTS.inc(outcome="rate_limited")
+                logger.warning("[RestartScheduler] Restart rate limit reached, delaying it {:.0f} seconds".format(wait_time))
+                self.__schedule(wait_time)
+                return
+            self.state = self.RESTARTING
+            requests, self.requests = self.requests, []
+        reasons = sorted(set(reason for reason, _ in requests))
+        logger.info("[RestartScheduler] Restarting openHAB ({} requests): {}".format(len(requests), ", ".join(reasons)))
+        start_time = time.time()
+        end_time = start_time
+        max_latency = 0
+        try:
+            try:
+                self.restart()
+            except Exception as e:
+                logger.error("[RestartScheduler] Restart failed: {}".format(e))
+            end_time = time.time()
+            latencies = [end_time - request_time for _, request_time in requests]
+            max_latency = max(latencies) if latencies else 0
+            RESTART_DURATION.observe(end_time - start_time)
+            for latency in latencies:
+                RESTART_LATENCY.observe(latency)
+        finally:
+            # The state must leave RESTARTING whatever happens, otherwise every later request waits for a follow-up
+            with self.lock:
+                self.stats["executed"] += 1
+                self.history.append({"reasons": reasons, "requests": len(requests), "started": start_time,
+                                     "duration": end_time - start_time, "max_latency": max_latency})
+                if self.requests:
+                    self.state = self.DEBOUNCING
+                    self.first_request = end_time
+                    self.__schedule(self.debounce)
+                else:
+                    self.state = self.IDLE
+        logger.info("[RestartScheduler] Restart completed in {:.0f} seconds, {:.0f} seconds after the first request".format(
+            end_time - start_time, max_latency))
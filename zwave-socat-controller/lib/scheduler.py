@@ -0,0 +1,225 @@
+#!/usr/bin/python
+import os
+import time
+import errno
+import fcntl
+import heapq
+import Queue
+import select
+import itertools
+import threading
+import traceback
+import logging
+
+logger = logging.getLogger(__name__)
+
+scheduler = None
+scheduler_lock = threading.Lock()
+
+
+class TimerHandle(object):
+
+    def __init__(self, scheduler, deadline, callback, args, name, interval, blocking):
+        self.scheduler = scheduler
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.name = name or getattr(callback, "__name__", "timer")
+        self.interval = interval
+        self.blocking = blocking
+        self.cancelled = False
+        self.queued = True
+        self.fired = False
+
+    def cancel(self):
+        # The count is also updated by the scheduler thread when it compacts the heap
+        with self.scheduler.lock:
+            if not self.cancelled:
+                self.cancelled = True
+                if self.queued:
+                    self.scheduler.cancelled += 1
+
+    # A one-shot timer is no longer pending once its callback has started, a periodic one until it is cancelled
+    def is_pending(self):
+        return not self.cancelled and not self.fired
+
+
+class Debouncer(object):
+
+    def __init__(self, scheduler, delay, callback, name=None, blocking=False):
+        self.scheduler = scheduler
+        self.delay = delay
+        self.callback = callback
+        self.name = name
+        self.blocking = blocking
+        self.handle = None
+        self.lock = threading.Lock()
+
+    # Every trigger postpones the call, only the last arguments are used
+    def trigger(self, *args):
+        with self.lock:
+            if self.handle is not None:
+                self.handle.cancel()
+            self.handle = self.scheduler.call_later(self.delay, self.__fire, *args, name=self.name, blocking=self.blocking)
+
+    def cancel(self):
+        with self.lock:
+            if self.handle is not None:
+                self.handle.cancel()
+                self.handle = None
+
+    def __fire(self, *args):
+        with self.lock:
+            self.handle = None
+        self.callback(*args)
+
+
+class Throttler(object):
+
+    def __init__(self, scheduler, interval, callback, name=None, blocking=False):
+        self.scheduler = scheduler
+        self.interval = interval
+        self.callback = callback
+        self.name = name
+        self.blocking = blocking
+        self.handle = None
+        self.last_call = 0
+        self.lock = threading.Lock()
+
+    # The first trigger runs right away, the following ones are merged into one call per interval
+    def trigger(self):
+        with self.lock:
+            if self.handle is not None:
+                return
+            delay = max(self.last_call + self.interval - time.time(), 0)
+            self.handle = self.scheduler.call_later(delay, self.__fire, name=self.name, blocking=self.blocking)
+
+    def cancel(self):
+        with self.lock:
+            if self.handle is not None:
+                self.handle.cancel()
+                self.handle = None
+
+    def __fire(self):
+        with self.lock:
+            self.handle = None
+            self.last_call = time.time()
+        self.callback()
+
+
+class Scheduler(object):
+
+    def __init__(self, name="scheduler"):
+        self.name = name
+        self.heap = []
+        self.sequence = itertools.count()
+        self.cancelled = 0
+        self.lock = threading.Lock()
+        # A pipe wakes the thread up, select sleeps in the kernel instead of polling like Condition.wait
+        self.wakeup_read, self.wakeup_write = os.pipe()
+        fcntl.fcntl(self.wakeup_write, fcntl.F_SETFL, fcntl.fcntl(self.wakeup_write, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self.workers = {}
+        self.thread = threading.Thread(target=self.__run, name=name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def call_later(self, delay, callback, *args, **options):
+        return self.__schedule(time.time() + delay, callback, args, options.get("name"), None, options.get("blocking", False))
+
+    def call_every(self, interval, callback, *args, **options):
+        delay = options.get("delay", interval)
+        return self.__schedule(time.time() + delay, callback, args, options.get("name"), interval, options.get("blocking", False))
+
+    def debounce(self, delay, callback, name=None, blocking=False):
+        return Debouncer(self, delay, callback, name, blocking)
+
+    def throttle(self, interval, callback, name=None, blocking=False):
+        return Throttler(self, interval, callback, name, blocking)
+
+    def pending(self):
+        now = time.time()
+        with self.lock:
+            handles = sorted((handle for _, _, handle in self.heap if not handle.cancelled), key=lambda handle: handle.deadline)
+        return [{"name": handle.name, "due_in": handle.deadline - now, "interval": handle.interval, "blocking": handle.blocking}
+                for handle in handles]
+
+    def __schedule(self, deadline, callback, args, name, interval, blocking):
+        handle = TimerHandle(self, deadline, callback, args, name, interval, blocking)
+        with self.lock:
+            heapq.heappush(self.heap, (deadline, next(self.sequence), handle))
+            earliest = self.heap[0][2] is handle
+        if earliest:
+            try:
+                os.write(self.wakeup_write, b"x")
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    raise
+        return handle
+
+    def __run(self):
+        while True:
+            with self.lock:
+                # Cancelled handles are dropped lazily, the heap is rebuilt once they are the majority
+                if self.cancelled > 64 and self.cancelled > len(self.heap) / 2:
+                    for entry in self.heap:
+                        entry[2].queued = not entry[2].cancelled
+                    self.heap = [entry for entry in self.heap if not entry[2].cancelled]
+                    heapq.heapify(self.heap)
+                    self.cancelled = 0
+                timeout = max(self.heap[0][0] - time.time(), 0) if self.heap else None
+            if timeout != 0:
+                readable, _, _ = select.select([self.wakeup_read], [], [], timeout)
+                if readable:
+                    os.read(self.wakeup_read, 4096)
+            now = time.time()
+            due = []
+            with self.lock:
+                while self.heap and self.heap[0][0] <= now:
+                    _, _, handle = heapq.heappop(self.heap)
+                    handle.queued = False
+                    if handle.cancelled:
+                        self.cancelled -= 1
+                        continue
+                    if handle.interval is not None:
+                        handle.queued = True
+                        handle.deadline = max(handle.deadline + handle.interval, now)
+                        heapq.heappush(self.heap, (handle.deadline, next(self.sequence), handle))
+                    due.append(handle)
+            for handle in due:
+                if handle.blocking:
+                    self.__get_jobs(handle.blocking).put(handle)
+                else:
+                    self.__call(handle)
+
+    # Blocking callbacks run one after another on a worker so they never delay the timers. blocking=True selects the
+    # shared worker, a name gives the callbacks their own so they do not wait behind the other ones
+    def __get_jobs(self, blocking):
+        worker_name = "worker" if blocking is True else blocking
+        jobs = self.workers.get(worker_name)
+        if jobs is None:
+            jobs = self.workers[worker_name] = Queue.Queue()
+            worker = threading.Thread(target=self.__work, args=(jobs,), name="{}-{}".format(self.name, worker_name))
+            worker.daemon = True
+            worker.start()
+        return jobs
+
+    def __work(self, jobs):
+        while True:
+            handle = jobs.get()
+            if not handle.cancelled:
+                self.__call(handle)
+
+    def __call(self, handle):
+        handle.fired = handle.interval is None
+        try:
+            handle.callback(*handle.args)
+        except Exception:
+            logger.error("[Scheduler] '{}' timer failed: {}".format(handle.name, traceback.format_exc()))
+
+
+def get_scheduler():
+    global scheduler
+    with scheduler_lock:
+        if scheduler is None:
+            scheduler = Scheduler()
+        return scheduler
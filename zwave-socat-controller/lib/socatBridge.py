@@ -0,0 +1,48 @@
+#!/usr/bin/python
+import logging
+from processSupervisor import ProcessSupervisor
+from connectionManager import LINK_TIMEOUT, LINK_FAILURES, KEEPALIVE_IDLE, KEEPALIVE_INTERVAL, KEEPALIVE_COUNT
+
+logger = logging.getLogger(__name__)
+
+
+class SocatBridge(object):
+
+    SOCAT = "/usr/bin/socat"
+
+    def __init__(self, supervisor=None, link_timeout=LINK_TIMEOUT):
+        self.supervisor = supervisor if supervisor is not None else ProcessSupervisor()
+        self.supervisor.on_exit = self.__on_exit
+        self.link_timeout = link_timeout
+        self.failures = {}
+        # Called with the node name and the link state when socat cannot connect
+        self.on_link_change = None
+
+    def start(self, name, link, host, port):
+        command = [self.SOCAT, "pty,link={},echo=0,raw,waitslave,group=dialout,mode=660".format(link),
+                   "tcp:{}:{},nodelay,keepalive,keepidle={},keepintvl={},keepcnt={},connect-timeout={}".format(
+                       host, port, KEEPALIVE_IDLE, KEEPALIVE_INTERVAL, KEEPALIVE_COUNT, self.link_timeout)]
+        self.failures[name] = 0
+        self.supervisor.start(name, command)
+
+    def stop(self, name):
+        self.failures.pop(name, None)
+        return self.supervisor.stop(name)
+
+    def is_running(self, name):
+        return self.supervisor.is_running(name)
+
+    def get_names(self):
+        return self.supervisor.processes.keys()
+
+    def status(self, name):
+        return self.supervisor.status(name)
+
+    # socat exits with 0 when the node closes the connection and with 1 when it cannot connect to it
+    def __on_exit(self, name, return_code):
+        if return_code <= 0:
+            self.failures[name] = 0
+            return
+        self.failures[name] = self.failures.get(name, 0) + 1
+        if self.failures[name] == LINK_FAILURES and self.on_link_change is not None:
+            self.on_link_change(name, False)
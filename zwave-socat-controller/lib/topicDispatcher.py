@@ -0,0 +1,49 @@
+#!/usr/bin/python
+import threading
+import logging
+import traceback
+
+logger = logging.getLogger(__name__)
+
+
+class TopicDispatcher(object):
+
+    WILDCARD = "+"
+
+    def __init__(self, prefix):
+        self.prefix = prefix.rstrip("/") + "/"
+        self.routes = {}
+        self.lock = threading.Lock()
+
+    def add_handler(self, node, attribute, handler):
+        with self.lock:
+            routes = dict(self.routes)
+            routes[node] = dict(routes.get(node, {}))
+            routes[node][attribute] = handler
+            self.routes = routes
+
+    def remove_handlers(self, node):
+        with self.lock:
+            routes = dict(self.routes)
+            routes.pop(node, None)
+            self.routes = routes
+
+    # Routes '{prefix}/{node}/{attribute}' to the node handler and then to the wildcard one
+    def dispatch(self, topic, payload):
+        if not topic.startswith(self.prefix):
+            return 0
+        node, _, attribute = topic[len(self.prefix):].partition("/")
+        # The routing table is replaced on every change, so readers never need the lock
+        routes = self.routes
+        dispatched = 0
+        for key in (node, self.WILDCARD):
+            node_routes = routes.get(key)
+            if node_routes is None or attribute not in node_routes:
+                continue
+            handler = node_routes[attribute]
+            try:
+                handler(node, payload)
+            except Exception:
+                logger.error(traceback.format_exc())
+            dispatched += 1
+        return dispatched
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+import os
+import shutil
+import hashlib
+import zipfile
+import tempfile
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class WebappInstaller(object):
+
+    CHUNK_SIZE = 64 * 1024
+    VERSION_FILE = ".installed_version"
+
+    def __init__(self, folder):
+        self.folder = folder.rstrip("/")
+        self.parent_folder = os.path.dirname(self.folder)
+        self.old_folder = os.path.join(self.parent_folder, "." + os.path.basename(self.folder) + ".old")
+
+    def get_installed_version(self):
+        try:
+            with open(os.path.join(self.folder, self.VERSION_FILE)) as f:
+                return f.read().strip()
+        except EnvironmentError:
+            return None
+
+    # The version only depends on the names and CRCs in the central directories, no member is read
+    @staticmethod
+    def get_archives_version(archives):
+        sha1 = hashlib.sha1()
+        for zip_file_path, prefix in archives:
+            zip_ref = zipfile.ZipFile(zip_file_path, 'r')
+            try:
+                for info in zip_ref.infolist():
+                    sha1.update("{}\0{}\0{}\0{}\n".format(prefix, info.filename, info.CRC, info.file_size))
+            finally:
+                zip_ref.close()
+        return sha1.hexdigest()
+
+    # archives is a list of (zip file, member prefix), later archives overlay the earlier ones
+    def install(self, archives, version=None):
+        version = version or self.get_archives_version(archives)
+        if version == self.get_installed_version():
+            logger.debug("[WebappInstaller] '{}' already up to date".format(self.folder))
+            return False
+        staging_folder = tempfile.mkdtemp(dir=self.parent_folder, prefix="." + os.path.basename(self.folder) + "-")
+        try:
+            files = 0
+            for zip_file_path, prefix in archives:
+                files += self.__extract(zip_file_path, prefix, staging_folder)
+            if not files:
+                raise zipfile.BadZipfile("no files found under {}".format([prefix for _, prefix in archives]))
+            with open(os.path.join(staging_folder, self.VERSION_FILE), 'w') as f:
+                f.write(version + "\n")
+            os.chmod(staging_folder, 0755)
+            self.__swap(staging_folder)
+        finally:
+            if os.path.isdir(staging_folder):
+                shutil.rmtree(staging_folder, ignore_errors=True)
+        logger.info("[WebappInstaller] '{}' installed ({} files, version {})".format(self.folder, files, version[:12]))
+        return True
+
+    def __extract(self, zip_file_path, prefix, staging_folder):
+        files = 0
+        zip_ref = zipfile.ZipFile(zip_file_path, 'r')
+        try:
+            for info in zip_ref.infolist():
+                if not info.filename.startswith(prefix):
+                    continue
+                relative_path = os.path.normpath(info.filename[len(prefix):])
+                if relative_path == "." or relative_path.startswith("..") or os.path.isabs(relative_path):
+                    continue
+                destination = os.path.join(staging_folder, relative_path)
+                if info.filename.endswith("/"):
+                    if not os.path.isdir(destination):
+                        os.makedirs(destination)
+                    continue
+                if not os.path.isdir(os.path.dirname(destination)):
+                    os.makedirs(os.path.dirname(destination))
+                # Members are streamed in chunks, the CRC is checked by zipfile when the member has been read
+                with zip_ref.open(info) as source, open(destination, 'wb') as f:
+                    shutil.copyfileobj(source, f, self.CHUNK_SIZE)
+                if os.path.getsize(destination) != info.file_size:
+                    raise zipfile.BadZipfile("'{}' size mismatch".format(info.filename))
+                files += 1
+        finally:
+            zip_ref.close()
+        return files
+
+    # Not atomic: the folder is missing between the two back-to-back renames, but it is never a partial tree.
+    # A symlink swap would be atomic, but Jetty refuses to serve files whose canonical path differs (aliases)
+    def __swap(self, staging_folder):
+        if os.path.isdir(self.old_folder):
+            shutil.rmtree(self.old_folder)
+        if os.path.isdir(self.folder):
+            os.rename(self.folder, self.old_folder)
+        try:
+            os.rename(staging_folder, self.folder)
+        except OSError:
+            if os.path.isdir(self.old_folder):
+                os.rename(self.old_folder, self.folder)
+            raise
+        shutil.rmtree(self.old_folder, ignore_errors=True)
@@ -0,0 +1,155 @@
+#!/usr/bin/python
+import time
+import logging
+import metricsHandler as mH
+
+logger = logging.getLogger(__name__)
+
+SOF = 0x01
+ACK = 0x06
+NAK = 0x15
+CAN = 0x18
+REQUEST = 0x00
+RESPONSE = 0x01
+ACK_TIMEOUT = 1.6 # seconds, from the serial API specification
+
+FRAME_NAMES = {SOF: "data", ACK: "ack", NAK: "nak", CAN: "can"}
+
+ACK_TIME = mH.histogram("zwave_frame_ack_seconds", "Time from a host data frame to the controller ACK", ["node"],
+                        (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 1.6))
+RESPONSE_TIME = mH.histogram("zwave_frame_response_seconds", "Time from a host request to the controller response", ["node"],
+                             (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+FRAMES = mH.counter("zwave_frames_total", "Z-Wave serial API frames by sender and type", ["node", "sender", "type"])
+ACK_TIMEOUTS = mH.counter("zwave_frame_ack_timeouts_total", "Host data frames not acknowledged in time", ["node"])
+
+
+class FrameParser(object):
+
+    WAITING = 0
+    LENGTH = 1
+    BODY = 2
+
+    def __init__(self, on_frame):
+        self.on_frame = on_frame
+        self.discarded = 0
+        self.reset()
+
+    def reset(self):
+        self.state = self.WAITING
+        self.remaining = 0
+        self.position = 0
+        self.checksum = 0
+        self.frame_type = None
+        self.function = None
+
+    # The bytes are read in place from the bridge buffer, a frame split across reads is resumed on the next call
+    def feed(self, data, start=0):
+        on_frame = self.on_frame
+        state = self.state
+        for index in xrange(start, len(data)):
+            byte = data[index]
+            if state == self.BODY:
+                self.remaining -= 1
+                if self.remaining:
+                    self.checksum ^= byte
+                    if self.position == 0:
+                        self.frame_type = byte
+                    elif self.position == 1:
+                        self.function = byte
+                    self.position += 1
+                else:
+                    state = self.WAITING
+                    on_frame(SOF, self.frame_type, self.function, byte == self.checksum)
+            elif state == self.WAITING:
+                if byte == SOF:
+                    state = self.LENGTH
+                elif byte == ACK or byte == NAK or byte == CAN:
+                    on_frame(byte, None, None, True)
+                else:
+                    self.discarded += 1
+            else:
+                # Type, function and checksum are always there, a shorter frame cannot be valid
+                if byte < 3:
+                    state = self.WAITING
+                    on_frame(SOF, None, None, False)
+                    continue
+                state = self.BODY
+                self.remaining = byte
+                self.position = 0
+                self.checksum = 0xFF ^ byte
+                self.frame_type = self.function = None
+        self.state = state
+
+
+class FrameInspector(object):
+    # The host is openHAB on the pty side, the controller is the Z-Wave stick behind the TCP side
+
+    def __init__(self, name, clock=time.time):
+        self.name = name
+        self.clock = clock
+        self.host_parser = FrameParser(self.__on_host_frame)
+        self.controller_parser = FrameParser(self.__on_controller_frame)
+        self.ack_pending = None
+        self.responses_pending = {}
+        self.stats = {}
+        self.now = 0
+        self.reset()
+
+    def host_data(self, data, start=0):
+        self.now = self.clock()
+        self.host_parser.feed(data, start)
+
+    def controller_data(self, data, start=0):
+        self.now = self.clock()
+        self.controller_parser.feed(data, start)
+
+    # The partial frames and the pending requests are lost with the connection
+    def reset(self):
+        self.host_parser.reset()
+        self.controller_parser.reset()
+        self.ack_pending = None
+        self.responses_pending = {}
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats["discarded_bytes"] = self.host_parser.discarded + self.controller_parser.discarded
+        return stats
+
+    def __count(self, sender, frame_name):
+        key = "{}_{}".format(sender, frame_name)
+        self.stats[key] = self.stats.get(key, 0) + 1
+        FRAMES.inc(node=self.name, sender=sender, type=frame_name)
+
+    def __on_host_frame(self, kind, frame_type, function, valid):
+        if kind != SOF:
+            self.__count("host", FRAME_NAMES[kind])
+            return
+        if not valid:
+            self.__count("host", "invalid")
+            return
+        self.__count("host", "data")
+        if self.ack_pending is not None and self.now - self.ack_pending > ACK_TIMEOUT:
+            ACK_TIMEOUTS.inc(node=self.name)
+            self.__count("host", "ack_timeout")
+        self.ack_pending = self.now
+        if frame_type == REQUEST:
+            self.responses_pending[function] = self.now
+
+    def __on_controller_frame(self, kind, frame_type, function, valid):
+        if kind == ACK:
+            self.__count("controller", "ack")
+            if self.ack_pending is not None:
+                ACK_TIME.observe(self.now - self.ack_pending, node=self.name)
+                self.ack_pending = None
+            return
+        if kind != SOF:
+            # The host retransmits the frame, its ACK time is measured from the retransmission
+            self.__count("controller", FRAME_NAMES[kind])
+            self.ack_pending = None
+            return
+        if not valid:
+            self.__count("controller", "invalid")
+            return
+        self.__count("controller", "data")
+        if frame_type == RESPONSE and function in self.responses_pending:
+            RESPONSE_TIME.observe(self.now - self.responses_pending.pop(function), node=self.name)
@@ -4,17 +4,31 @@ import os
 import sys
 import time
 import logging
-import subprocess
 import threading
-import urllib2
 import re
 import json
 import zipfile
+import urllib
+import urllib2
+import argparse
 import signal
 import traceback
-import paho.mqtt.client as mqtt_client
 from lib.openhabHandler import OpenHABHandler
+from lib.mqttSession import MqttSession
+from lib.socatBridge import SocatBridge
+from lib.bridgeEngine import BridgeEngine
+from lib.bindingOrchestrator import BindingOrchestrator
+from lib.artifactCache import ArtifactCache
+from lib.artifactRepository import ArtifactRepository
+from lib.webappInstaller import WebappInstaller
+from lib.configReconciler import ConfigReconciler
+from lib.nodeHealth import HealthEvaluator
+from lib.connectionManager import ConnectionManager
+from lib.livenessTracker import LivenessTracker
+from lib.scheduler import get_scheduler
+from lib.catalogHandler import CatalogHandler, get_source
 import lib.notificationsHandler as nH
+import lib.metricsHandler as mH
 logging.basicConfig(filename="/var/log/zwave-socat-controller.log", format='%(asctime)s %(levelname)-8s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -28,60 +42,107 @@ class MqttBrokerParameters(object):
         self.passw = passw
 
 
+class ArtifactStager(object):
+    # Only the catalog, the cache and the mirrors, pre-staging runs on mirror and build hosts without openHAB
+
+    HABMIN_URL = "https://github.com/cdjackson/HABmin/archive/master.zip"
+    HABMIN_MAX_AGE = 12 # hours
+
+    def __init__(self, cache_folder="/var/cache/zwave-socat-controller", fast_start=True, catalog_source=None, artifact_mirrors=None):
+        self.cache = ArtifactCache(cache_folder)
+        self.ghh = GitHubInfoHandler(cache_folder + "/catalog.json", fast_start, catalog_source)
+        self.repository = ArtifactRepository(self.cache, artifact_mirrors)
+
+    def prestage(self, mirror_folder=None):
+        self.ghh.wait_for_update()
+        artifacts = []
+        manifest = {"zwave": {}, "habmin": {}}
+        for kind, infos in (("zwave", self.ghh.get_zwaves_bindings_info()), ("habmin", self.ghh.get_habmin_bindings_info())):
+            for name, info in sorted(infos.items()):
+                path = ArtifactRepository.get_path(kind, info["url"])
+                manifest[kind][name] = {"version": info["version"], "date": info["date"], "url": urllib.quote(path, safe="/()")}
+                artifacts.append((path, info["url"], "{}-{}".format(info["version"], info["date"]), None, info.get("hash"),
+                                  manifest[kind][name]))
+        extension_url = self.ghh.get_habmin_extension_url_by_name()
+        artifacts.append((ArtifactRepository.get_path("habmin", extension_url), extension_url, None, self.HABMIN_MAX_AGE*60*60, None, None))
+        artifacts.append(("HABmin-master.zip", self.HABMIN_URL, None, self.HABMIN_MAX_AGE*60*60, None, None))
+        staged = 0
+        for path, url, version, max_age, expected_hash, manifest_entry in artifacts:
+            try:
+                cached_path = self.repository.fetch(path, url, version, max_age, expected_hash)
+                if mirror_folder:
+                    destination = os.path.join(mirror_folder, *path.split("/"))
+                    if not os.path.isdir(os.path.dirname(destination)):
+                        os.makedirs(os.path.dirname(destination))
+                    ArtifactCache.copy_atomically(cached_path, destination)
+                if manifest_entry is not None:
+                    # Lets the mirror clients check what they download
+                    manifest_entry["sha256"] = ArtifactCache.get_hashes(cached_path)["sha256"]
+                staged += 1
+                logger.info("[ArtifactStager] '{}' pre-staged".format(path))
+            except (EnvironmentError, urllib2.URLError) as e:
+                logger.error("[ArtifactStager] '{}' cannot be pre-staged: {}".format(path, e))
+        if mirror_folder:
+            with open(os.path.join(mirror_folder, "manifest.json"), 'w') as f:
+                json.dump(manifest, f, indent=2, sort_keys=True)
+        return staged, len(artifacts)
+
+
 class ZWaveBindingsHandler(object):
 
-    def __init__(self, default_file="/etc/default/openhab", configuration_folder="/etc/openhab/configurations", addons_folder="/usr/share/openhab/addons", habmin_folder="/usr/share/openhab/webapps/habmin"):
-        self.ghh = GitHubInfoHandler()
+    HABMIN_URL = ArtifactStager.HABMIN_URL
+    HABMIN_MAX_AGE = ArtifactStager.HABMIN_MAX_AGE
+
+    def __init__(self, default_file="/etc/default/openhab", configuration_folder="/etc/openhab/configurations", addons_folder="/usr/share/openhab/addons", habmin_folder="/usr/share/openhab/webapps/habmin", cache_folder="/var/cache/zwave-socat-controller", oh=None, fast_start=True, catalog_source=None, artifact_mirrors=None, spare_serial_ports=2):
+        stager = ArtifactStager(cache_folder, fast_start, catalog_source, artifact_mirrors)
+        self.cache = stager.cache
+        self.ghh = stager.ghh
         self.configuration_folder = configuration_folder
         self.addons_folder = addons_folder
         self.habmin_folder = habmin_folder
-        self.webapps_folder = "/".join(self.habmin_folder.split("/")[0:-1])
-        self.default_file = default_file
-        self.oh = OpenHABHandler()
+        self.habmin_installer = WebappInstaller(self.habmin_folder)
+        self.reconciler = ConfigReconciler(configuration_folder, default_file, spare_serial_ports)
+        self.repository = stager.repository
+        self.oh = oh if oh is not None else OpenHABHandler(addons_folder=addons_folder)
         logger.debug("[ZWaveHandler] Service started")
 
-    def __install_addon_from_url(self, url):
-        addon_name = url.split("/")[-1].split("?")[0]
-        page = urllib2.urlopen(url)
-        file = page.read()
-        with open(self.addons_folder + "/" + addon_name, 'wb') as f:
-            f.write(file)
-        logger.info("[ZWaveHandler] '{}' binding installed".format(addon_name.split(".")[3].split("_")[0]))
-
-    def __install_habmin_html_files(self):
-        url = "https://github.com/cdjackson/HABmin/archive/master.zip"
-        file_name = url.split("/")[-1]
-        file = urllib2.urlopen(url).read()
-        zip_file_path = self.webapps_folder + "/" + file_name
-        with open(zip_file_path, 'wb') as f:
-            f.write(file)
-        zip_ref = zipfile.ZipFile(zip_file_path, 'r')
-        zip_ref.extractall(self.webapps_folder)
-        zip_ref.close()
-        os.rename(self.webapps_folder + "/HABmin-master", self.webapps_folder + "/habmin")
-        os.remove(zip_file_path)
-
-    def __install_habmin_extension_html_files(self):
-        url = self.ghh.get_habmin_extension_url_by_name()
-        file_name = url.split("/")[-1]
-        file = urllib2.urlopen(url).read()
-        zip_file_path = self.webapps_folder + "/" + file_name
-        with open(zip_file_path, 'wb') as f:
-            f.write(file)
-        zip_ref = zipfile.ZipFile(zip_file_path, 'r')
-        zip_ref.extractall(self.webapps_folder)
-        zip_ref.close()
-        os.remove(zip_file_path)
+    def __get_artifact_info(self, kind, name):
+        info = self.ghh.get_zwaves_bindings_info() if kind == "zwave" else self.ghh.get_habmin_bindings_info()
+        # Sites without a reachable catalog can still be provisioned from a local mirror
+        return info.get(name) or self.repository.lookup(kind, name)
+
+    def __install_addon(self, kind, name, info, results):
+        path = ArtifactRepository.get_path(kind, info["url"])
+        destination = self.addons_folder + "/" + path.split("/")[-1]
+        try:
+            self.repository.install(path, info["url"], destination, "{}-{}".format(info["version"], info["date"]),
+                                    expected_hash=info.get("hash"))
+        except (EnvironmentError, urllib2.URLError) as e:
+            logger.error("[ZWaveHandler] '{}' {} cannot be installed: {}".format(name, kind, e))
+            results[(kind, name)] = None
+            return
+        results[(kind, name)] = destination
+        logger.info("[ZWaveHandler] '{}' {} installed".format(name, "binding" if kind == "zwave" else "habmin"))
+
+    def __install_habmin_web_files(self):
+        max_age = self.HABMIN_MAX_AGE*60*60
+        extension_url = self.ghh.get_habmin_extension_url_by_name()
+        archives = [(self.repository.fetch("HABmin-master.zip", self.HABMIN_URL, max_age=max_age), "HABmin-master/"),
+                    (self.repository.fetch(ArtifactRepository.get_path("habmin", extension_url), extension_url, max_age=max_age), "habmin/")]
+        return self.habmin_installer.install(archives)
 
     def update(self, zwave_bindings):
-        reboot = self.update_jars(zwave_bindings)
-        reboot = self.update_configuration_file(zwave_bindings) or reboot
-        reboot = self.update_default_file(zwave_bindings) or reboot
-        reboot = self.update_logback_files(zwave_bindings) or reboot
+        installed_jars, uninstalled_jars = self.update_jars(zwave_bindings)
+        reboot = self.reconciler.reconcile(zwave_bindings)
         logger.debug("[ZWaveHandler] Update finished")
         if reboot:
             logger.info("[ZwaveHandler] Configuration changed")
-            self.oh.restart_openhab()
+            self.oh.restart_openhab("configuration changed")
+        elif installed_jars or uninstalled_jars:
+            # Only the affected bundles are reloaded, the other Z-Wave networks keep running
+            if not self.oh.reload_bundles(installed_jars, uninstalled_jars):
+                logger.warning("[ZwaveHandler] Bundles cannot be reloaded, restarting openHAB")
+                self.oh.restart_openhab("bundles cannot be reloaded")
 
     def update_jars(self, zwave_bindings):
         def get_zwave_bindings_numbers(list):
@@ -137,174 +198,46 @@ class ZWaveBindingsHandler(object):
             habmin_binding_to_install = set_zwave_binding_from_number(max_zwave_bindings_number)
             habmin_binding_to_uninstall = installed_habmin_version
 
+        # The catalog may still be loading in the background on the first update
+        if zwave_bindings_to_install or habmin_binding_to_install:
+            self.ghh.wait_for_update()
         # ZWave bindings installation
+        results = {}
         zwave_bindings_to_install_threads = []
         for binding in zwave_bindings_to_install:
-            try:
-                url = self.ghh.get_zwave_url_by_name(binding)
-                zwave_bindings_to_install_threads.append(threading.Thread(target=self.__install_addon_from_url, args=(url,)))
-            except KeyError:
-                logger.error("[ZWaveHandler] '{}' binding cannot be installed".format(binding))
+            info = self.__get_artifact_info("zwave", binding)
+            if not info:
+                logger.error("[ZWaveHandler] '{}' binding cannot be installed, it is not in the catalog".format(binding))
+                continue
+            zwave_bindings_to_install_threads.append(threading.Thread(target=self.__install_addon, args=("zwave", binding, info, results)))
         for thread in zwave_bindings_to_install_threads: thread.start()
         for thread in zwave_bindings_to_install_threads: thread.join()
         # ZWave bindings uninstallation
+        uninstalled_jars = []
         for binding in zwave_bindings_to_uninstall:
-            os.remove(self.addons_folder + "/" + installed_zwave_bindings[binding])
+            uninstalled_jars.append(self.addons_folder + "/" + installed_zwave_bindings[binding])
+            os.remove(uninstalled_jars[-1])
             logger.info("[ZWaveHandler] '{}' binding uninstalled".format(binding))
         # HABmin binding installation
         if habmin_binding_to_install:
-            try:
-                self.__install_addon_from_url(self.ghh.get_habmin_url_by_name(habmin_binding_to_install))
-            except KeyError:
-                habmin_binding_to_uninstall = None
-                logger.error("[ZWaveHandler] '{}' habmin cannot be installed".format(habmin_binding_to_install))
+            info = self.__get_artifact_info("habmin", habmin_binding_to_install)
+            if info:
+                self.__install_addon("habmin", habmin_binding_to_install, info, results)
+            else:
+                logger.error("[ZWaveHandler] '{}' habmin cannot be installed, it is not in the catalog".format(habmin_binding_to_install))
+            if not results.get(("habmin", habmin_binding_to_install)):
+                habmin_binding_to_install = habmin_binding_to_uninstall = None
         # HABmin binding uninstallation
         if habmin_binding_to_uninstall:
-            os.remove(self.addons_folder + "/" + installed_habmin)
+            uninstalled_jars.append(self.addons_folder + "/" + installed_habmin)
+            os.remove(uninstalled_jars[-1])
             logger.debug("[ZWaveHandler] '{}' habmin uninstalled".format(habmin_binding_to_uninstall))
-        # HABmin web files installation
-        if not os.path.isdir(self.habmin_folder):
-            self.__install_habmin_html_files()
-            logger.debug("[ZWaveHandler] HABmin html files installed")
-        # HABmin extended web files installation
-        if not os.path.isfile(self.habmin_folder + "/extension_installed"):
-            self.__install_habmin_extension_html_files()
-            logger.debug("[ZWaveHandler] HABmin extension html files installed")
-        if zwave_bindings_to_install or zwave_bindings_to_uninstall or habmin_binding_to_uninstall or habmin_binding_to_install:
-            return True
-        return False
-
-    def update_configuration_file(self, zwave_bindings):
-        openhab_configuration_path = self.configuration_folder + "/openhab.cfg"
-        openhab_configuration_default_path = self.configuration_folder + "/openhab_default.cfg"
-        reboot = False
-
-        path = openhab_configuration_path
-        if not os.path.exists(openhab_configuration_path): path = openhab_configuration_default_path
-        with open(path, 'r') as f:
-            content = f.read()
-
-        zwave_section_pattern = re.compile(ur'\#+\s+Z-Wave\s+Binding\s+\#+(.*)\n#+\s+Nikobus', re.DOTALL)
-        result = re.search(zwave_section_pattern, content)
-
-        content_searchable = content
-        if result: content_searchable = result.group(1)
-
-        n_content_searchable = content_searchable
-        for binding in zwave_bindings:
-            binding_port = "/dev/{}".format(binding)
-            pattern = re.compile(ur'[^\#]{}:port=(.*)\n'.format(binding))
-            result = re.search(pattern, n_content_searchable)
-            if result:
-                if binding_port != result.group(1):
-                    n_content_searchable = n_content_searchable.replace(result.group(0), "\n{0}:port={1}\n".format(binding, binding_port))
-                    reboot = True
-            else:
-                n_content_searchable += "{0}:port=/dev/{0}\n".format(binding)
-                reboot = True
-
-        if content_searchable == n_content_searchable:
-            logger.debug("[ZWaveHandler] Configuration file not updated")
-            return reboot
-
-        content = content.replace(content_searchable, n_content_searchable)
-
-        with open(openhab_configuration_path, 'w') as f:
-            f.write(content)
-        logger.info("[ZWaveHandler] Configuration file updated")
-        return reboot
-
-    def update_default_file(self, zwave_bindings):
-        zwave_ports = ["/dev/{}".format(binding) for binding in zwave_bindings]
-        configured_serial_ports = []
-        reboot = False
-        old_line = new_line = None
-        java_args_keyword = "JAVA_ARGS="
-        sp_keyword = "-Dgnu.io.rxtx.SerialPorts="
-
-        with open(self.default_file, 'r') as f:
-            content = f.read()
-
-        for line in content.splitlines():
-            if java_args_keyword in line:
-                old_line = line
-                java_args = line.strip(java_args_keyword).replace('"','').split(" ")
-
-                configured_other_java_args = [arg for arg in java_args if sp_keyword not in arg]
-                __configured_serial_ports = [arg.replace(sp_keyword,'') for arg in java_args if sp_keyword in arg]
-                if __configured_serial_ports:
-                    configured_serial_ports = __configured_serial_ports[0].split(":")
-
-                configured_zwave_ports = [port for port in configured_serial_ports if "zwave" in port]
-                configured_other_ports = [port for port in configured_serial_ports if "zwave" not in port]
-
-                reboot = set(zwave_ports) != set(configured_zwave_ports)
-
-                new_serial_ports = ":".join(zwave_ports + configured_other_ports)
-                new_serial_ports_text = sp_keyword + new_serial_ports
-                new_java_args = " ".join([new_serial_ports_text] + configured_other_java_args)
-                new_line = java_args_keyword + '"' + new_java_args + '"'
-                break
-
-        if old_line == new_line:
-            logger.debug("[ZWaveHandler] Default file not updated")
-            return reboot
-
-        content = content.replace(old_line, new_line)
-
-        with open(self.default_file, 'w') as f:
-            f.write(content)
-
-        logger.info("[ZWaveHandler] Default file updated")
-        return reboot
-
-    def update_logback_files(self, zwave_bindings):
-        logback_folder = "/".join(self.configuration_folder.split("/")[:-1]) + "/"
-        logback_files = ['logback.xml', 'logback_debug.xml']
-        logback_files_paths = [logback_folder + logback_name for logback_name in logback_files]
-
-        def get_logger_text(binding, level):
-            text = '\t<logger name="org.openhab.binding.{0}" level="{1}" additivity="false">\n' \
-                   '\t\t<appender-ref ref="{2}FILE" />\n\t</logger>'.format(binding, level.upper(), binding.upper())
-            return text
-
-        def get_appender_text(binding):
-            text = '\t<appender name="{0}FILE" class="ch.qos.logback.core.rolling.RollingFileAppender">\n' \
-                   '\t\t<file>${{openhab.logdir:-logs}}/{1}.log</file>\n' \
-                   '\t\t<rollingPolicy class="ch.qos.logback.core.rolling.TimeBasedRollingPolicy">\n' \
-                   '\t\t\t<fileNamePattern>${{openhab.logdir:-logs}}/{2}-%d{{yyyy-ww}}.log.zip</fileNamePattern>\n' \
-                   '\t\t\t<maxHistory>15</maxHistory>\n' \
-                   '\t\t</rollingPolicy>\n' \
-                   '\t\t<encoder>\n' \
-                   '\t\t\t<pattern>%d{{yyyy-MM-dd HH:mm:ss.SSS}} [%-5level] [%-30.30logger{{36}}:%-4line]- ' \
-                   '%msg%n</pattern>\n' \
-                   '\t\t</encoder>\n' \
-                   '\t</appender>'.format(binding.upper(), binding, binding)
-            return text
-
-        for logback_file in logback_files_paths:
-            log_level = 'debug' if 'debug' in logback_file else 'info'
-
-            with open(logback_file, 'r') as f:
-                content = f.read()
-
-            for zwave in zwave_bindings:
-                if '<logger name="org.openhab.binding.{0}"'.format(zwave) not in content:
-                    old_line = '<logger name="org.openhab" level="{0}"/>'.format(log_level.upper())
-                    if log_level == "debug":
-                        old_line = '<logger name="org.openhab" level="{0}" />'.format(log_level.upper())
-                    new_line = old_line + "\n\n" + get_logger_text(zwave, log_level)
-                    content = content.replace(old_line, new_line)
-
-                if '<appender name="{0}FILE"'.format(zwave.upper()) not in content:
-                    old_line = '\t<logger name="runtime.busevents" level="INFO" additivity="false">'
-                    new_line = get_appender_text(zwave) + '\n\n' + old_line
-                    content = content.replace(old_line, new_line)
-
-            with open(logback_file, 'w') as f:
-                f.write(content)
-
-        return False
+        # HABmin web files installation, the extension files are overlaid on the HABmin files
+        try:
+            self.__install_habmin_web_files()
+        except (EnvironmentError, urllib2.URLError, zipfile.BadZipfile) as e:
+            logger.error("[ZWaveHandler] HABmin html files cannot be installed: {}".format(e))
+        return [path for path in results.values() if path], uninstalled_jars
 
 
 class GitHubInfoHandler(object):
@@ -314,20 +247,32 @@ class GitHubInfoHandler(object):
     ZWAVE_FOLDER = "zwave"
     HABMIN_FOLDER = "habmin"
     UPDATE_PERIOD = 12 # hours
+    UPDATE_WAIT_TIMEOUT = 30 # seconds
 
-    def __init__(self):
+    def __init__(self, catalog_file="/var/cache/zwave-socat-controller/catalog.json", background=True, source=None):
         logger.debug("[GitHubInfoHandler] Service started")
-        self.update_thread = None
-        self.zwaves_bindings_info = {}
-        self.habmin_bindings_info = {}
-        self.last_update = None
-        self.update_bindings_info_periodically()
+        self.catalog = CatalogHandler(get_source(source, self.USER, self.PROJECT), catalog_file)
+        self.updated = threading.Event()
+        self.zwaves_bindings_info = self.catalog.get("zwave")
+        self.habmin_bindings_info = self.catalog.get("habmin")
+        self.last_update = self.catalog.last_update
+        if background:
+            # The last known catalog is served while the first refresh runs
+            get_scheduler().call_later(0, self.update_bindings_info, name="catalog-refresh", blocking="catalog")
+        else:
+            self.update_bindings_info()
+        # Its own worker, a source timing out must not hold the bindings updates and restarts back, nor the opposite
+        self.update_timer = get_scheduler().call_every(self.UPDATE_PERIOD*60*60, self.update_bindings_info,
+                                                       name="catalog-refresh", blocking="catalog")
 
     def get_zwaves_bindings_info(self):
         return self.zwaves_bindings_info
 
     def get_habmin_bindings_info(self):
-        return self.habmin_binding_info
+        return self.habmin_bindings_info
+
+    def wait_for_update(self, timeout=UPDATE_WAIT_TIMEOUT):
+        return self.updated.wait(timeout)
 
     def get_zwave_info_by_name(self, name):
         try:
@@ -361,225 +306,253 @@ class GitHubInfoHandler(object):
         return "https://github.com/{}/{}/blob/master/{}/habmin.zip?raw=true".format(self.USER, self.PROJECT, self.HABMIN_FOLDER)
 
     def update_bindings_info(self):
-        self.update_zwaves_bindings_info()
-        self.update_habmin_bindings_info()
-        self.last_update = time.time()
-        logger.debug("[GitHubInfoHandler] Bindings repository info updated")
-
-    def update_bindings_info_periodically(self, period=UPDATE_PERIOD):
-        self.update_bindings_info()
-        self.update_thread = threading.Timer(period*60*60, self.update_bindings_info_periodically)
-        self.update_thread.daemon = True
-        self.update_thread.start()
-
-    def update_zwaves_bindings_info(self):
-        url = "https://github.com/{}/{}/tree/master/{}".format(self.USER, self.PROJECT, self.ZWAVE_FOLDER)
-        zwave_binding_pattern = re.compile(ur'\"(\/{0}\/{1}\/blob\/master\/{2}\/org\.openhab\.binding\.([^\s]*)\_([\d\.]*)\(([\d\.\-]*)\)\.jar)\"'.format(self.USER, self.PROJECT, self.ZWAVE_FOLDER))
-
-        try:
-            page = urllib2.urlopen(url).read()
-        except urllib2.URLError:
-            return
-
-        bindings = re.findall(zwave_binding_pattern, page)
-
-        for binding in bindings:
-            name = binding[1]
-            version = binding[2]
-            date = binding[3]
-            url = "https://github.com{}?raw=true".format(binding[0])
-            self.zwaves_bindings_info[name] = { "version":version, "date":date, "url":url }
-
-    def update_habmin_bindings_info(self):
-        url = "https://github.com/{}/{}/tree/master/{}".format(self.USER, self.PROJECT, self.HABMIN_FOLDER)
-        habmin_binding_pattern = re.compile(ur'\"(\/{0}\/{1}\/blob\/master\/{2}\/org\.openhab\.io\.habmin\_([^\s]*)\_([\d\.]*)\(([\d\.\-]*)\)\.jar)\"'.format(self.USER, self.PROJECT, self.HABMIN_FOLDER))
-
         try:
-            page = urllib2.urlopen(url).read()
-        except urllib2.URLError:
-            return
-
-        bindings = re.findall(habmin_binding_pattern, page)
-
-        for binding in bindings:
-            url = "https://github.com{}?raw=true".format(binding[0])
-            name = binding[1]
-            version = binding[2]
-            date = binding[3]
-            self.habmin_bindings_info[name] = { "version":version, "date":date, "url":url }
+            self.catalog.refresh()
+            self.last_update = self.catalog.last_update
+            logger.debug("[GitHubInfoHandler] Bindings repository info updated")
+        finally:
+            self.updated.set()
 
 
 class NodeController(object):
 
     MAX_TIMEOUT = 24 # hours
     openhab_control_enabled = True
-    binding_status = {}
     active_nodes = {}
     oh = None
     zbh = None
+    orchestrator = None
 
-    def __init__(self, mqtt_params=MqttBrokerParameters(), prefix="/devices", openhab_control_enabled=True):
+    def __init__(self, mqtt_params=MqttBrokerParameters(), prefix="/devices", openhab_control_enabled=True, fast_start=True, catalog_source=None, artifact_mirrors=None, spare_serial_ports=2):
         self.mqtt_params = mqtt_params
         self.prefix = prefix
         self.detected_nodes = {}
+        self.processing = get_scheduler().debounce(0.5, self.process_detected_nodes, name="controller-update", blocking=True)
+        self.lock = threading.Lock()
+        self.liveness = LivenessTracker(self.MAX_TIMEOUT*60*60, self.handle_node_alive, self.handle_node_expired)
         NodeController.openhab_control_enabled = openhab_control_enabled
         if NodeController.openhab_control_enabled:
+            phase_start = time.time()
             NodeController.oh = OpenHABHandler()
-            NodeController.zbh = ZWaveBindingsHandler()
-        self.timer = None
-        self.client = mqtt_client.Client("zwave-node-controller")
-        self.client.username_pw_set(self.mqtt_params.user, self.mqtt_params.passw)
-        self.client.connect(self.mqtt_params.host, self.mqtt_params.port, 60)
-        self.client.subscribe([("{}/+/$fwname".format(self.prefix), 1), ("{}/+/time/last_report".format(self.prefix), 1)])
-        self.client.on_message = self.message_handler
-        self.client.loop_start()
+            NodeController.zbh = ZWaveBindingsHandler(oh=NodeController.oh, fast_start=fast_start, catalog_source=catalog_source,
+                                                     artifact_mirrors=artifact_mirrors, spare_serial_ports=spare_serial_ports)
+            NodeController.orchestrator = BindingOrchestrator(NodeController.oh)
+            logger.info("[Controller] openHAB handlers ready in {:.0f} ms".format((time.time()-phase_start)*1000))
+        phase_start = time.time()
+        self.session = MqttSession(self.mqtt_params, self.prefix)
+        self.session.add_handler("+", "$fwname", self.handle_fwname)
+        self.session.add_handler("+", "time/last_report", self.handle_last_report)
+        self.session.subscribe("{}/+/$fwname".format(self.prefix), 1)
+        self.session.subscribe("{}/+/time/last_report".format(self.prefix), 1)
+        logger.info("[Controller] MQTT subscriptions requested in {:.0f} ms".format((time.time()-phase_start)*1000))
         logger.debug("[Controller] Service started")
 
-    def message_handler(self, client, obj, msg):
-        if "$fwname" in msg.topic and "zwave-socat-node" in msg.payload:
-            node_name = msg.topic.replace(self.prefix+"/","").replace("/$fwname","")
-            if node_name not in self.detected_nodes: self.detected_nodes[node_name]= { "binding":node_name }
-        if "time/last_report" in msg.topic:
-            node_name = msg.topic.replace(self.prefix+"/","").replace("/time/last_report","")
-            if node_name in self.detected_nodes: self.detected_nodes[node_name]["last_update"] = int(msg.payload)
-        if self.timer is not None:
-            self.timer.cancel()
-        self.timer = threading.Timer(0.5, self.process_detected_nodes)
-        self.timer.start()
+    def handle_fwname(self, node_name, payload):
+        if "zwave-socat-node" in payload and node_name not in self.detected_nodes:
+            self.detected_nodes[node_name] = { "binding":node_name }
 
-    def process_detected_nodes(self):
-        self.timer = None
-        correct_nodes = []
-        for node_name, node_info in self.detected_nodes.iteritems():
-            if "last_update" in node_info and int(time.time()) - node_info["last_update"] <= self.MAX_TIMEOUT*60*60:
-                correct_nodes.append(node_name)
-        active_nodes_list = self.active_nodes.keys()
-        new_nodes = list(set(correct_nodes) - set(active_nodes_list))
-        delete_nodes = list(set(active_nodes_list) - set(correct_nodes))
-        for node in new_nodes:
+    def handle_last_report(self, node_name, payload):
+        if node_name in self.detected_nodes:
+            self.detected_nodes[node_name]["last_update"] = int(payload)
+            self.liveness.touch(node_name, int(payload))
+
+    def handle_node_alive(self, node):
+        with self.lock:
             logger.info("[Controller] Node detected: {}".format(node))
             nH.send_notification({"text": "New '{0}' node detected".format(node)})
-            NodeController.active_nodes[node] = Node(node, self.mqtt_params, self.prefix)
-        for node in delete_nodes:
+            NodeController.active_nodes[node] = Node(node, self.session, self.prefix)
+        self.schedule_processing()
+
+    def handle_node_expired(self, node):
+        with self.lock:
             logger.info("[Controller] Node deleted: {}".format(node))
             nH.send_notification({"text": "Old '{0}' node deleted".format(node)})
-            NodeController.active_nodes[node].delete()
-            del NodeController.active_nodes[node]
-        if NodeController.openhab_control_enabled and (new_nodes or delete_nodes):
-            NodeController.zbh.update(correct_nodes)
+            NodeController.active_nodes.pop(node).delete()
+        self.schedule_processing()
 
-    @staticmethod
-    def handle_binding(name):
+    def schedule_processing(self):
         if not NodeController.openhab_control_enabled:
             return
+        self.processing.trigger()
 
-        new_status = NodeController.active_nodes[name].start_binding
-        if name in NodeController.binding_status and NodeController.binding_status[name] == new_status:
-            return
-        NodeController.__start_binding(name) if new_status else NodeController.__stop_binding(name)
-        NodeController.binding_status[name] = new_status
+    def process_detected_nodes(self):
+        NodeController.zbh.update(self.liveness.get_alive())
 
     @staticmethod
-    def __start_binding(name):
-        if not NodeController.oh.start_binding(name):
-            logger.error("[%s] Binding has failed starting..." % (name))
-            NodeController.oh.restart_openhab()
-        else:
-            logger.debug("[%s] Binding correctly started..." % (name))
+    def handle_binding(name, status):
+        if not NodeController.openhab_control_enabled or NodeController.orchestrator is None:
+            return
+        NodeController.orchestrator.request(name, status)
 
     @staticmethod
-    def __stop_binding(name):
-        if not NodeController.oh.stop_binding(name):
-            logger.error("[%s] Binding has failed stopping..." % (name))
-            NodeController.oh.restart_openhab()
-        else:
-            logger.debug("[%s] Binding correctly stopped..." % (name))
+    def handle_link(name, up):
+        node = NodeController.active_nodes.get(name)
+        if node is not None:
+            node.handle_link(up)
 
 
 class Node(object):
 
-    KILL_TIME = 3
+    UNHEALTHY_TO_KILL_TIME = mH.histogram("zwave_node_unhealthy_to_port_killed_seconds",
+                                          "Time from a node reporting it is not healthy to its local port being killed", ["node"])
+    bridge = SocatBridge()
+    health_parameters = {}
+    device_folder = "/dev"
+    connection_manager = None
 
-    def __init__(self, name, mqtt_params=MqttBrokerParameters(), prefix="devices"):
-        self.mqtt_params = mqtt_params
+    def __init__(self, name, session, prefix="devices"):
+        self.session = session
         self.name = name
         self.online = None
-        self.local_port = "/dev/" + name
+        self.local_port = os.path.join(self.device_folder, name)
         self.local_socat_status = None
         self.remote_ip = self.remote_port = self.remote_socat_status = None
+        self.link_up = None
+        self.probing = False
         self.start_binding = None
-        self.kill_timer = None
-        time.sleep(0.05)
-
-        self.client = mqtt_client.Client("%s-node-handler" % (self.name))
-        self.client.username_pw_set(self.mqtt_params.user, self.mqtt_params.passw)
-        self.client.connect(self.mqtt_params.host, self.mqtt_params.port, 60)
-        self.client.subscribe("{0}/{1}/#".format(prefix,self.name), 0)
-        self.client.on_message = self.mqtt_message_handler
-        self.client.loop_start()
-
-    def mqtt_message_handler(self, client, obj, msg):
-        if "$online" in msg.topic:
-            if msg.payload == "false": self.remote_socat_status = "false"
-            self.online = msg.payload
-            logger.debug("[%s] Node online: %s" % (self.name, msg.payload))
-        if "$localip" in msg.topic: self.remote_ip = msg.payload
-        if "socat/port" in msg.topic: self.remote_port = msg.payload
-        if "socat/status" in msg.topic:
-            self.remote_socat_status = msg.payload
-            logger.debug("[%s] Remote socat status: %s" % (self.name, msg.payload))
+        self.prefix = prefix
+        self.lock = threading.RLock()
+        self.health = HealthEvaluator(self.name, lambda healthy: self.apply_health(), **self.health_parameters)
+        self.session.add_handler(self.name, "$online", self.handle_online)
+        self.session.add_handler(self.name, "$localip", self.handle_local_ip)
+        self.session.add_handler(self.name, "socat/port", self.handle_socat_port)
+        self.session.add_handler(self.name, "socat/status", self.handle_socat_status)
+        for topic in self.__get_topics():
+            self.session.subscribe(topic)
+
+    def handle_online(self, node_name, payload):
+        if payload == "false": self.remote_socat_status = "false"
+        self.online = payload
+        logger.debug("[%s] Node online: %s" % (self.name, payload))
+        self.handle_socat_connection()
+
+    def handle_local_ip(self, node_name, payload):
+        self.remote_ip = payload
+        self.handle_socat_connection()
+
+    def handle_socat_port(self, node_name, payload):
+        self.remote_port = payload
+        self.handle_socat_connection()
+
+    def handle_socat_status(self, node_name, payload):
+        self.remote_socat_status = payload
+        logger.debug("[%s] Remote socat status: %s" % (self.name, payload))
         self.handle_socat_connection()
 
     def handle_socat_connection(self):
         if not self.online or not self.remote_socat_status: return
-        node_healthy = str(self.online == "true" and self.remote_socat_status == "true").lower()
-        # Special case where the timer is active
-        if self.kill_timer:
-            if node_healthy == "true":
-                logger.warning("[%s] Fake node death, not killing the local port..." % (self.name))
-                self.kill_timer.cancel()
-                self.kill_timer = None
-            return
-        # There is a mismatch between the local socat status and the remote socat status
-        if self.local_socat_status != node_healthy: # There is a mismatch between the local socat status and the remote socat status
-            # The remote socat is online, so we start the local socat
-            if node_healthy == "true":
-                if self.local_port and self.remote_ip and self.remote_port:
-                    logger.info("[%s] Node healthy..." % (self.name))
-                    nH.send_notification({"text": "'{0}' node ({1}) is healthy".format(self.name, self.remote_ip)})
-                    self.start_local_port()
-            # The remote socat is offline, so we kill the local socat
+        with self.lock:
+            announced = self.online == "true" and self.remote_socat_status == "true"
+            self.health.report(announced and self.link_up is not False)
+            self.update_link_probe(announced)
+            self.apply_health()
+
+    # Link results come from the bridge and the connection manager, a link down is already confirmed by several failed connections
+    def handle_link(self, up):
+        with self.lock:
+            if up == self.link_up: return
+            self.link_up = up
+            logger.debug("[%s] Link up: %s" % (self.name, up))
+            if up:
+                # The link may come up through the bridge while a probe is still scheduled
+                if self.probing:
+                    self.connection_manager.unwatch(self.name)
+                    self.probing = False
+            else:
+                self.health.report(False, immediate=True)
+            if self.online and self.remote_socat_status:
+                self.handle_socat_connection()
             else:
-                self.kill_timer = threading.Timer(self.KILL_TIME, self.mark_as_not_healthy)
-                self.kill_timer.start()
+                self.apply_health()
+
+    # The link of a node announced as ready but unreachable is probed until it answers
+    def update_link_probe(self, announced):
+        if self.connection_manager is None: return
+        probing = announced and self.link_up is False and self.remote_ip and self.remote_port
+        if probing and not self.probing:
+            self.connection_manager.watch(self.name, self.remote_ip, self.remote_port, NodeController.handle_link)
+        elif self.probing and not probing:
+            self.connection_manager.unwatch(self.name)
+        self.probing = bool(probing)
+
+    def apply_health(self):
+        with self.lock:
+            healthy = self.health.is_healthy()
+            if healthy is None: return
+            node_healthy = str(healthy).lower()
+            # There is a mismatch between the local socat status and the evaluated node health
+            if self.local_socat_status != node_healthy:
+                # The remote socat is online, so we start the local socat
+                if healthy:
+                    if self.local_port and self.remote_ip and self.remote_port:
+                        logger.info("[%s] Node healthy..." % (self.name))
+                        nH.send_notification({"text": "'{0}' node ({1}) is healthy".format(self.name, self.remote_ip)})
+                        self.start_local_port()
+                # The remote socat is offline, so we kill the local socat
+                else:
+                    self.mark_as_not_healthy()
 
     def mark_as_not_healthy(self):
         logger.warning("[%s] Node not healthy..." % (self.name))
         nH.send_notification({"text": "'{0}' node ({1}) is not healthy".format(self.name, self.remote_ip)})
         self.kill_local_port()
+        if self.health.reported_time is not None:
+            self.UNHEALTHY_TO_KILL_TIME.observe(time.time() - self.health.reported_time, node=self.name)
 
     def kill_local_port(self):
         self.set_binding_status(False)
-        kill_command = "kill -9 $(ps ax | grep \"/usr/bin/socat\" | grep \"%s,\" | grep -v grep | awk \'{print $1}\')" % (self.name)
-        error = subprocess.Popen(kill_command, stderr=subprocess.PIPE, shell=True).communicate()[1]
+        killed = self.bridge.stop(self.name)
         self.local_socat_status = "false"
-        self.kill_timer = None
-        if not error: logger.debug("[%s] Local port killed..." % (self.name))
+        if killed: logger.debug("[%s] Local port killed..." % (self.name))
 
     def start_local_port(self):
-        socat_command = "/usr/bin/socat pty,link=%s,echo=0,raw,waitslave,group=dialout,mode=660 tcp:%s:%s" % (self.local_port, self.remote_ip, self.remote_port)
-        sh_command = "while true; do %s; done" % (socat_command)
-        subprocess.Popen(sh_command, stderr=subprocess.PIPE, shell=True)
+        self.bridge.start(self.name, self.local_port, self.remote_ip, self.remote_port)
         self.local_socat_status = "true"
         logger.debug("[%s] Local port started..." % (self.name))
         self.set_binding_status(True)
 
     def set_binding_status(self, status):
         self.start_binding = status
-        NodeController.handle_binding(self.name)
+        NodeController.handle_binding(self.name, status)
+
+    def get_health_stats(self):
+        return self.health.get_stats()
 
     def delete(self):
-        self.client.loop_stop()
+        self.health.cancel()
+        if self.probing:
+            self.connection_manager.unwatch(self.name)
+        for topic in self.__get_topics():
+            self.session.unsubscribe(topic)
+        self.session.remove_handlers(self.name)
+
+    def __get_topics(self):
+        return ["{0}/{1}/{2}".format(self.prefix, self.name, attribute)
+                for attribute in ("$online", "$localip", "socat/port", "socat/status")]
+
+
+def register_metrics():
+    def get_bridges_status():
+        return dict((name, Node.bridge.status(name)) for name in Node.bridge.get_names())
+
+    def get_nodes_health():
+        return dict((name, node.get_health_stats()) for name, node in NodeController.active_nodes.items())
+
+    mH.gauge("zwave_nodes_active", "Active Z-Wave nodes").set_function(lambda: len(NodeController.active_nodes))
+    mH.gauge("zwave_nodes_healthy", "Active Z-Wave nodes evaluated as healthy").set_function(
+        lambda: sum(1 for stats in get_nodes_health().values() if stats["healthy"]))
+    mH.gauge("zwave_node_flaps", "Health flaps by node", ["node"]).set_function(
+        lambda: dict(((name,), stats["flaps"]) for name, stats in get_nodes_health().items()))
+    mH.gauge("zwave_node_suppressed", "Whether the node is suppressed for flapping", ["node"]).set_function(
+        lambda: dict(((name,), int(stats["suppressed"])) for name, stats in get_nodes_health().items()))
+    mH.gauge("zwave_bridges_running", "Running serial bridges").set_function(
+        lambda: sum(1 for status in get_bridges_status().values() if status and status["running"]))
+    mH.gauge("zwave_bridge_uptime_seconds", "Serial bridge uptime by node", ["node"]).set_function(
+        lambda: dict(((name,), status["uptime"]) for name, status in get_bridges_status().items() if status))
+    mH.gauge("zwave_bridge_restarts", "Serial bridge restarts by node", ["node"]).set_function(
+        lambda: dict(((name,), status["restarts"]) for name, status in get_bridges_status().items() if status))
+    mH.gauge("scheduler_pending_timers", "Timers pending on the shared scheduler").set_function(
+        lambda: len(get_scheduler().pending()))
 
 
 def load_configuration(config_file=None):
@@ -604,9 +577,27 @@ if __name__ == '__main__':
             logger.error("[Main] You must run this script as root")
             sys.exit("You must run this script as root")
 
-        logger.info("[Main] Starting zwave-socat-controller program...")
+        parser = argparse.ArgumentParser(description="Z-Wave socat nodes controller for openHAB")
+        parser.add_argument("command", nargs="?", choices=["run", "prestage"], default="run",
+                            help="'prestage' downloads every binding and HABmin version to the artifact cache")
+        parser.add_argument("--mirror", help="folder where the pre-staged artifacts are also copied as a mirror")
+        args = parser.parse_args()
 
         config = load_configuration()
+        fast_start = config.get("FAST_START", True)
+        catalog_source = config.get("CATALOG_SOURCE", "github")
+        artifact_mirrors = config.get("ARTIFACT_MIRRORS", "").split(",")
+        spare_serial_ports = config.get("SPARE_SERIAL_PORTS", 2)
+
+        if args.command == "prestage":
+            logger.info("[Main] Pre-staging artifacts...")
+            stager = ArtifactStager(fast_start=False, catalog_source=catalog_source, artifact_mirrors=artifact_mirrors)
+            staged, total = stager.prestage(args.mirror)
+            print("{} of {} artifacts pre-staged".format(staged, total))
+            sys.exit(0 if staged == total else 1)
+
+        logger.info("[Main] Starting zwave-socat-controller program...")
+        start_time = time.time()
 
         if config["DEBUG"]:
             logger.setLevel(logging.DEBUG)
@@ -621,18 +612,47 @@ if __name__ == '__main__':
 
         nH.send_notification({"text": "Zwave-socat-controller program has started"})
 
+        Node.health_parameters = {"up_delay": config.get("HEALTH_UP_DELAY", HealthEvaluator.UP_DELAY),
+                                  "down_delay": config.get("HEALTH_DOWN_DELAY", HealthEvaluator.DOWN_DELAY),
+                                  "half_life": config.get("HEALTH_HALF_LIFE", HealthEvaluator.HALF_LIFE),
+                                  "suppress_threshold": config.get("HEALTH_SUPPRESS_THRESHOLD", HealthEvaluator.SUPPRESS_THRESHOLD),
+                                  "reuse_threshold": config.get("HEALTH_REUSE_THRESHOLD", HealthEvaluator.REUSE_THRESHOLD),
+                                  "max_suppress_time": config.get("HEALTH_MAX_SUPPRESS_TIME", HealthEvaluator.MAX_SUPPRESS_TIME)}
+
+        if config.get("BRIDGE_ENGINE", "socat") == "builtin":
+            logger.info("[Main] Using the built-in bridge engine")
+            Node.bridge = BridgeEngine(config.get("BRIDGE_FRAME_INSPECTION", False))
+        elif config.get("BRIDGE_FRAME_INSPECTION", False):
+            logger.warning("[Main] Frame inspection needs the built-in bridge engine, it is disabled with socat")
+
+        if config.get("LINK_PROBING_ENABLED", True):
+            Node.connection_manager = ConnectionManager()
+            Node.bridge.on_link_change = NodeController.handle_link
+
+        if config.get("METRICS_ENABLED", False):
+            register_metrics()
+            mH.start_server(config.get("METRICS_PORT", 9105))
+
         if config["AUTODISCOVERY_ENABLED"]:
             logger.info("[Main] Autodiscovery mode enabled, searching for nodes...")
-            nc = NodeController(mqtt_params, config["MQTT_HOMIE_PREFIX"], config["OPENHAB_CONTROL_ENABLED"])
+            nc = NodeController(mqtt_params, config["MQTT_HOMIE_PREFIX"], config["OPENHAB_CONTROL_ENABLED"], fast_start, catalog_source, artifact_mirrors, spare_serial_ports)
         else:
             zwave_networks = config["ZWAVE_NETWORKS"].split(",") if config["ZWAVE_NETWORKS"] != "" else []
             logger.info("[Main] Manual mode enabled for: {}".format(zwave_networks))
+            NodeController.openhab_control_enabled = config["OPENHAB_CONTROL_ENABLED"]
             if config["OPENHAB_CONTROL_ENABLED"]:
-                zbh = ZWaveBindingsHandler()
-                zbh.update(zwave_networks)
+                zbh = ZWaveBindingsHandler(fast_start=fast_start, catalog_source=catalog_source, artifact_mirrors=artifact_mirrors,
+                                           spare_serial_ports=spare_serial_ports)
+                NodeController.orchestrator = BindingOrchestrator(zbh.oh)
+                if fast_start:
+                    get_scheduler().call_later(0, zbh.update, zwave_networks, name="bindings-update", blocking=True)
+                else:
+                    zbh.update(zwave_networks)
+            session = MqttSession(mqtt_params, config["MQTT_HOMIE_PREFIX"])
             for network in zwave_networks:
-                Node(network, mqtt_params, config["MQTT_HOMIE_PREFIX"], config["OPENHAB_CONTROL_ENABLED"])
+                NodeController.active_nodes[network] = Node(network, session, config["MQTT_HOMIE_PREFIX"])
 
+        logger.info("[Main] Startup completed in {:.0f} ms".format((time.time()-start_time)*1000))
         signal.pause()
     except KeyboardInterrupt:
         logger.info("[Main] Stopping the script manually...")